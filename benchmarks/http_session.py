@@ -0,0 +1,64 @@
+"""
+Compares the request rate of one-off requests.get calls against a pooled keep-alive session.
+
+Starts a local mock server on a random port, so no Gitlab or JIRA instance is needed:
+
+    python benchmarks/http_session.py [request_count]
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from http_transport import create_session  # noqa: E402
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so the server keeps connections open between requests
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, avoid the delayed-ACK stall on reused connections
+    disable_nagle_algorithm = True
+    body = json.dumps([{"id": i, "title": f"Issue {i}", "labels": []} for i in range(20)]).encode("utf-8")
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _measure(get, url, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        get(url).raise_for_status()
+    return count / (time.perf_counter() - start)
+
+
+def main(count=500):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/api/v4/projects/1/issues"
+
+    try:
+        without_session = _measure(requests.get, url, count)
+        with create_session() as session:
+            with_session = _measure(session.get, url, count)
+    finally:
+        server.shutdown()
+
+    print(f"requests.get:    {without_session:8.1f} req/s")
+    print(f"pooled session:  {with_session:8.1f} req/s ({with_session / without_session:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
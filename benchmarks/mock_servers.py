@@ -0,0 +1,377 @@
+"""
+In-process mock Gitlab and JIRA servers for the benchmarks, serving a synthetic dataset.
+
+Only the endpoints the sync uses are implemented. Both servers can add a fixed latency to every request, and
+answer with 429 and `Retry-After` once a client exceeds `rate_limit` requests per second. Gitlab list endpoints
+page with `X-Next-Page` and `Link` headers, and the GraphQL issue and epic listings by cursor; the JIRA search pages
+by `startAt`.
+"""
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+ISSUE_TYPE_LABELS = {"type::bug": "Bug", "type::story": "Story", "type::task": "Task"}
+STATUS_LABELS = {"status::todo": "To Do", "status::doing": "In Progress", "status::done": "Done"}
+SYNC_LABEL = "sync"
+
+# the config the synthetic items are labelled for
+CONFIG = {
+    "gitlab_to_jira": {
+        "jira_project_key": "BENCH",
+        "rules": [{"type": "label_to_issue_type", "label": label, "issue_type": issue_type}
+                  for label, issue_type in ISSUE_TYPE_LABELS.items()] +
+                 [{"type": "label_to_status", "label": label, "status": status}
+                  for label, status in STATUS_LABELS.items()],
+        "filters": [{"issue_type": "non-epic", "label": SYNC_LABEL}, {"issue_type": "epic", "label": None}],
+        "epic_link_field": "parent"
+    }
+}
+
+GROUP = "bench-group"
+PROJECT = "bench-project"
+GROUP_ID = 100
+PROJECT_ID = 200
+
+_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class Dataset:
+    """
+    Synthetic Gitlab epics and issues. Items are labelled so that most of them pass the filters and map to an issue
+    type and status; each has a distinct `updated_at`, in ID order. Most issues belong to an epic.
+    """
+
+    def __init__(self, issues=1000, epics=1000, seed=42):
+        self.random = random.Random(seed)
+        self.clock = 0
+        self.epics = [self._item(i + 1, "epic") for i in range(epics)]
+        self.issues = [self._item(epics + i + 1, "issue") for i in range(issues)]
+        # epic IID => issues of the epic, drawn separately so the items stay the same as without epics
+        membership = random.Random(seed + 1)
+        self.epic_issues = {}
+        for issue in self.issues:
+            if self.epics and membership.random() < 0.8:
+                self.epic_issues.setdefault(membership.choice(self.epics)["iid"], []).append(issue)
+        self._lock = threading.Lock()
+
+    def _item(self, item_id, kind):
+        labels = [SYNC_LABEL] if self.random.random() < 0.9 else []
+        if kind == "issue":
+            labels.append(self.random.choice(list(ISSUE_TYPE_LABELS)))
+            labels.append(self.random.choice(list(STATUS_LABELS)))
+        item = {
+            "id": item_id,
+            "iid": item_id,
+            "title": f"{kind.capitalize()} {item_id}",
+            "description": f"Synthetic {kind} {item_id} " + "lorem ipsum " * self.random.randint(0, 40),
+            "labels": labels,
+            "state": "opened",
+            "updated_at": self._tick()
+        }
+        item["group_id" if kind == "epic" else "project_id"] = GROUP_ID if kind == "epic" else PROJECT_ID
+        return item
+
+    def _tick(self):
+        self.clock += 1
+        return (_START + timedelta(seconds=self.clock)).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+    def touch(self, fraction, kind="issue"):
+        """
+        Changes the title of a random share of the items and moves them to the end of the update order, like
+        edits made between two incremental runs
+        :return: number of changed items
+        """
+        with self._lock:
+            items = self.epics if kind == "epic" else self.issues
+            touched = self.random.sample(items, max(1, int(len(items) * fraction)))
+            for item in touched:
+                item["title"] += " (edited)"
+                item["updated_at"] = self._tick()
+            items.sort(key=lambda item: item["updated_at"])
+            return len(touched)
+
+
+class _RateLimiter:
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._allowance = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        """
+        :return: None if the request is allowed, otherwise the seconds until it would be
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._allowance >= 1:
+                self._allowance -= 1
+                return None
+            return (1 - self._allowance) / self.rate
+
+
+class MockServer:
+    """
+    Base class of the mock servers: runs a ThreadingHTTPServer on a free port in a background thread and routes
+    requests to `route(method, path, query, body)`, which returns (status, body, headers)
+    """
+
+    def __init__(self, latency=0.0, rate_limit=None):
+        self.latency = latency
+        self.limiter = _RateLimiter(rate_limit) if rate_limit else None
+        self.requests = 0
+        self.throttled = 0
+        self._counter_lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def route(self, method, path, query, body):
+        raise NotImplementedError
+
+    def _handle(self, handler, method):
+        with self._counter_lock:
+            self.requests += 1
+        length = int(handler.headers.get("Content-Length") or 0)
+        raw = handler.rfile.read(length) if length else b""
+
+        if self.limiter is not None:
+            retry_after = self.limiter.retry_after()
+            if retry_after is not None:
+                with self._counter_lock:
+                    self.throttled += 1
+                handler.send_response(429)
+                handler.send_header("Retry-After", f"{retry_after:.3f}")
+                handler.send_header("Content-Length", "0")
+                handler.end_headers()
+                return
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        url = urlsplit(handler.path)
+        status, body, headers = self.route(method, unquote(url.path), dict(parse_qsl(url.query)),
+                                           json.loads(raw) if raw else None)
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, as the real servers do
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                server._handle(self, "GET")
+
+            def do_POST(self):
+                server._handle(self, "POST")
+
+            def do_PUT(self):
+                server._handle(self, "PUT")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class MockGitlab(MockServer):
+
+    def __init__(self, dataset: Dataset, latency=0.0, rate_limit=None, max_per_page=100):
+        super().__init__(latency=latency, rate_limit=rate_limit)
+        self.dataset = dataset
+        self.max_per_page = max_per_page
+
+    def route(self, method, path, query, body):
+        if method == "GET" and path in (f"/api/v4/projects/{GROUP}/{PROJECT}", f"/api/v4/projects/{PROJECT_ID}"):
+            return 200, {"id": PROJECT_ID, "name": PROJECT, "path": PROJECT,
+                         "path_with_namespace": f"{GROUP}/{PROJECT}"}, None
+        if method == "GET" and path == f"/api/v4/groups/{GROUP}/epics":
+            return self._page(self.dataset.epics, path, query)
+        if method == "GET" and path in (f"/api/v4/projects/{PROJECT_ID}/issues",):
+            return self._page(self.dataset.issues, path, query)
+        if method == "POST" and path == "/api/graphql":
+            return self._graphql(body["query"], body.get("variables") or {})
+
+        match = re.fullmatch(rf"/api/v4/groups/(?:{GROUP}|{GROUP_ID})/epics/(\d+)/issues", path)
+        if method == "GET" and match:
+            return self._page(self.dataset.epic_issues.get(int(match.group(1)), []), path, query)
+
+        match = re.fullmatch(r"/api/v4/(?:projects/\d+/issues|groups/[^/]+/epics)/(\d+)", path)
+        if method == "PUT" and match:
+            return self._update(int(match.group(1)), body or {})
+
+        return 404, {"message": "404 Not Found"}, None
+
+    def _page(self, items, path, query):
+        updated_after = query.get("updated_after")
+        if updated_after:
+            # items are kept in update order, so the changed ones are a suffix
+            items = [item for item in items if item["updated_at"] >= updated_after]
+        per_page = min(int(query.get("per_page", 20)), self.max_per_page)
+        page = int(query.get("page", 1))
+        selected = items[(page - 1) * per_page:page * per_page]
+
+        headers = {}
+        if page * per_page < len(items):
+            headers["X-Next-Page"] = str(page + 1)
+            next_query = "&".join(f"{k}={v}" for k, v in dict(query, page=page + 1).items())
+            headers["Link"] = f'<{self.url}{path}?{next_query}>; rel="next"'
+        return 200, selected, headers
+
+    def _graphql(self, query, variables):
+        # only the two listing queries of GitlabApi are understood
+        if "project(fullPath" in query:
+            root, connection, kind, items = "project", "issues", "Issue", self.dataset.issues
+            parent_id = f"gid://gitlab/Project/{PROJECT_ID}"
+        else:
+            root, connection, kind, items = "group", "epics", "Epic", self.dataset.epics
+            parent_id = f"gid://gitlab/Group/{GROUP_ID}"
+
+        updated_after = variables.get("updatedAfter")
+        if updated_after:
+            items = [item for item in items if item["updated_at"] >= updated_after]
+        per_page = int(re.search(r"first: (\d+)", query).group(1))
+        start = int(variables.get("after") or 0)
+        selected = items[start:start + per_page]
+
+        nodes = [{
+            "id": f"gid://gitlab/{kind}/{item['id']}",
+            "iid": str(item["iid"]),
+            "title": item["title"],
+            "description": item["description"],
+            "state": item["state"],
+            "updatedAt": item["updated_at"].replace(".000Z", "Z"),
+            "labels": {"nodes": [{"title": label} for label in item["labels"]]}
+        } for item in selected]
+        if kind == "Epic":
+            for node, item in zip(nodes, selected):
+                node["group"] = {"id": f"gid://gitlab/Group/{item['group_id']}"}
+        page_info = {"hasNextPage": start + per_page < len(items), "endCursor": str(start + per_page)}
+        return 200, {"data": {root: {"id": parent_id, connection: {"pageInfo": page_info, "nodes": nodes}}}}, None
+
+    def _update(self, item_id, fields):
+        for item in self.dataset.epics + self.dataset.issues:
+            if item["id"] == item_id:
+                if "title" in fields:
+                    item["title"] = fields["title"]
+                labels = [label for label in item["labels"]
+                          if label not in (fields.get("remove_labels") or "").split(",")]
+                if fields.get("add_labels"):
+                    labels += fields["add_labels"].split(",")
+                item["labels"] = labels
+                return 200, item, None
+        return 404, {"message": "404 Not Found"}, None
+
+
+class MockJira(MockServer):
+    """
+    JIRA with a workflow in which every status can move to every other status
+    """
+
+    STATUSES = ["To Do", "In Progress", "Done"]
+
+    def __init__(self, latency=0.0, rate_limit=None, max_results=100):
+        super().__init__(latency=latency, rate_limit=rate_limit)
+        self.max_results = max_results
+        self.issues = {}
+        self._lock = threading.Lock()
+
+    def route(self, method, path, query, body):
+        if method == "POST" and path == "/rest/api/2/issue":
+            return 201, self._create(body["fields"]), None
+        if method == "POST" and path == "/rest/api/2/issue/bulk":
+            return 201, {"issues": [self._create(update["fields"]) for update in body["issueUpdates"]],
+                         "errors": []}, None
+        if method == "GET" and path == "/rest/api/2/search":
+            return self._search(query)
+        if method == "GET" and path == "/rest/api/2/myself":
+            return 200, {"timeZone": "UTC"}, None
+
+        match = re.fullmatch(r"/rest/api/2/issue/([A-Z]+-\d+)(/transitions)?", path)
+        issue = self.issues.get(match.group(1)) if match else None
+        if issue is None:
+            return 404, {"errorMessages": ["Issue does not exist"]}, None
+
+        if method == "GET" and not match.group(2):
+            data = self._json(issue)
+            if query.get("expand") == "transitions":
+                data["transitions"] = [{"id": str(i), "to": {"name": status}}
+                                       for i, status in enumerate(self.STATUSES) if status != issue["status"]]
+            return 200, data, None
+        if method == "PUT" and not match.group(2):
+            fields = body["fields"]
+            if "summary" in fields:
+                issue["summary"] = fields["summary"]
+            if "parent" in fields:
+                issue["parent"] = (fields["parent"] or {}).get("key")
+            issue["updated"] = self._now()
+            return 204, None, None
+        if method == "POST" and match.group(2):
+            issue.update(status=self.STATUSES[int(body["transition"]["id"])], updated=self._now())
+            return 204, None, None
+        return 405, None, None
+
+    def _create(self, fields):
+        with self._lock:
+            key = f"{fields['project']['key']}-{len(self.issues) + 1}"
+            self.issues[key] = {"key": key, "summary": fields["summary"], "status": self.STATUSES[0],
+                                "issuetype": fields["issuetype"]["name"], "updated": self._now(),
+                                "parent": (fields.get("parent") or {}).get("key")}
+        return {"key": key}
+
+    def _search(self, query):
+        issues = list(self.issues.values())
+        keys = re.search(r"key in \(([^)]*)\)", query.get("jql", ""))
+        if keys:
+            wanted = {key.strip() for key in keys.group(1).split(",")}
+            issues = [issue for issue in issues if issue["key"] in wanted]
+        start = int(query.get("startAt", 0))
+        count = min(int(query.get("maxResults", 50)), self.max_results)
+        return 200, {"startAt": start, "maxResults": count, "total": len(issues),
+                     "issues": [self._json(issue) for issue in issues[start:start + count]]}, None
+
+    @staticmethod
+    def _json(issue):
+        return {"key": issue["key"], "fields": {"summary": issue["summary"], "status": {"name": issue["status"]},
+                                                "issuetype": {"name": issue["issuetype"]}, "updated": issue["updated"]}}
+
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000+0000")
@@ -0,0 +1,229 @@
+"""
+Times full and incremental runs of Synchronizer.sync_epics and sync_issues against in-process mock Gitlab and JIRA
+servers, as well as mapping lookups and rule evaluation, on synthetic datasets.
+
+Each run is appended to a results file together with the commit and the parameters, and compared against the
+previous run with the same parameters, so regressions show up between versions:
+
+    python benchmarks/sync_benchmark.py --sizes 1000,10000,100000 --latency 5 --workers 8
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config_reader import Config  # noqa: E402
+from gitlab_api import GitlabApi  # noqa: E402
+from http_transport import Transport  # noqa: E402
+from issue_mapping import IssueMapper  # noqa: E402
+from jira_api import JiraApi  # noqa: E402
+from mapping_store import SqliteMappingStore, import_csv  # noqa: E402
+from mock_servers import CONFIG, GROUP, PROJECT, Dataset, MockGitlab, MockJira  # noqa: E402
+from synchronizer import Synchronizer  # noqa: E402
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+# share of the items changed between the full and the incremental run
+TOUCHED = 0.01
+
+
+def run_size(size, args, workdir):
+    """
+    Runs all scenarios on a dataset of `size` epics and `size` issues
+    :return: dictionary of scenario name => measurements
+    """
+    dataset = Dataset(issues=size, epics=size)
+    results = {}
+
+    config_path = os.path.join(workdir, "config.json")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(CONFIG, f)
+    config = Config(config_path)
+
+    csv_path = os.path.join(workdir, f"mapping_{size}.csv")
+    latency = args.latency / 1000.0
+
+    with MockGitlab(dataset, latency=latency, rate_limit=args.rate_limit) as gitlab, \
+            MockJira(latency=latency, rate_limit=args.rate_limit) as jira:
+        pool_size = max(args.workers, 10)
+        jira_api = JiraApi(jira.url, "token", transport=Transport(pool_size=pool_size, backoff_base=0.05))
+        gitlab_api = GitlabApi(gitlab.url, "token", transport=Transport(pool_size=pool_size, backoff_base=0.05),
+                               graphql=args.graphql)
+        mapper = IssueMapper(csv_path, batch_size=1000)
+
+        def sync_run(name, kind, incremental):
+            sync = Synchronizer(jira_api, gitlab_api, GROUP, PROJECT, config, mapper=mapper,
+                                incremental=incremental, workers=args.workers, bulk_create=args.bulk_create)
+            sync.max_epics_created = sync.max_issues_created = sys.maxsize
+            requests_before = gitlab.requests + jira.requests
+            start = time.perf_counter()
+            counts = sync.sync_epics() if kind == "epics" else sync.sync_issues()
+            mapper.flush()
+            seconds = time.perf_counter() - start
+            results[name] = {
+                "seconds": seconds,
+                "items": counts["retrieved"],
+                "items_per_second": counts["retrieved"] / seconds if seconds else None,
+                "requests": gitlab.requests + jira.requests - requests_before
+            }
+
+        for kind in ("epics", "issues"):
+            sync_run(f"{kind}_full", kind, incremental=False)
+            dataset.touch(TOUCHED, kind="epic" if kind == "epics" else "issue")
+            sync_run(f"{kind}_incremental", kind, incremental=True)
+
+        results["throttled_requests"] = {"count": gitlab.throttled + jira.throttled}
+        mapper.close()
+        jira_api.close()
+        gitlab_api.close()
+
+    results["mapping_lookups_csv"] = _time_lookups(IssueMapper(csv_path), dataset)
+    db_path = os.path.join(workdir, f"mapping_{size}.db")
+    store = SqliteMappingStore(db_path)
+    import_csv(csv_path, store)
+    results["mapping_lookups_sqlite"] = _time_lookups(IssueMapper(store=store), dataset)
+    store.close()
+
+    results["rule_evaluation"] = _time_rules(config, dataset)
+    return results
+
+
+def _time_lookups(mapper, dataset):
+    items = [("epic", item["id"]) for item in dataset.epics] + [("issue", item["id"]) for item in dataset.issues]
+    random.Random(1).shuffle(items)
+
+    start = time.perf_counter()
+    jira_issues = [mapper.get_jira_issue(gitlab_issue=item_id, type=type) for type, item_id in items]
+    forward = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for jira_issue in jira_issues:
+        if jira_issue is not None:
+            mapper.get_gitlab_issue(jira_issue)
+    reverse = time.perf_counter() - start
+
+    return {"lookups": len(items), "seconds": forward + reverse, "forward_seconds": forward,
+            "reverse_seconds": reverse}
+
+
+def _time_rules(config, dataset):
+    start = time.perf_counter()
+    for item in dataset.issues:
+        if config.is_synchronizable(item["labels"], "non-epic"):
+            config.get_issue_type(item["labels"])
+            config.get_status(item["labels"])
+    for item in dataset.epics:
+        config.is_synchronizable(item["labels"], "epic")
+    seconds = time.perf_counter() - start
+    items = len(dataset.issues) + len(dataset.epics)
+    return {"items": items, "seconds": seconds, "items_per_second": items / seconds if seconds else None}
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _previous(output, params):
+    """
+    :return: the last recorded run with the same parameters, or None
+    """
+    if not os.path.exists(output):
+        return None
+    previous = None
+    with open(output, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("params") == params:
+                previous = record
+    return previous
+
+
+def _report(record, previous, threshold):
+    regressions = 0
+    print(f"{'scenario':<36}{'seconds':>10}{'items/s':>12}{'requests':>10}{'change':>10}")
+    for size, scenarios in record["results"].items():
+        for name, result in scenarios.items():
+            if "seconds" not in result:
+                print(f"{name + '@' + size:<36}{result['count']:>10}")
+                continue
+            line = f"{name + '@' + size:<36}{result['seconds']:>10.3f}"
+            rate = result.get("items_per_second")
+            line += f"{rate:>12.0f}" if rate else f"{'':>12}"
+            line += f"{result['requests']:>10}" if "requests" in result else f"{'':>10}"
+
+            before = (previous or {}).get("results", {}).get(size, {}).get(name, {}).get("seconds")
+            if before:
+                change = (result["seconds"] - before) / before
+                line += f"{change:>+10.0%}"
+                if change > threshold:
+                    line += "  REGRESSION"
+                    regressions += 1
+            print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000",
+                        help="comma separated numbers of epics and of issues, e.g. 1000,10000,100000")
+    parser.add_argument("--latency", type=float, default=0.0, help="latency added to every request, in ms")
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests per second each server allows")
+    parser.add_argument("--workers", type=int, default=4, help="items synced concurrently")
+    parser.add_argument("--bulk-create", action="store_true", help="create JIRA issues through the bulk endpoint")
+    parser.add_argument("--graphql", action="store_true", help="list Gitlab items through the GraphQL API")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="results file, one JSON record per run")
+    parser.add_argument("--no-record", action="store_true", help="compare against the results without appending")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="slowdown against the previous run reported as a regression, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    params = {
+        "sizes": [int(size) for size in args.sizes.split(",")],
+        "latency_ms": args.latency,
+        "rate_limit": args.rate_limit,
+        "workers": args.workers,
+        "bulk_create": args.bulk_create,
+        "graphql": args.graphql
+    }
+
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": {}
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in params["sizes"]:
+            record["results"][str(size)] = run_size(size, args, workdir)
+
+    regressions = _report(record, _previous(args.output, params), args.threshold)
+
+    if not args.no_record:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"Results appended to {args.output}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+import hashlib
+import logging
+import re
+import tempfile
+from collections import Counter
+from urllib.parse import unquote
+
+from synchronizer import OUTCOME_FAILED, OUTCOME_SKIPPED, OUTCOME_UNCHANGED, OUTCOME_UPDATED, Synchronizer
+
+logger = logging.getLogger(__name__)
+
+# Markdown link or image of a file uploaded to Gitlab, e.g. `![screenshot](/uploads/<secret>/screenshot.png)`
+UPLOAD_LINK = re.compile(r"(!?)\[([^\]]*)\]\((/uploads/([0-9a-f]{32})/([^)\s]+))\)")
+# marker closing every copied comment, by which a note is recognized when it was posted but not recorded
+NOTE_MARKER = re.compile(r"\(Gitlab note (\d+)\)")
+# uploads are kept in memory up to this size while they are hashed, and spooled to a temporary file beyond
+SPOOL_SIZE = 1024 * 1024
+
+
+class CommentSync:
+    """
+    Copies the comments of synced Gitlab items to their JIRA issues, together with the files uploaded to Gitlab that
+    the comments link.
+
+    Items are listed like a Gitlab => JIRA sync, oldest change first and from the `comments:` watermarks when
+    incremental; a new note changes the `updated_at` of its item. Per item, notes are read newest first down to the
+    last one copied, which is kept as `note_id` in the sync state, and posted oldest first. System notes are skipped.
+
+    Each comment ends with a marker naming its note. Before posting, the latest comments of the JIRA issue are checked
+    for the markers, so a note posted by a run which failed before recording it is not posted twice. Uploads are
+    streamed from Gitlab into a spooled temporary file while their SHA-256 is computed, and attached to JIRA from there
+    unless the issue already has the same content, either recorded in the mapping store or found among the issue's
+    attachments with the same name and size.
+    """
+
+    def __init__(self, synchronizer: Synchronizer, attachments=True):
+        """
+        :param synchronizer: provides the API clients, mapper, group/project and run machinery
+        :param attachments: also attach the files linked from comments; links are kept as they are otherwise
+        """
+        self.sync = synchronizer
+        self.attachments = attachments
+
+    def run(self, include_epics=True, include_issues=True):
+        """
+        :return: Counter of item outcomes, plus the number of retrieved items under "retrieved"
+        """
+        counts = Counter()
+        if include_epics:
+            counts += self._run("epic")
+        if include_issues and self.sync.gitlab_project is not None:
+            counts += self._run("issue")
+        logger.info("Comments copied for %d items, unchanged: %d, failed: %d",
+                    counts[OUTCOME_UPDATED], counts[OUTCOME_UNCHANGED], counts[OUTCOME_FAILED])
+        return counts
+
+    def _run(self, type):
+        sync = self.sync
+        watermark_name = "comments:" + (sync.epics_watermark if type == "epic" else sync.issues_watermark)
+        watermark, since = sync._start(watermark_name)
+
+        if type == "epic":
+            items = sync.gitlab_api.iter_epics(group_id=sync.gitlab_group, params=sync.fetch_params(since), lean=True)
+        else:
+            items = sync.gitlab_api.iter_issues(group_name=sync.gitlab_group, project_name=sync.gitlab_project,
+                                                params=sync.fetch_params(since), lean=True)
+
+        counts = sync._run(items, lambda item: self.sync_item(type, item), watermark, kind="comments",
+                           checkpoint=watermark_name)
+        sync._finish(watermark_name, watermark)
+        sync.mapper.flush()
+        return counts
+
+    def sync_item(self, type, item):
+        """
+        Posts the notes of a Gitlab item added since the last run as comments of its JIRA issue
+        :param type: "epic" or "issue"
+        :param item: Gitlab item
+        :return: outcome of the sync, one of the OUTCOME_* constants
+        """
+        mapper = self.sync.mapper
+        jira_issue = mapper.get_jira_issue(gitlab_issue=item["id"], type=type)
+        if jira_issue is None:
+            return OUTCOME_SKIPPED
+
+        state = mapper.get_sync_state(item["id"], type) or {}
+        try:
+            notes = self._new_notes(type, item, state.get("note_id"))
+            if not notes:
+                return OUTCOME_UNCHANGED
+
+            posted = None
+            for note in notes:
+                if not note.get("system"):
+                    if posted is None:
+                        posted = self._posted_notes(jira_issue)
+                    if note["id"] not in posted:
+                        if self.sync.jira_api.add_comment(jira_issue, self._comment(type, item, jira_issue,
+                                                                                    note)) is None:
+                            return OUTCOME_FAILED
+                        self.sync.metrics.count("comments_total")
+                mapper.set_sync_state(item["id"], type, note_id=note["id"])
+        except Exception as e:
+            logger.warning("Failed to copy comments of Gitlab %s %s to %s: %s", type, item["id"], jira_issue, e)
+            return OUTCOME_FAILED
+        return OUTCOME_UPDATED
+
+    def _new_notes(self, type, item, last_note_id):
+        """
+        :return: the notes of the item after `last_note_id`, oldest first
+        """
+        params = {"order_by": "created_at", "sort": "desc"}
+        if type == "epic":
+            notes = self.sync.gitlab_api.iter_epic_notes(item["group_id"], item["id"], params=params)
+        else:
+            notes = self.sync.gitlab_api.iter_issue_notes(item["project_id"], item["iid"], params=params)
+
+        new = []
+        try:
+            for note in notes:
+                # note IDs grow with creation, so the pages older than the last copied note are never fetched
+                if last_note_id is not None and note["id"] <= last_note_id:
+                    break
+                new.append(note)
+        finally:
+            notes.close()
+        new.reverse()
+        return new
+
+    def _posted_notes(self, jira_issue):
+        """
+        :return: IDs of the notes named by the markers of the latest comments of the JIRA issue
+        """
+        posted = set()
+        for comment in self.sync.jira_api.get_comments(jira_issue):
+            posted.update(int(note_id) for note_id in NOTE_MARKER.findall(comment.get("body") or ""))
+        return posted
+
+    def _comment(self, type, item, jira_issue, note):
+        """
+        :return: JIRA comment text of a note, with links to Gitlab uploads pointing to the attached files
+        """
+        body = note.get("body") or ""
+        if self.attachments:
+            def attach(match):
+                image, secret, filename = match.group(1), match.group(4), match.group(5)
+                name = self._attach(type, item, jira_issue, secret, filename)
+                return f"!{name}!" if image else f"[^{name}]"
+
+            body = UPLOAD_LINK.sub(attach, body)
+
+        author = (note.get("author") or {}).get("name", "unknown")
+        return f"{body}\n\n----\n_{author} in Gitlab, {note.get('created_at')} (Gitlab note {note['id']})_"
+
+    def _attach(self, type, item, jira_issue, secret, filename):
+        """
+        Attaches a Gitlab upload to the JIRA issue unless the issue already has it
+        :return: file name of the attachment in JIRA
+        """
+        mapper = self.sync.mapper
+        source = f"{secret}/{filename}"
+        attachment = mapper.get_attachment(jira_issue, source=source)
+        if attachment is not None:
+            return attachment["filename"]
+
+        kind, parent_id = ("groups", item["group_id"]) if type == "epic" else ("projects", item["project_id"])
+        name = unquote(filename)
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+            digest, size = hashlib.sha256(), 0
+            for chunk in self.sync.gitlab_api.iter_upload(kind, parent_id, secret, filename):
+                digest.update(chunk)
+                spool.write(chunk)
+                size += len(chunk)
+            content_hash = digest.hexdigest()
+
+            attachment = mapper.get_attachment(jira_issue, content_hash=content_hash)
+            if attachment is not None:
+                attachment_id, name = attachment["attachment_id"], attachment["filename"]
+                result = "deduplicated"
+            else:
+                found = self._find_attachment(jira_issue, name, size, content_hash)
+                if found is not None:
+                    attachment_id, name = found["id"], found["filename"]
+                    result = "deduplicated"
+                else:
+                    created = self.sync.jira_api.add_attachment(jira_issue, name, spool, size)
+                    attachment_id, name = created["id"], created["filename"]
+                    result = "uploaded"
+                    logger.info("Attached %s (%d bytes) to %s", name, size, jira_issue)
+
+        mapper.add_attachment(jira_issue, source, content_hash, attachment_id, name)
+        self.sync.metrics.count("attachments_total", result=result)
+        return name
+
+    def _find_attachment(self, jira_issue, name, size, content_hash):
+        """
+        Looks for a file attached to the issue but not recorded, e.g. by a run which failed right after the upload.
+        Only attachments with the same name and size are downloaded to compare their content.
+        :return: the attachment dictionary, or None
+        """
+        for attachment in self.sync.jira_api.get_attachments(jira_issue):
+            if attachment.get("filename") != name or attachment.get("size") != size:
+                continue
+            digest = hashlib.sha256()
+            for chunk in self.sync.jira_api.iter_attachment_content(attachment["content"]):
+                digest.update(chunk)
+            if digest.hexdigest() == content_hash:
+                return attachment
+        return None
@@ -1,14 +1,33 @@
 import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigError(Exception):
+    pass
 
 
 class Config:
+    """
+    Reads the sync configuration. Rules and filters are compiled once on load into lookup tables keyed by label, so
+    evaluating an item costs a set intersection with its labels; conflicting rules are rejected up front.
+    """
 
     def __init__(self, filepath):
         self.filepath = filepath
         self.rules = []
         self.jira_project_key = None
         self.filters = []
+        self.jobs = []
+        self.limits = {}
+        self.epic_link_field = None
+        self.issue_type_by_label = {}
+        self.status_by_label = {}
+        self.label_by_status = {}
+        self.required_labels = {}
         self._load_rules()
+        self._compile()
 
     def _load_rules(self):
         try:
@@ -17,12 +36,112 @@ class Config:
                 self.rules = data.get("gitlab_to_jira", {}).get("rules", [])
                 self.filters = data.get("gitlab_to_jira", {}).get("filters", [])
                 self.jira_project_key = data.get("gitlab_to_jira", {}).get("jira_project_key")
+                self.jobs = data.get("gitlab_to_jira", {}).get("jobs", [])
+                self.limits = data.get("gitlab_to_jira", {}).get("limits", {})
+                # "parent" on JIRA Cloud, or the ID of the Epic Link custom field of JIRA Server/Data Center;
+                # issues are not linked to their epic unless set
+                self.epic_link_field = data.get("gitlab_to_jira", {}).get("epic_link_field")
         except (FileNotFoundError, json.JSONDecodeError) as e:
-            print(f"Error loading rules from {self.filepath}: {e}")
+            logger.error("Error loading rules from %s: %s", self.filepath, e)
             self.rules = []
 
+    def _compile(self):
+        issue_type_by_label = {}
+        status_by_label = {}
+        required_labels = {}
+
+        for rule in self.rules:
+            if rule["type"] == "label_to_issue_type":
+                _add_rule(issue_type_by_label, rule["label"], rule["issue_type"], "issue type")
+            elif rule["type"] == "label_to_status":
+                _add_rule(status_by_label, rule["label"], rule["status"], "status")
+            else:
+                logger.warning("Ignoring rule of unknown type '%s' in %s", rule["type"], self.filepath)
+
+        for f in self.filters:
+            if f["label"] is not None:
+                required_labels.setdefault(f["issue_type"], set()).add(f["label"])
+
+        self.issue_type_by_label = issue_type_by_label
+        self.status_by_label = status_by_label
+        # for the JIRA => Gitlab direction, the first label of each status in rule order
+        label_by_status = {}
+        for label, status in status_by_label.items():
+            label_by_status.setdefault(status.lower(), label)
+        self.label_by_status = label_by_status
+        self.required_labels = {issue_type: frozenset(labels) for issue_type, labels in required_labels.items()}
+
     def get_rules(self):
         return self.rules
 
     def get_filters(self):
         return self.filters
+
+    def get_jobs(self):
+        """
+        :return: list of job dictionaries with keys `gitlab_group`, `gitlab_project` and `jira_project_key`;
+                 jobs without their own `jira_project_key` use the top-level one
+        """
+        return [dict(job, jira_project_key=job.get("jira_project_key") or self.jira_project_key) for job in self.jobs]
+
+    def get_limits(self):
+        """
+        :return: dictionary with the maximum number of `create`, `update`, `transition` and `link` writes of a
+                 planned run; missing entries are unlimited
+        """
+        unknown = set(self.limits) - {"create", "update", "transition", "link"}
+        if unknown:
+            raise ConfigError(f"Unknown limits in {self.filepath}: {', '.join(sorted(unknown))}")
+        return dict(self.limits)
+
+    def is_synchronizable(self, labels, issue_type):
+        """
+        :param labels: labels of a Gitlab item
+        :param issue_type: "epic" or "non-epic"
+        :return: True if the item has all labels required by the filters of its type
+        """
+        required = self.required_labels.get(issue_type)
+        return not required or required.issubset(labels)
+
+    def get_issue_type(self, labels):
+        """
+        :return: JIRA issue type the labels map to, or None if no rule applies
+        :raises ConfigError: if the labels map to more than one issue type
+        """
+        return _match(self.issue_type_by_label, labels, "issue type")
+
+    def get_status(self, labels):
+        """
+        :return: JIRA status the labels map to, or None if no rule applies
+        :raises ConfigError: if the labels map to more than one status
+        """
+        return _match(self.status_by_label, labels, "issue status")
+
+    def get_status_label(self, status):
+        """
+        :return: Gitlab label that maps to the JIRA status, or None if no rule maps to it
+        """
+        return self.label_by_status.get(status.lower())
+
+    def get_status_labels(self):
+        """
+        :return: all Gitlab labels that map to a JIRA status
+        """
+        return set(self.status_by_label)
+
+
+def _add_rule(table, label, value, kind):
+    existing = table.get(label)
+    if existing is not None and existing != value:
+        raise ConfigError(f"Conflicting {kind} mapping for label {label}: '{existing}' and '{value}'")
+    table[label] = value
+
+
+def _match(table, labels, kind):
+    matched = table.keys() & set(labels)
+    if not matched:
+        return None
+    values = {table[label] for label in matched}
+    if len(values) > 1:
+        raise ConfigError(f"Duplicate {kind} mapping for labels {', '.join(sorted(matched))}")
+    return values.pop()
@@ -1,14 +1,165 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from urllib.parse import quote, unquote
+
 import requests
 
+from http_cache import ResponseCache
+from http_transport import DEFAULT_POOL_SIZE, Transport
+
+# Gitlab silently caps per_page at 100
+MAX_PER_PAGE = 100
+# bytes read at a time from a streamed upload
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# seconds the subgroups of a group are remembered, subgroups created in the meantime are seen after that
+SUBGROUP_TTL = 600
+
+logger = logging.getLogger(__name__)
+
+# fields of an issue or epic selected by the GraphQL queries, the same ones GitlabItem keeps
+_ITEM_NODE = "id iid title description state updatedAt labels { nodes { title } }"
+
+GRAPHQL_ISSUES = """
+query($path: ID!, $after: String, $updatedAfter: Time, $sort: IssueSort) {
+  project(fullPath: $path) {
+    id
+    issues(first: %d, after: $after, updatedAfter: $updatedAfter, sort: $sort) {
+      pageInfo { hasNextPage endCursor }
+      nodes { %s }
+    }
+  }
+}
+""" % (MAX_PER_PAGE, _ITEM_NODE)
+
+GRAPHQL_EPICS = """
+query($path: ID!, $after: String, $updatedAfter: Time, $sort: EpicSort) {
+  group(fullPath: $path) {
+    epics(first: %d, after: $after, updatedAfter: $updatedAfter, sort: $sort) {
+      pageInfo { hasNextPage endCursor }
+      nodes { %s group { id } }
+    }
+  }
+}
+""" % (MAX_PER_PAGE, _ITEM_NODE)
+
+# GraphQL sort of the REST `order_by` / `sort` parameters the sync uses
+_GRAPHQL_SORTS = {
+    "issue": {("updated_at", "asc"): "UPDATED_ASC", ("updated_at", "desc"): "UPDATED_DESC",
+              ("created_at", "asc"): "CREATED_ASC", ("created_at", "desc"): "CREATED_DESC"},
+    "epic": {("updated_at", "asc"): "UPDATED_AT_ASC", ("updated_at", "desc"): "UPDATED_AT_DESC",
+             ("created_at", "asc"): "CREATED_AT_ASC", ("created_at", "desc"): "CREATED_AT_DESC"}
+}
+
+
+class GitlabItem:
+    """
+    Compact record of the fields the sync reads from a Gitlab issue or epic. Items are read like the dictionaries
+    returned by the REST API (`item["title"]`, `item.get("updated_at")`), so records and dictionaries, e.g. from
+    webhooks, can be synced alike. Label names are interned, as the same few labels repeat on every item.
+    """
+
+    __slots__ = ("id", "iid", "title", "description", "labels", "state", "updated_at", "project_id", "group_id")
+
+    def __init__(self, id, iid, title, description, labels, state=None, updated_at=None, project_id=None,
+                 group_id=None):
+        self.id = id
+        self.iid = iid
+        self.title = title
+        self.description = description
+        self.labels = tuple(sys.intern(label) for label in labels or ())
+        self.state = state
+        self.updated_at = updated_at
+        self.project_id = project_id
+        self.group_id = group_id
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Keeps the synced fields of an item returned by the REST API
+        """
+        return cls(id=data["id"], iid=data.get("iid"), title=data.get("title"), description=data.get("description"),
+                   labels=data.get("labels"), state=data.get("state"), updated_at=data.get("updated_at"),
+                   project_id=data.get("project_id"), group_id=data.get("group_id"))
+
+    @classmethod
+    def from_graphql(cls, node, project_id=None, group_id=None):
+        """
+        Converts an issue or epic node of the GraphQL API, whose IDs are global IDs and timestamps lack
+        milliseconds, to the values the REST API returns
+        """
+        return cls(id=_numeric_id(node["id"]), iid=int(node["iid"]), title=node.get("title"),
+                   description=node.get("description"),
+                   labels=[label["title"] for label in (node.get("labels") or {}).get("nodes", [])],
+                   state=node.get("state"), updated_at=_rest_timestamp(node.get("updatedAt")),
+                   project_id=project_id, group_id=group_id)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __repr__(self):
+        return f"GitlabItem(id={self.id!r}, title={self.title!r})"
+
 
 class GitlabApi:
-    def __init__(self, base_url, access_token):
+    def __init__(self, base_url, access_token, session: requests.Session = None, pool_size=DEFAULT_POOL_SIZE,
+                 transport: Transport = None, cache: ResponseCache = None, id_cache_path=None, graphql=False):
+        """
+        :param graphql: fetch lean item listings through the GraphQL API, which returns only the selected fields,
+                        instead of trimming full REST responses
+        """
         self.base_url = base_url.rstrip('/')  # Ensure no trailing slash
         self.access_token = access_token
         self.headers = {
             "Authorization": f"Bearer {self.access_token}",
             "Content-Type": "application/json"
         }
+        # a session or transport passed in by the caller is shared with other clients and left open by close()
+        self._owns_transport = session is None and transport is None
+        self.transport = transport if transport is not None else Transport(session=session, pool_size=pool_size,
+                                                                           cache=cache)
+        # project and group IDs resolved so far, optionally persisted to id_cache_path
+        self.id_cache_path = id_cache_path
+        self._project_ids = {}
+        self._group_ids = {}
+        self._group_indexes = {}
+        self._full_paths = {}
+        # group key => (time listed, set of subgroup IDs)
+        self._subgroup_ids = {}
+        self._ids_lock = threading.Lock()
+        self._load_ids()
+        self.graphql = graphql
+
+    @property
+    def session(self):
+        return self.transport.session
+
+    def close(self):
+        if self._owns_transport:
+            self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def list_projects(self):
         """
@@ -16,7 +167,7 @@ class GitlabApi:
         :return: List of dictionaries containing project details
         """
         url = f"{self.base_url}/api/v4/projects"
-        response = requests.get(url, headers=self.headers)
+        response = self.transport.get(url, headers=self.headers)
 
         if response.status_code == 200:
             projects = response.json()
@@ -30,13 +181,16 @@ class GitlabApi:
         :param group_id: ID or URL-encoded path of the group
         :return: array of strings denoting project names
         """
-        url = f"{self.base_url}/api/v4/groups/{group_id}/projects"
-        response = requests.get(url, headers=self.headers)
+        return [project["name"] for project in self.iter_group_projects(group_id)]
 
-        if response.status_code == 200:
-            return [project["name"] for project in response.json()]
-        else:
-            raise Exception(f"Failed to fetch group projects: {response.status_code} {response.text}")
+    def iter_group_projects(self, group_id):
+        """
+        Lazily iterates over all projects of a group, page by page
+        :param group_id: ID or URL-encoded path of the group
+        :return: iterator of project dictionaries
+        """
+        url = f"{self.base_url}/api/v4/groups/{group_id}/projects"
+        return self._paginate(url, error_message="Failed to fetch group projects")
 
     def get_commits(self, group_name, project_name, commit_count=20):
         """
@@ -49,40 +203,177 @@ class GitlabApi:
 
         project_id = self.get_project_id(group_name, project_name)
 
-        url = f"{self.base_url}/api/v4/projects/{project_id}/repository/commits?per_page=" + str(commit_count)
-        response = requests.get(url, headers=self.headers)
-        if response.status_code == 200:
-            return response.json()
-        return []
+        url = f"{self.base_url}/api/v4/projects/{project_id}/repository/commits"
+        try:
+            return list(islice(self._paginate(url, params={"per_page": commit_count}), commit_count))
+        except Exception:
+            return []
 
-    def get_issues(self, group_name, project_name, issue_count=20):
+    def get_issues(self, group_name, project_name, issue_count=20, lean=False):
+        """
+        Retrieves the issues of a project
+        :param group_name: group name
+        :param project_name: project name
+        :param issue_count: maximum number of issues to return, None for all of them
+        :param lean: return GitlabItem records, see iter_issues
+        :return: list of issue dictionaries or records
+        """
+        return list(islice(self.iter_issues(group_name, project_name, lean=lean), issue_count))
 
+    def iter_issues(self, group_name, project_name, params=None, lean=False):
+        """
+        Lazily iterates over all issues of a project, following pagination. The next page is fetched while the
+        current one is being consumed.
+        :param group_name: group name
+        :param project_name: project name
+        :param params: additional query parameters, e.g. `state` or `order_by`
+        :param lean: yield GitlabItem records with only the synced fields; fetched through GraphQL if the client
+                     was created with `graphql=True`, which supports the `order_by`, `sort` and `updated_after`
+                     parameters
+        :return: iterator of issue dictionaries or records
+        """
         project_id = self.get_project_id(group_name, project_name)
 
-        url = f"{self.base_url}/api/v4/projects/{project_id}/issues?per_page=" + str(issue_count)
-        response = requests.get(url, headers=self.headers)
-        response.raise_for_status()
-        return response.json()
+        if lean and self.graphql:
+            path = self._full_path("projects", project_id, "path_with_namespace")
+            nodes = self._graphql_nodes(GRAPHQL_ISSUES, self._graphql_variables(path, params, "issue"),
+                                        "project", "issues", "Failed to fetch issues")
+            return (GitlabItem.from_graphql(node, project_id=_numeric_id(project["id"])) for project, node in nodes)
+
+        url = f"{self.base_url}/api/v4/projects/{project_id}/issues"
+        issues = self._paginate(url, params=params, error_message="Failed to fetch issues")
+        return (GitlabItem.from_json(issue) for issue in issues) if lean else issues
 
     def get_project_id(self, group_id, project_name):
         """
-        Retrieves the project ID based on its name and group
-        :param group_id: ID of the group
-        :param project_name: Name of the project
+        Retrieves the project ID based on its name and group. Resolved IDs are remembered for the lifetime of the
+        client, and across runs if `id_cache_path` is set. The project is first looked up directly by its path;
+        if that fails, the group's projects are listed once and indexed by lower-cased name and path.
+        :param group_id: ID or path of the group
+        :param project_name: Name or path of the project
         :return: Project ID if found, None otherwise
         """
-        url = f"{self.base_url}/api/v4/groups/{group_id}/projects?per_page=100"
-        response = requests.get(url, headers=self.headers)
+        key = f"{group_id}/{project_name}".lower()
+        with self._ids_lock:
+            if key in self._project_ids:
+                return self._project_ids[key]
+
+        project_id = self._get_project_id_by_path(group_id, project_name)
+
+        if project_id is None:
+            project_id = self._group_project_index(group_id).get(project_name.lower())
+
+        if project_id is not None:
+            with self._ids_lock:
+                self._project_ids[key] = project_id
+            self._save_ids()
+        return project_id
+
+    def get_group_id(self, group):
+        """
+        Retrieves the numeric ID of a group, remembered like project IDs
+        :param group: ID or full path of the group
+        :return: Group ID if found, None otherwise
+        """
+        if str(group).isdigit():
+            return int(group)
+
+        key = str(group).lower()
+        with self._ids_lock:
+            if key in self._group_ids:
+                return self._group_ids[key]
+
+        url = f"{self.base_url}/api/v4/groups/{quote(str(group), safe='')}"
+        response = self.transport.get(url, headers=self.headers, params={"with_projects": "false"})
+        if response.status_code != 200:
+            return None
+
+        group_id = response.json()["id"]
+        with self._ids_lock:
+            self._group_ids[key] = group_id
+        self._save_ids()
+        return group_id
+
+    def get_subgroup_ids(self, group):
+        """
+        Lists the subgroups of a group at any depth; the result is remembered for SUBGROUP_TTL seconds
+        :param group: ID or full path of the group
+        :return: set of the subgroup IDs
+        """
+        key = str(group).lower()
+        with self._ids_lock:
+            listed_at, subgroup_ids = self._subgroup_ids.get(key, (None, None))
+        if listed_at is not None and time.monotonic() - listed_at < SUBGROUP_TTL:
+            return subgroup_ids
+
+        url = f"{self.base_url}/api/v4/groups/{quote(str(group), safe='')}/descendant_groups"
+        subgroup_ids = {subgroup["id"] for subgroup in self._paginate(url, error_message="Failed to fetch subgroups")}
+        with self._ids_lock:
+            self._subgroup_ids[key] = (time.monotonic(), subgroup_ids)
+        return subgroup_ids
+
+    def _get_project_id_by_path(self, group_id, project_name):
+        # GET /projects/:path only accepts the full path, which needs a group path and a project path without spaces
+        if str(group_id).isdigit() or " " in project_name:
+            return None
+
+        url = f"{self.base_url}/api/v4/projects/{quote(f'{group_id}/{project_name}', safe='')}"
+        response = self.transport.get(url, headers=self.headers)
         if response.status_code == 200:
-            projects = response.json()
-            for project in projects:
-                if project["name"].lower() == project_name.lower():
-                    return project["id"]
+            return response.json()["id"]
         return None
 
+    def _group_project_index(self, group_id):
+        """
+        :return: dictionary of lower-cased project name and path => project ID for all projects of the group
+        """
+        key = str(group_id).lower()
+        with self._ids_lock:
+            index = self._group_indexes.get(key)
+        if index is not None:
+            return index
+
+        index = {}
+        try:
+            for project in self.iter_group_projects(group_id):
+                index[project["name"].lower()] = project["id"]
+                if "path" in project:
+                    index.setdefault(project["path"].lower(), project["id"])
+        except Exception as e:
+            logger.warning("Failed to list projects of group %s: %s", group_id, e)
+            return index
+
+        with self._ids_lock:
+            self._group_indexes[key] = index
+        return index
+
+    def _load_ids(self):
+        if self.id_cache_path is None or not os.path.exists(self.id_cache_path):
+            return
+        try:
+            with open(self.id_cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable ID cache %s: %s", self.id_cache_path, e)
+            return
+        self._project_ids.update(data.get("projects", {}))
+        self._group_ids.update(data.get("groups", {}))
+
+    def _save_ids(self):
+        if self.id_cache_path is None:
+            return
+        with self._ids_lock:
+            data = {"projects": dict(self._project_ids), "groups": dict(self._group_ids)}
+            tmp_path = self.id_cache_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.id_cache_path)
+
     def search_comments(self, group_name, project_name, comment_count=20, keyword=None):
         """
-        Retrieves the latest comments from a project, with an optional keyword filter
+        Retrieves the latest comments from a project, with an optional keyword filter. With a keyword, the project
+        search API finds the matching comments on the server, and only the pages needed for `comment_count` are
+        fetched.
         :param comment_count: number of comments to return
         :param group_name: name of the group
         :param project_name: the name of the project
@@ -90,14 +381,57 @@ class GitlabApi:
         :return: JSON list of comment objects
         """
         project_id = self.get_project_id(group_name, project_name)
-        url = f"{self.base_url}/api/v4/projects/{project_id}/issues_notes?per_page=" + str(comment_count)
-        response = requests.get(url, headers=self.headers)
-        if response.status_code == 200:
-            comments = response.json()
-            if keyword:
-                comments = [comment for comment in comments if keyword.lower() in comment['body'].lower()]
-            return comments
-        return []
+        if keyword:
+            url = f"{self.base_url}/api/v4/projects/{project_id}/search"
+            comments = self._paginate(url, params={"scope": "notes", "search": keyword,
+                                                   "per_page": min(comment_count, MAX_PER_PAGE)})
+        else:
+            url = f"{self.base_url}/api/v4/projects/{project_id}/issues_notes"
+            comments = self._paginate(url)
+        try:
+            return list(islice(comments, comment_count))
+        except Exception:
+            return []
+
+    def iter_issue_notes(self, project_id, issue_iid, params=None):
+        """
+        Lazily iterates over the notes (comments and system notes) of an issue, following pagination
+        :param project_id: ID or URL-encoded path of the project
+        :param issue_iid: project-internal ID of the issue
+        :param params: additional query parameters, e.g. `order_by` (`created_at` or `updated_at`) and `sort`
+        :return: iterator of note dictionaries
+        """
+        url = f"{self.base_url}/api/v4/projects/{project_id}/issues/{issue_iid}/notes"
+        return self._paginate(url, params=params, error_message="Failed to fetch issue notes")
+
+    def iter_epic_notes(self, group_id, epic_id, params=None):
+        """
+        Lazily iterates over the notes of an epic, following pagination
+        :param group_id: ID or URL-encoded path of the group
+        :param epic_id: ID of the epic; unlike the other epic endpoints, the notes API takes the ID, not the IID
+        :param params: additional query parameters, see iter_issue_notes
+        :return: iterator of note dictionaries
+        """
+        url = f"{self.base_url}/api/v4/groups/{group_id}/epics/{epic_id}/notes"
+        return self._paginate(url, params=params, error_message="Failed to fetch epic notes")
+
+    def iter_upload(self, kind, parent_id, secret, filename, chunk_size=UPLOAD_CHUNK_SIZE):
+        """
+        Streams a file uploaded to a project or group, e.g. one linked as `/uploads/<secret>/<filename>` from a
+        note, without reading it into memory as a whole
+        :param kind: "projects" or "groups"
+        :param parent_id: ID or URL-encoded path of the project or group
+        :param secret: the 32 character secret of the upload
+        :param filename: file name of the upload, as it appears in its link
+        :param chunk_size: bytes per chunk
+        :return: iterator of byte chunks
+        """
+        url = f"{self.base_url}/api/v4/{kind}/{parent_id}/uploads/{secret}/{filename}"
+        response = self.transport.get(url, headers=self.headers, stream=True)
+        with response:
+            if response.status_code != 200:
+                raise Exception(f"Failed to download upload {secret}/{filename}: {response.status_code}")
+            yield from response.iter_content(chunk_size=chunk_size)
 
     def search_issues(self, group_name, project_name, keyword, search_in='title,description'):
         """
@@ -114,25 +448,221 @@ class GitlabApi:
         url = f"{self.base_url}/api/v4/projects/{project_id}/issues"
         params = {
             'search': keyword,
-            'in': search_in,
-            'per_page': 1000  # Adjust as needed; be mindful of performance and API limits
+            'in': search_in
         }
-        response = requests.get(url, headers=self.headers, params=params)
-        response.raise_for_status()
-        return response.json()
+        return list(self._paginate(url, params=params, error_message="Failed to search issues"))
 
-    def get_epics(self, group_id):
+    def get_epics(self, group_id, lean=False):
         """
         Retrieves all epics from a specific GitLab group.
 
         :param group_id: The ID or URL-encoded path of the group.
-        :return: A list of epic dictionaries.
+        :param lean: return GitlabItem records, see iter_epics
+        :return: A list of epic dictionaries or records.
+        """
+        return list(self.iter_epics(group_id, lean=lean))
+
+    def iter_epics(self, group_id, params=None, lean=False):
+        """
+        Lazily iterates over all epics of a group, following pagination
+
+        :param group_id: The ID or URL-encoded path of the group.
+        :param params: additional query parameters
+        :param lean: yield GitlabItem records with only the synced fields, fetched through GraphQL if the client
+                     was created with `graphql=True`, see iter_issues
+        :return: iterator of epic dictionaries or records
         """
+        if lean and self.graphql:
+            path = self._full_path("groups", group_id, "full_path")
+            nodes = self._graphql_nodes(GRAPHQL_EPICS, self._graphql_variables(path, params, "epic"),
+                                        "group", "epics", "Failed to fetch epics")
+            # the listing includes the epics of subgroups, each with the group it belongs to
+            return (GitlabItem.from_graphql(node, group_id=_numeric_id(node["group"]["id"])) for _, node in nodes)
+
         url = f"{self.base_url}/api/v4/groups/{group_id}/epics"
-        response = requests.get(url, headers=self.headers)
+        epics = self._paginate(url, params=params, error_message="Failed to fetch epics")
+        return (GitlabItem.from_json(epic) for epic in epics) if lean else epics
 
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"Failed to fetch epics: {response.status_code} - {response.text}")
+    def iter_epic_issues(self, group_id, epic_iid, params=None):
+        """
+        Lazily iterates over the issues assigned to an epic, following pagination
+        :param group_id: ID or URL-encoded path of the group
+        :param epic_iid: group-internal ID of the epic
+        :param params: additional query parameters
+        :return: iterator of issue dictionaries, which include `id` and `project_id`
+        """
+        url = f"{self.base_url}/api/v4/groups/{group_id}/epics/{epic_iid}/issues"
+        return self._paginate(url, params=params, error_message="Failed to fetch epic issues")
+
+    def update_issue(self, project_id, issue_iid, **fields):
+        """
+        Updates an issue
+        :param project_id: ID or URL-encoded path of the project
+        :param issue_iid: project-internal ID of the issue
+        :param fields: attributes to change, e.g. `title`, `add_labels` or `remove_labels`
+        :return: the updated issue dictionary
+        """
+        url = f"{self.base_url}/api/v4/projects/{project_id}/issues/{issue_iid}"
+        return self._put(url, fields, "Failed to update issue")
 
+    def get_epic(self, group_id, epic_iid):
+        """
+        :param group_id: ID or URL-encoded path of the group
+        :param epic_iid: group-internal ID of the epic
+        :return: the epic dictionary
+        """
+        url = f"{self.base_url}/api/v4/groups/{group_id}/epics/{epic_iid}"
+        response = self.transport.get(url, headers=self.headers)
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch epic: {response.status_code} - {response.text}")
+        return response.json()
+
+    def update_epic(self, group_id, epic_iid, **fields):
+        """
+        Updates an epic
+        :param group_id: ID or URL-encoded path of the group
+        :param epic_iid: group-internal ID of the epic
+        :param fields: attributes to change, e.g. `title`, `add_labels` or `remove_labels`
+        :return: the updated epic dictionary
+        """
+        url = f"{self.base_url}/api/v4/groups/{group_id}/epics/{epic_iid}"
+        return self._put(url, fields, "Failed to update epic")
+
+    def _put(self, url, fields, error_message):
+        response = self.transport.put(url, headers=self.headers, json=fields)
+        if response.status_code != 200:
+            raise Exception(f"{error_message}: {response.status_code} - {response.text}")
+        return response.json()
+
+    def _full_path(self, kind, id, attribute):
+        """
+        :param kind: "projects" or "groups"
+        :param id: ID or path of the project or group
+        :param attribute: attribute of the REST representation holding the full path
+        :return: full path of a project or group, as the GraphQL API addresses them
+        """
+        if not str(id).isdigit():
+            return unquote(str(id))
+        key = (kind, str(id))
+        with self._ids_lock:
+            if key in self._full_paths:
+                return self._full_paths[key]
+
+        response = self.transport.get(f"{self.base_url}/api/v4/{kind}/{id}", headers=self.headers)
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch {kind} {id}: {response.status_code} - {response.text}")
+        path = response.json()[attribute]
+        with self._ids_lock:
+            self._full_paths[key] = path
+        return path
+
+    @staticmethod
+    def _graphql_variables(path, params, type):
+        """
+        Translates the REST query parameters of an item listing to the variables of its GraphQL query
+        :raises ValueError: for parameters the GraphQL query does not support
+        """
+        params = dict(params or {})
+        variables = {"path": path}
+        order = (params.pop("order_by", "created_at"), params.pop("sort", "desc"))
+        if order not in _GRAPHQL_SORTS[type]:
+            raise ValueError(f"Ordering by {order[0]} {order[1]} is not supported with GraphQL")
+        variables["sort"] = _GRAPHQL_SORTS[type][order]
+        if "updated_after" in params:
+            variables["updatedAfter"] = params.pop("updated_after")
+        params.pop("per_page", None)
+        if params:
+            raise ValueError(f"Parameters not supported with GraphQL: {', '.join(sorted(params))}")
+        return variables
+
+    def _graphql_nodes(self, query, variables, root, connection, error_message):
+        """
+        Yields the nodes of a paginated GraphQL connection `<root> { <connection> { nodes } }`, following its cursor.
+        While the nodes of one page are consumed, the next page is already being fetched.
+        :return: iterator of (root object, node) tuples
+        """
+        url = f"{self.base_url}/api/graphql"
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            data = self._graphql(url, query, variables, error_message)
+            while data is not None:
+                parent = data.get(root)
+                if parent is None:
+                    raise Exception(f"{error_message}: {root} {variables['path']} not found")
+                page = parent[connection]
+                future = None
+                if page["pageInfo"]["hasNextPage"]:
+                    future = prefetcher.submit(self._graphql, url, query,
+                                               dict(variables, after=page["pageInfo"]["endCursor"]), error_message)
+                for node in page["nodes"]:
+                    yield parent, node
+                data = future.result() if future else None
+
+    def _graphql(self, url, query, variables, error_message):
+        response = self.transport.post(url, headers=self.headers, json={"query": query, "variables": variables})
+        if response.status_code != 200:
+            raise Exception(f"{error_message}: {response.status_code} - {response.text}")
+        data = response.json()
+        if data.get("errors"):
+            raise Exception(f"{error_message}: {'; '.join(error.get('message', '') for error in data['errors'])}")
+        return data["data"]
+
+    def _paginate(self, url, params=None, error_message="Failed to fetch"):
+        """
+        Yields the items of a paginated list endpoint. Follows the `Link: rel="next"` header, which is how both keyset
+        and offset pagination expose the next page, and falls back to `X-Next-Page`. While the items of one page are
+        consumed, the next page is already being fetched, so at most two pages are held in memory.
+        :param url: URL of the list endpoint
+        :param params: query parameters of the first request
+        :param error_message: message of the exception raised on a non-200 response
+        :return: iterator of items
+        """
+        params = dict(params or {})
+        params["per_page"] = min(int(params.get("per_page", MAX_PER_PAGE)), MAX_PER_PAGE)
+
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            response = self._get_page(url, params, error_message)
+            while response is not None:
+                next_page = self._next_page(response, url, params)
+                future = prefetcher.submit(self._get_page, *next_page, error_message) if next_page else None
+                yield from response.json()
+                response = future.result() if future else None
+
+    def _get_page(self, url, params, error_message):
+        response = self.transport.get(url, headers=self.headers, params=params)
+        if response.status_code != 200:
+            raise Exception(f"{error_message}: {response.status_code} - {response.text}")
+        return response
+
+    @staticmethod
+    def _next_page(response, url, params):
+        """
+        :return: tuple (url, params) of the next page request, None on the last page
+        """
+        next_link = response.links.get("next", {}).get("url")
+        if next_link:
+            # the link already carries all query parameters, including the keyset cursor
+            return next_link, None
+
+        next_page = response.headers.get("X-Next-Page")
+        if next_page:
+            return url, dict(params, page=next_page)
+
+        return None
+
+
+def _numeric_id(global_id):
+    """
+    :return: numeric ID of a GraphQL global ID such as `gid://gitlab/Issue/123`
+    """
+    return int(str(global_id).rsplit("/", 1)[-1])
+
+
+def _rest_timestamp(value):
+    """
+    :return: a GraphQL timestamp in the format of the REST API, `2024-05-01T12:30:00.000Z`, so both compare alike
+             as watermarks
+    """
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(timezone.utc)
+    return parsed.strftime("%Y-%m-%dT%H:%M:%S.") + f"{parsed.microsecond // 1000:03d}Z"
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# response headers kept with a cached body; pagination depends on Link and X-Next-Page
+CACHED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Link", "X-Next-Page", "X-Page", "X-Per-Page",
+                  "X-Total", "X-Total-Pages")
+
+
+class ResponseCache:
+    """
+    On-disk cache of GET responses, revalidated with conditional requests.
+
+    A cached response younger than the TTL of its endpoint is served without contacting the server. Older ones are
+    revalidated by sending `If-None-Match` / `If-Modified-Since`, so an unchanged resource costs a 304 with an
+    empty body. The cache is bounded to `max_bytes` and evicts the least recently used entries first.
+    """
+
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024, ttls=None, default_ttl=0):
+        """
+        :param directory: directory holding the cached responses, created if it does not exist
+        :param max_bytes: maximum total size of the cached bodies
+        :param ttls: dictionary of URL path regular expression => seconds a response is served without revalidation;
+                     the first matching pattern applies
+        :param default_ttl: TTL of endpoints not matching any pattern; 0 revalidates on every request
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls or {}).items()]
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._counters = {"hits": 0, "revalidated": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        # least recently used first; hits touch the body file, so its mtime orders the entries across runs
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".body"):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name[:-len(".body")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._size += size
+        self._evict()
+
+    def get(self, send, url, params=None, headers=None, **kwargs):
+        """
+        Sends a GET request through the cache
+        :param send: function called as `send(url, headers=..., **kwargs)` for requests that reach the server
+        :return: requests.Response, either from the server or rebuilt from the cache
+        """
+        full_url = requests.Request("GET", url, params=params).prepare().url
+        key = self._key(full_url, headers)
+        entry = self._read(key)
+
+        if entry is not None:
+            metadata, body = entry
+            if time.time() - metadata["stored_at"] < self._ttl(full_url):
+                self._count("hits")
+                self._touch(key)
+                return self._response(full_url, metadata, body)
+
+            headers = dict(headers or {})
+            if metadata["headers"].get("ETag"):
+                headers["If-None-Match"] = metadata["headers"]["ETag"]
+            if metadata["headers"].get("Last-Modified"):
+                headers["If-Modified-Since"] = metadata["headers"]["Last-Modified"]
+
+        response = send(full_url, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            self._count("revalidated")
+            metadata["stored_at"] = time.time()
+            self._write(key, metadata)
+            return self._response(full_url, metadata, body)
+
+        self._count("misses")
+        if response.status_code == 200 and self._is_cacheable(full_url, response):
+            self._write(key, {
+                "url": full_url,
+                "stored_at": time.time(),
+                "headers": {h: response.headers[h] for h in CACHED_HEADERS if h in response.headers}
+            }, response.content)
+        return response
+
+    def stats(self):
+        """
+        :return: dictionary with hit, revalidation, miss and eviction counts and the current size in bytes
+        """
+        with self._lock:
+            return dict(self._counters, size=self._size, entries=len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def _is_cacheable(self, url, response):
+        if "no-store" in response.headers.get("Cache-Control", ""):
+            return False
+        return "ETag" in response.headers or "Last-Modified" in response.headers or self._ttl(url) > 0
+
+    def _ttl(self, url):
+        path = urlsplit(url).path
+        for pattern, ttl in self.ttls:
+            if pattern.search(path):
+                return ttl
+        return self.default_ttl
+
+    @staticmethod
+    def _key(url, headers):
+        # responses depend on who asks, so the credentials are part of the key
+        authorization = (headers or {}).get("Authorization", "")
+        return hashlib.sha256(f"{authorization}\n{url}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _response(url, metadata, body):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(metadata["headers"])
+        response._content = body
+        response.encoding = "utf-8"
+        return response
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".json", base + ".body"
+
+    def _read(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            metadata_path, body_path = self._paths(key)
+            try:
+                with open(metadata_path, "r", encoding="utf-8") as f:
+                    metadata = json.load(f)
+                with open(body_path, "rb") as f:
+                    body = f.read()
+            except (OSError, ValueError):
+                # half-written or removed behind our back
+                self._remove(key)
+                return None
+            return metadata, body
+
+    def _write(self, key, metadata, body=None):
+        """
+        Stores an entry; without a body only the metadata of an existing entry is replaced
+        """
+        if body is not None and len(body) > self.max_bytes:
+            return
+        metadata_path, body_path = self._paths(key)
+        with self._lock:
+            if body is None:
+                if key in self._entries:
+                    _replace_file(metadata_path, json.dumps(metadata), "w")
+                    self._entries.move_to_end(key)
+                return
+
+            # body first: an entry is only considered valid once its metadata exists
+            _replace_file(body_path, body, "wb")
+            _replace_file(metadata_path, json.dumps(metadata), "w")
+
+            self._size -= self._entries.pop(key, 0)
+            self._entries[key] = len(body)
+            self._size += len(body)
+
+            self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._counters["evictions"] += 1
+
+    def _touch(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                try:
+                    os.utime(self._paths(key)[1])
+                except OSError:
+                    pass
+
+    def _remove(self, key):
+        self._size -= self._entries.pop(key, 0)
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+
+def _replace_file(path, data, mode):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
@@ -0,0 +1,281 @@
+import contextlib
+import email.utils
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from http_cache import ResponseCache
+from metrics import DISABLED, Metrics
+
+DEFAULT_POOL_SIZE = 10
+
+# statuses worth retrying; any request which got one of these may be sent again if its method is idempotent
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+def create_session(headers=None, pool_size=DEFAULT_POOL_SIZE, verify=True):
+    """
+    Creates a requests session which keeps connections alive and reuses them across calls, so only the first
+    request to a host pays for the TCP and TLS handshakes
+    :param headers: headers sent with every request
+    :param pool_size: maximum number of connections kept open per host
+    :param verify: whether to verify TLS certificates
+    :return: requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({
+        "Connection": "keep-alive",
+        "Accept-Encoding": "gzip, deflate"
+    })
+    if headers:
+        session.headers.update(headers)
+    session.verify = verify
+    return session
+
+
+class TokenBucket:
+    """
+    Client-side rate limit: allows `rate` requests per second on average, with bursts of up to `capacity` requests
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token, blocking until one is available
+        :return: number of seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class Transport:
+    """
+    Sends requests through a pooled session and rides out rate limits and transient failures.
+
+    - 429 and 5xx responses and connection errors are retried with exponential backoff and full jitter.
+      `Retry-After` takes precedence over the computed delay. POST is not idempotent, so it is only retried
+      when the server did not process it: on 429, or when the connection could not be established.
+    - A `RateLimit-Remaining: 0` response pauses all requests to that host until `RateLimit-Reset`.
+    - `rate_limits` optionally caps the request rate per host with a token bucket, and `max_concurrent_per_host`
+      the number of requests in flight to a host, across all threads sharing the transport.
+
+    - GET requests go through `cache`, if given, which answers them from disk or revalidates them. Streamed
+      downloads (`stream=True`) bypass the cache, which would have to read them whole.
+
+    Retry and throttle counters are available through `stats()`; per-endpoint request counts, latencies and bytes
+    are recorded in `metrics`, if given.
+    """
+
+    def __init__(self, session: requests.Session = None, max_retries=5, backoff_base=0.5, backoff_max=60.0,
+                 rate_limits=None, pool_size=DEFAULT_POOL_SIZE, verify=True, cache: ResponseCache = None,
+                 max_concurrent_per_host=None, metrics: Metrics = None):
+        """
+        :param session: session to send requests with; a new pooled session is created if not given
+        :param max_retries: number of times a request is retried before its last response or error is returned
+        :param backoff_base: delay in seconds before the first retry, doubled on each further attempt
+        :param backoff_max: upper bound of the backoff delay in seconds
+        :param rate_limits: dictionary of host name => maximum requests per second
+        :param pool_size: connection pool size of the created session
+        :param verify: whether the created session verifies TLS certificates
+        :param cache: optional on-disk cache for GET responses
+        :param max_concurrent_per_host: maximum number of requests in flight to one host, unlimited if None
+        :param metrics: records every request sent, including retries; nothing is recorded if None
+        """
+        self.session = session if session is not None else create_session(pool_size=pool_size, verify=verify)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cache = cache
+        self.metrics = metrics if metrics is not None else DISABLED
+        self._buckets = {host: TokenBucket(rate) for host, rate in (rate_limits or {}).items()}
+        self.max_concurrent_per_host = max_concurrent_per_host
+        self._host_slots = {}
+        self._resume_at = {}
+        self._counters = {"requests": 0, "retries": 0, "throttled": 0, "wait_seconds": 0.0}
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request, retrying it as described in the class documentation
+        :return: the first successful response, or the last response once retries are exhausted
+        :raises requests.RequestException: if the last attempt failed without a response
+        """
+        method = method.upper()
+        if method == "GET" and self.cache is not None and not kwargs.get("stream"):
+            return self.cache.get(lambda cache_url, **cache_kwargs: self._send("GET", cache_url, **cache_kwargs),
+                                  url, **kwargs)
+        return self._send(method, url, **kwargs)
+
+    def _send(self, method, url, **kwargs):
+        host = urlsplit(url).hostname
+        attempt = 0
+
+        while True:
+            self._wait_for_host(host)
+            self._count("requests")
+
+            try:
+                with self._host_slot(host):
+                    start = time.perf_counter()
+                    response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.metrics.observe_request(method, url, "error", time.perf_counter() - start, 0, 0)
+                retryable = method in IDEMPOTENT_METHODS or isinstance(e, requests.ConnectTimeout) \
+                    or _is_connection_refused(e)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                self._backoff(attempt)
+                attempt += 1
+                continue
+
+            if self.metrics.enabled:
+                self.metrics.observe_request(method, url, response.status_code, time.perf_counter() - start,
+                                             _body_size(response.request.body), _received_size(response))
+
+            self._observe_rate_limit(host, response)
+
+            if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                return response
+            if response.status_code != 429 and method not in IDEMPOTENT_METHODS:
+                return response
+
+            if response.status_code == 429:
+                self._count("throttled")
+            self._backoff(attempt, _retry_after(response))
+            attempt += 1
+
+    def stats(self):
+        """
+        :return: dictionary with the number of requests sent (including retries), retries, throttled responses
+                 and the total time spent waiting on backoff and rate limits
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def close(self):
+        self.session.close()
+
+    def _host_slot(self, host):
+        if self.max_concurrent_per_host is None:
+            return contextlib.nullcontext()
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.max_concurrent_per_host)
+            return self._host_slots[host]
+
+    def _wait_for_host(self, host):
+        waited = 0.0
+        with self._lock:
+            resume_at = self._resume_at.get(host)
+        if resume_at is not None:
+            delay = resume_at - time.time()
+            if delay > 0:
+                time.sleep(delay)
+                waited += delay
+        bucket = self._buckets.get(host)
+        if bucket is not None:
+            waited += bucket.acquire()
+        if waited > 0:
+            self._count("wait_seconds", waited)
+
+    def _observe_rate_limit(self, host, response):
+        remaining = response.headers.get("RateLimit-Remaining")
+        if remaining is None or remaining.strip() != "0":
+            return
+        reset = response.headers.get("RateLimit-Reset")
+        try:
+            # Gitlab sends the reset time as a unix timestamp
+            resume_at = float(reset)
+        except (TypeError, ValueError):
+            resume_at = time.time() + self.backoff_base
+        with self._lock:
+            self._resume_at[host] = min(resume_at, time.time() + self.backoff_max)
+            self._counters["throttled"] += 1
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            delay = min(retry_after, self.backoff_max)
+        else:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        self._count("retries")
+        self._count("wait_seconds", delay)
+        time.sleep(delay)
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+
+def _retry_after(response):
+    """
+    :return: the delay requested by the `Retry-After` header in seconds, or None
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    if isinstance(body, bytes):
+        return len(body)
+    # streamed bodies are not read twice just to be measured, only those which know their length count
+    return len(body) if hasattr(body, "__len__") else 0
+
+
+def _received_size(response):
+    # bytes on the wire, which for a compressed response is less than its decoded content
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit():
+        return int(length)
+    # a streamed response which was not read yet is not loaded into memory just to be measured
+    return 0 if getattr(response, "_content", None) is False else len(response.content)
+
+
+def _is_connection_refused(error):
+    # the request never reached the server, so it is safe to send again whatever the method
+    return isinstance(error, requests.ConnectionError) and "refused" in str(error).lower()
@@ -1,31 +1,124 @@
-import csv
-import os
+import threading
+
+from mapping_store import CsvMappingStore, MappingStore, create_store
 
 
 class IssueMapper:
-    def __init__(self, csv_path="issue_mapping.csv"):
-        self.csv_path = csv_path
-        # create the file if it does not exist
-        if not os.path.exists(self.csv_path):
-            with open(self.csv_path, mode='w', newline='') as f:
-                writer = csv.DictWriter(f, fieldnames=["jira_issue", "gitlab_issue", "type"])
-                writer.writeheader()
+    """
+    Stores the mapping between Gitlab and JIRA issues, along with the sync state of each mapped item.
+
+    Storage is delegated to a MappingStore; by default the original CSV file is used. All store access is serialized,
+    so a mapper can be shared by threads syncing items concurrently.
+    """
+
+    def __init__(self, csv_path="issue_mapping.csv", batch_size=25, store: MappingStore = None):
+        self.store = store if store is not None else CsvMappingStore(csv_path, batch_size=batch_size)
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_path(cls, path, batch_size=25):
+        """
+        Creates a mapper whose backend is chosen from the file extension (see mapping_store.create_store)
+        """
+        return cls(store=create_store(path, batch_size=batch_size))
 
     def store_mapping(self, jira_issue, gitlab_issue, type):
-        # check for duplicates
-        if not self.get_jira_issue(gitlab_issue, type):
-            with open(self.csv_path, mode='a', newline='') as f:
-                writer = csv.DictWriter(f, fieldnames=["jira_issue", "gitlab_issue", "type"])
-                writer.writerow({
-                    "jira_issue": jira_issue,
-                    "gitlab_issue": gitlab_issue,
-                    "type": type
-                })
+        # a failed JIRA call returns None, which must never end up as a mapping
+        if jira_issue is None:
+            raise ValueError(f"Cannot map {type} {gitlab_issue} to an empty JIRA issue")
+        # duplicates are ignored by the store
+        with self._lock:
+            self.store.add_mapping(jira_issue, gitlab_issue, type)
 
     def get_jira_issue(self, gitlab_issue, type):
-        with open(self.csv_path, mode='r', newline='') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if str(row["gitlab_issue"]) == str(gitlab_issue) and row["type"] == type:
-                    return str(row["jira_issue"])
-        return None
+        with self._lock:
+            return self.store.get_jira_issue(gitlab_issue, type)
+
+    def get_gitlab_issue(self, jira_issue):
+        """
+        Reverse lookup of a mapping
+        :param jira_issue: JIRA issue key
+        :return: tuple (type, gitlab_issue) if the JIRA issue is mapped, None otherwise
+        """
+        with self._lock:
+            return self.store.get_gitlab_issue(jira_issue)
+
+    def get_sync_state(self, gitlab_issue, type):
+        with self._lock:
+            return self.store.get_sync_state(gitlab_issue, type)
+
+    def set_sync_state(self, gitlab_issue, type, **fields):
+        """
+        Updates the sync state of an item; fields which are not given keep their stored value
+        :param fields: any of `updated_at`, `content_hash`, `status`, `title`, `gitlab_ref`, `note_id` and `epic_key`
+        """
+        with self._lock:
+            state = self.store.get_sync_state(gitlab_issue, type) or {}
+            state.update(fields)
+            self.store.set_sync_state(gitlab_issue, type, **state)
+
+    def get_watermark(self, name):
+        with self._lock:
+            return self.store.get_watermark(name)
+
+    def set_watermark(self, name, value):
+        with self._lock:
+            self.store.set_watermark(name, value)
+
+    def get_attachment(self, jira_issue, source=None, content_hash=None):
+        """
+        Looks up a file attached to a JIRA issue by its source or content, see MappingStore.get_attachment
+        """
+        with self._lock:
+            return self.store.get_attachment(jira_issue, source=source, content_hash=content_hash)
+
+    def add_attachment(self, jira_issue, source, content_hash, attachment_id, filename):
+        with self._lock:
+            self.store.add_attachment(jira_issue, source, content_hash, attachment_id, filename)
+
+    def set_epic_issues(self, epic_id, issues):
+        """
+        Records the issues of a Gitlab epic, see MappingStore.set_epic_issues
+        """
+        with self._lock:
+            self.store.set_epic_issues(epic_id, issues)
+
+    def epic_issues(self):
+        """
+        :return: list of (epic_id, gitlab_issue, project_id) tuples
+        """
+        with self._lock:
+            return list(self.store.epic_issues())
+
+    def add_pending_creations(self, creations):
+        """
+        Journals JIRA issues about to be created, see MappingStore.add_pending_creations
+        """
+        with self._lock:
+            self.store.add_pending_creations(creations)
+
+    def remove_pending_creation(self, gitlab_issue, type):
+        with self._lock:
+            self.store.remove_pending_creation(gitlab_issue, type)
+
+    def pending_creations(self):
+        with self._lock:
+            return self.store.pending_creations()
+
+    def flush(self):
+        with self._lock:
+            self.store.flush()
+
+    def close(self):
+        with self._lock:
+            self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return len(self.store)
@@ -1,73 +1,209 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
 import requests
 import urllib3
 
+from http_transport import DEFAULT_POOL_SIZE, Transport
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+logger = logging.getLogger(__name__)
+
+# maximum number of issues JIRA accepts in one bulk create request
+BULK_CREATE_LIMIT = 50
+# JIRA caps maxResults of a search at 100 by default
+MAX_SEARCH_RESULTS = 100
+# fields needed to build a JiraIssue
+ISSUE_FIELDS = "summary,status,issuetype,updated"
+# bytes read at a time from a file being attached
+ATTACHMENT_CHUNK_SIZE = 256 * 1024
+# field linking an issue to its epic in team-managed projects and JIRA Cloud; company-managed projects on JIRA
+# Server/Data Center use the Epic Link custom field instead
+PARENT_FIELD = "parent"
+
 
 class JiraIssue:
 
-    def __init__(self, issue_key, status, summary):
+    __slots__ = ("issue_key", "status", "summary", "issue_type", "updated")
+
+    def __init__(self, issue_key, status, summary, issue_type=None, updated=None):
         self.issue_key = issue_key
         self.status = status
         self.summary = summary
+        self.issue_type = issue_type
+        self.updated = updated
+
+    @classmethod
+    def from_json(cls, data):
+        fields = data["fields"]
+        return cls(issue_key=data["key"], status=fields["status"]["name"], summary=fields["summary"],
+                   issue_type=(fields.get("issuetype") or {}).get("name"), updated=fields.get("updated"))
 
 
 class JiraApi:
-    def __init__(self, base_url, token):
+    def __init__(self, base_url, token, session: requests.Session = None, pool_size=DEFAULT_POOL_SIZE,
+                 transport: Transport = None, transition_ttl=600):
         self.base_url = base_url.rstrip('/')
         self.token = token
         self.headers = {
             "Authorization": f"Bearer {self.token}",
             "Accept": "application/json"
         }
+        # a session or transport passed in by the caller is shared with other clients and left open by close()
+        self._owns_transport = session is None and transport is None
+        self.transport = transport if transport is not None else Transport(session=session, pool_size=pool_size,
+                                                                           verify=False)
+        self.transition_cache = TransitionCache(ttl=transition_ttl)
+        self._time_zone = None
+
+    @property
+    def session(self):
+        return self.transport.session
+
+    def close(self):
+        if self._owns_transport:
+            self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def get_issue(self, issue_key) -> JiraIssue:
         url = f"{self.base_url}/rest/api/2/issue/{issue_key}"
         try:
-            response = requests.get(url, headers=self.headers, verify=False)
+            response = self.transport.get(url, headers=self.headers, params={"fields": ISSUE_FIELDS}, verify=False)
             if response.status_code == 200:
-                issue_data = response.json()
-                return JiraIssue(issue_key=issue_key, status=issue_data['fields']['status']['name'],
-                                 summary=issue_data['fields']['summary'])
+                return JiraIssue.from_json(response.json())
             else:
-                print("Failed to fetch issue")
-                print("Status Code:", response.status_code)
-                print("Response:", response.text)
+                logger.error("Failed to fetch issue %s: %s - %s", issue_key, response.status_code, response.text)
         except requests.RequestException as e:
-            print("Request failed:", e)
+            logger.error("Request failed: %s", e)
 
     def get_issues(self, project_key) -> list[JiraIssue]:
-        jql = f"project={project_key}"
-        url = f"{self.base_url}/rest/api/2/search"
-        params = {
-            "jql": jql,
-            "fields": "summary,status",
-            "maxResults": 100
-        }
-
         issues = []
         try:
-            response = requests.get(url, headers=self.headers, params=params, verify=False)
-            if response.status_code == 200:
-                data = response.json()
-                for issue in data.get("issues", []):
-                    issues.append(
-                        JiraIssue(
-                            issue_key=issue["key"],
-                            status=issue["fields"]["status"]["name"],
-                            summary=issue["fields"]["summary"]
-                        )
-                    )
-            else:
-                print("Failed to fetch issues")
-                print("Status Code:", response.status_code)
-                print("Response:", response.text)
-        except requests.RequestException as e:
-            print("Request failed:", e)
+            for issue in self.search(f"project={project_key}", fields=ISSUE_FIELDS):
+                issues.append(JiraIssue.from_json(issue))
+        except Exception as e:
+            logger.error("Failed to fetch issues: %s", e)
+
+        return issues
 
+    def iter_updated_issues(self, project_key, since=None):
+        """
+        Lazily iterates over the issues of a project, oldest change first
+        :param project_key: JIRA project key
+        :param since: `updated` timestamp of an issue; only issues updated in the same minute or later are returned,
+                      as JQL compares dates with minute precision
+        :return: iterator of JiraIssue
+        """
+        jql = f"project = {project_key}"
+        if since is not None:
+            jql += f' AND updated >= "{self.jql_datetime(since)}"'
+        jql += " ORDER BY updated ASC, key ASC"
+        return (JiraIssue.from_json(issue) for issue in self.search(jql, fields=ISSUE_FIELDS))
+
+    def iter_created_issues(self, project_key, since):
+        """
+        Lazily iterates over the issues of a project created since a point in time, oldest first
+        :param project_key: JIRA project key
+        :param since: timestamp in the format JIRA returns; issues created in the same minute or later are returned
+        :return: iterator of JiraIssue
+        """
+        jql = f'project = {project_key} AND created >= "{self.jql_datetime(since)}" ORDER BY created ASC, key ASC'
+        return (JiraIssue.from_json(issue) for issue in self.search(jql, fields=ISSUE_FIELDS))
+
+    def get_issues_by_key(self, issue_keys):
+        """
+        Fetches many issues with one search per MAX_SEARCH_RESULTS keys
+        :param issue_keys: JIRA issue keys
+        :return: dictionary of issue key => JiraIssue; keys of issues which do not exist are left out
+        """
+        issue_keys = list(issue_keys)
+        issues = {}
+        for start in range(0, len(issue_keys), MAX_SEARCH_RESULTS):
+            jql = f"key in ({', '.join(issue_keys[start:start + MAX_SEARCH_RESULTS])})"
+            # warn instead of failing the whole query when one of the issues was deleted
+            for issue in self.search(jql, fields=ISSUE_FIELDS, validate_query="warn"):
+                issues[issue["key"]] = JiraIssue.from_json(issue)
         return issues
 
-    def create_issue(self, title, issue_type, description, project_key, issue_id=None):
+    def search(self, jql, fields=None, page_size=MAX_SEARCH_RESULTS, validate_query=None):
+        """
+        Yields the issues matching a JQL query, following pagination. While the issues of one page are consumed,
+        the next page is already being fetched.
+
+        The search pages by offset: when an issue which was already returned changes in a way that moves it within
+        the ordering, the next page may skip an issue. Queries ordered by `updated` are safe as long as only
+        the caller writes to the issues.
+        :param jql: JQL query
+        :param fields: comma separated fields to return; all navigable fields if None
+        :param page_size: issues per request
+        :param validate_query: JQL validation mode, e.g. "warn" to ignore unknown issue keys
+        :return: iterator of issue dictionaries
+        """
+        url = f"{self.base_url}/rest/api/2/search"
+        params = {"jql": jql, "maxResults": min(page_size, MAX_SEARCH_RESULTS), "startAt": 0}
+        if fields is not None:
+            params["fields"] = fields
+        if validate_query is not None:
+            params["validateQuery"] = validate_query
+
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            data = self._search_page(url, params)
+            while data is not None:
+                issues = data.get("issues", [])
+                # JIRA may return fewer issues than asked for, the next page starts after the last one returned
+                next_start = data.get("startAt", params["startAt"]) + len(issues)
+                future = None
+                if issues and next_start < data.get("total", 0):
+                    params = dict(params, startAt=next_start)
+                    future = prefetcher.submit(self._search_page, url, params)
+                yield from issues
+                data = future.result() if future else None
+
+    def _search_page(self, url, params):
+        response = self.transport.get(url, headers=self.headers, params=params, verify=False)
+        if response.status_code != 200:
+            raise Exception(f"Failed to search issues: {response.status_code} - {response.text}")
+        return response.json()
+
+    def jql_datetime(self, timestamp):
+        """
+        Formats an `updated` timestamp for JQL, which reads dates in the time zone of the authenticated user
+        :param timestamp: timestamp as returned by JIRA, e.g. `2024-05-01T12:30:00.000+0000`
+        :return: the timestamp as `yyyy/MM/dd HH:mm` in the user's time zone
+        """
+        value = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%f%z")
+        return value.astimezone(self._user_time_zone()).strftime("%Y/%m/%d %H:%M")
+
+    def _user_time_zone(self):
+        if self._time_zone is not None:
+            return self._time_zone
+        url = f"{self.base_url}/rest/api/2/myself"
+        try:
+            response = self.transport.get(url, headers=self.headers, verify=False)
+        except requests.RequestException as e:
+            raise Exception(f"Failed to get the time zone of the JIRA user: {e}")
+        if response.status_code != 200:
+            raise Exception(f"Failed to get the time zone of the JIRA user: {response.status_code} - {response.text}")
+        self._time_zone = ZoneInfo(response.json().get("timeZone") or "UTC")
+        return self._time_zone
+
+    def create_issue(self, title, issue_type, description, project_key, issue_id=None, fields=None):
+        """
+        Creates an issue, or updates the summary and description of `issue_id`
+        :param fields: additional fields to set, e.g. the epic link from epic_link_fields()
+        :return: key of the issue, None if the request failed
+        """
 
         is_update = issue_id is not None
 
@@ -77,60 +213,239 @@ class JiraApi:
         )
 
         payload = {
-            "fields": {
-                "summary": title,
-                "description": description,
-                "issuetype": {"name": issue_type}
-            }
+            "fields": self._issue_fields(title, issue_type, description, None if is_update else project_key, fields)
         }
 
-        if not is_update:
-            payload["fields"]["project"] = {"key": project_key}
-
-        if issue_type == "Epic":
-            payload["fields"]["customfield_10104"] = title
-
-            # inm Gitlab, epic description is optional, but in JIRA it's required
-            if payload["fields"]["description"] is None or len(payload["fields"]["description"]) == 0:
-                payload["fields"]["description"] = "<empty>"
-
         try:
             if is_update:
-                response = requests.put(url, json=payload, headers=self.headers, verify=False)
+                response = self.transport.put(url, json=payload, headers=self.headers, verify=False)
             else:
-                response = requests.post(url, json=payload, headers=self.headers, verify=False)
+                response = self.transport.post(url, json=payload, headers=self.headers, verify=False)
 
             if response.status_code in [200, 201, 204]:
                 if is_update:
-                    print(f"Issue {issue_id} updated successfully.")
+                    logger.debug("Issue %s updated successfully.", issue_id)
                     return issue_id
                 else:
                     issue_data = response.json()
                     jira_issue_key = issue_data['key']
-                    print(f"Issue {jira_issue_key} created successfully.")
+                    logger.info("Issue %s created successfully.", jira_issue_key)
                     return jira_issue_key
             else:
-                action = "update" if is_update else "create"
-                print(f"Failed to {action} issue")
-                print("Status Code:", response.status_code)
-                print("Response:", response.text)
+                logger.error("Failed to %s issue: %s - %s", "update" if is_update else "create",
+                             response.status_code, response.text)
         except requests.RequestException as e:
-            print("Request failed:", e)
+            logger.error("Request failed: %s", e)
+
+    def create_issues(self, issues):
+        """
+        Creates issues in batches of up to BULK_CREATE_LIMIT through the bulk endpoint. A batch is not atomic:
+        JIRA creates the valid items and reports an error for each of the others.
+        :param issues: list of dictionaries with keys `title`, `issue_type`, `description` and `project_key`, and
+                       optionally `fields` with additional fields, see create_issue
+        :return: list of (issue_key, error) tuples in the order of `issues`; issue_key is None for failed items
+        """
+        results = []
+        for start in range(0, len(issues), BULK_CREATE_LIMIT):
+            results.extend(self._create_issue_batch(issues[start:start + BULK_CREATE_LIMIT]))
+        return results
+
+    def _create_issue_batch(self, issues):
+        url = f"{self.base_url}/rest/api/2/issue/bulk"
+        payload = {
+            "issueUpdates": [
+                {"fields": self._issue_fields(i["title"], i["issue_type"], i["description"], i["project_key"],
+                                              i.get("fields"))}
+                for i in issues
+            ]
+        }
 
-    def update_issue_status(self, issue_key: str, new_status_name: str):
-        # Step 1: Get available transitions
-        url = f"{self.base_url}/rest/api/2/issue/{issue_key}/transitions"
         try:
-            response = requests.get(url, headers=self.headers, verify=False)
-            if response.status_code != 200:
-                raise Exception(f"Issue '{issue_key}' not found or failed to get transitions. Status code: {response.status_code}")
+            response = self.transport.post(url, json=payload, headers=self.headers, verify=False)
         except requests.RequestException as e:
-            raise Exception(f"Failed to get transitions for issue '{issue_key}': {e}")
+            logger.error("Request failed: %s", e)
+            return [(None, str(e))] * len(issues)
+
+        # 201 when all items were created, 400 when some or all of them failed
+        if response.status_code not in [201, 400]:
+            logger.error("Failed to create issues: %s - %s", response.status_code, response.text)
+            return [(None, f"{response.status_code} {response.text}")] * len(issues)
+
+        try:
+            data = response.json()
+        except ValueError:
+            return [(None, f"{response.status_code} {response.text}")] * len(issues)
+
+        errors = {}
+        for error in data.get("errors", []):
+            element_errors = error.get("elementErrors", {})
+            messages = list(element_errors.get("errorMessages", [])) + \
+                [f"{field}: {message}" for field, message in element_errors.get("errors", {}).items()]
+            errors[error["failedElementNumber"]] = "; ".join(messages) or f"status {error.get('status')}"
+
+        # the created issues are listed in request order, skipping the failed elements
+        created = iter(data.get("issues", []))
+        results = []
+        for index in range(len(issues)):
+            if index in errors:
+                results.append((None, errors[index]))
+                continue
+            issue = next(created, None)
+            results.append((issue["key"], None) if issue else (None, "missing from bulk response"))
+
+        logger.info("Bulk created %d of %d issues.", len(issues) - len(errors), len(issues))
+        return results
+
+    def set_epic_link(self, issue_key, epic_key, field=PARENT_FIELD):
+        """
+        Links an issue to an epic, or unlinks it from its epic
+        :param epic_key: key of the epic, None to unlink
+        :param field: field holding the link, see epic_link_fields
+        """
+        url = f"{self.base_url}/rest/api/2/issue/{issue_key}"
+        response = self.transport.put(url, json={"fields": self.epic_link_fields(epic_key, field)},
+                                      headers=self.headers, verify=False)
+        if response.status_code not in [200, 204]:
+            raise Exception(f"Failed to link {issue_key} to epic {epic_key}: "
+                            f"{response.status_code} - {response.text}")
+
+    @staticmethod
+    def epic_link_fields(epic_key, field=PARENT_FIELD):
+        """
+        :param field: PARENT_FIELD, or the ID of the Epic Link custom field, e.g. `customfield_10100`
+        :return: the fields linking an issue to the epic, or unlinking it if `epic_key` is None
+        """
+        if field == PARENT_FIELD:
+            return {field: {"key": epic_key} if epic_key is not None else None}
+        return {field: epic_key}
+
+    @staticmethod
+    def _issue_fields(title, issue_type, description, project_key=None, extra_fields=None):
+        fields = {
+            "summary": title,
+            "description": description,
+            "issuetype": {"name": issue_type}
+        }
+
+        if extra_fields:
+            fields.update(extra_fields)
+
+        # the project is only set on creation
+        if project_key is not None:
+            fields["project"] = {"key": project_key}
+
+        if issue_type == "Epic":
+            fields["customfield_10104"] = title
+
+            # inm Gitlab, epic description is optional, but in JIRA it's required
+            if fields["description"] is None or len(fields["description"]) == 0:
+                fields["description"] = "<empty>"
+
+        return fields
+
+    def add_comment(self, issue_key, body):
+        """
+        Adds a comment to an issue
+        :param body: comment text in JIRA wiki markup
+        :return: ID of the new comment, None if it could not be added
+        """
+        url = f"{self.base_url}/rest/api/2/issue/{issue_key}/comment"
+        try:
+            response = self.transport.post(url, json={"body": body}, headers=self.headers, verify=False)
+            if response.status_code == 201:
+                return response.json()["id"]
+            logger.error("Failed to comment on %s: %s - %s", issue_key, response.status_code, response.text)
+        except requests.RequestException as e:
+            logger.error("Request failed: %s", e)
+
+    def get_comments(self, issue_key, max_results=MAX_SEARCH_RESULTS):
+        """
+        :return: list of the latest comment dictionaries of an issue, newest first
+        """
+        url = f"{self.base_url}/rest/api/2/issue/{issue_key}/comment"
+        response = self.transport.get(url, headers=self.headers, params={"orderBy": "-created",
+                                                                         "maxResults": max_results}, verify=False)
+        if response.status_code != 200:
+            raise Exception(f"Failed to get comments of {issue_key}: {response.status_code} - {response.text}")
+        return response.json().get("comments", [])
+
+    def get_attachments(self, issue_key):
+        """
+        :return: list of attachment dictionaries of an issue, with `id`, `filename`, `size` and `content` (URL)
+        """
+        url = f"{self.base_url}/rest/api/2/issue/{issue_key}"
+        response = self.transport.get(url, headers=self.headers, params={"fields": "attachment"}, verify=False)
+        if response.status_code != 200:
+            raise Exception(f"Failed to get attachments of {issue_key}: {response.status_code} - {response.text}")
+        return response.json()["fields"].get("attachment") or []
+
+    def iter_attachment_content(self, content_url, chunk_size=ATTACHMENT_CHUNK_SIZE):
+        """
+        Streams the content of an attachment
+        :param content_url: the `content` URL of the attachment
+        :return: iterator of byte chunks
+        """
+        response = self.transport.get(content_url, headers=self.headers, stream=True, verify=False)
+        with response:
+            if response.status_code != 200:
+                raise Exception(f"Failed to download attachment {content_url}: {response.status_code}")
+            yield from response.iter_content(chunk_size=chunk_size)
+
+    def add_attachment(self, issue_key, filename, file, size, chunk_size=ATTACHMENT_CHUNK_SIZE):
+        """
+        Attaches a file to an issue. The multipart request body is streamed from the file in chunks, so the file is
+        never held in memory as a whole; it is read again from the start if the request has to be resent.
+        :param file: seekable binary file object
+        :param size: size of the file in bytes
+        :return: the attachment dictionary, with `id`, `filename` and `size`
+        """
+        url = f"{self.base_url}/rest/api/2/issue/{issue_key}/attachments"
+        body = _MultipartBody("file", filename, file, size, chunk_size)
+        # JIRA rejects attachment uploads without this header as a possible cross-site request
+        headers = dict(self.headers, **{"X-Atlassian-Token": "no-check", "Content-Type": body.content_type})
+        response = self.transport.post(url, data=body, headers=headers, verify=False)
+        if response.status_code != 200:
+            raise Exception(f"Failed to attach {filename} to {issue_key}: {response.status_code} - {response.text}")
+        return response.json()[0]
+
+    def update_issue_status(self, issue_key: str, new_status_name: str, issue_type=None, current_status=None):
+        """
+        Moves an issue to the given status. Transitions are looked up in the transition cache when the issue type and
+        current status are known, so the transition usually costs a single request; otherwise the issue is fetched
+        together with its transitions, which also fills the cache.
+        :param issue_key: JIRA issue key
+        :param new_status_name: name of the target status
+        :param issue_type: name of the issue type, if known
+        :param current_status: name of the current status, if known
+        :return: True if the issue was transitioned, False if it already was in the target status
+        """
+        if current_status is not None and current_status.lower() == new_status_name.lower():
+            return False
+
+        workflow = _workflow_of(issue_key)
+        transitions = None
+        if issue_type is not None and current_status is not None:
+            cache_key = (workflow, issue_type, current_status.lower())
+            transitions = self.transition_cache.get(cache_key)
+
+        if transitions is None:
+            # Step 1: Get the current status and the available transitions in one request
+            issue_type, current_status, transitions = self._get_transitions(issue_key)
+            if current_status.lower() == new_status_name.lower():
+                return False
+            cache_key = (workflow, issue_type, current_status.lower())
+            self.transition_cache.put(cache_key, transitions)
+            from_cache = False
+        else:
+            from_cache = True
 
-        transitions = response.json().get("transitions", [])
         matching_transition = next((t for t in transitions if t["to"]["name"].lower() == new_status_name.lower()), None)
 
         if not matching_transition:
+            if from_cache:
+                # the cached entry may be stale, e.g. after a workflow change
+                self.transition_cache.invalidate(cache_key)
+                return self.update_issue_status(issue_key, new_status_name)
             raise Exception(f"No matching transition found for status '{new_status_name}' in issue '{issue_key}'.")
 
         transition_id = matching_transition["id"]
@@ -144,11 +459,109 @@ class JiraApi:
         }
 
         try:
-            update_response = requests.post(transition_url, headers=self.headers, json=payload, verify=False)
+            update_response = self.transport.post(transition_url, headers=self.headers, json=payload, verify=False)
             if update_response.status_code == 204:
-                print(f"Issue '{issue_key}' successfully transitioned to '{new_status_name}'.")
-            else:
-                raise Exception(f"Failed to transition issue '{issue_key}'. Status code: {update_response.status_code}, Response: {update_response.text}")
+                logger.debug("Issue '%s' successfully transitioned to '%s'.", issue_key, new_status_name)
+                return True
+            if from_cache and update_response.status_code in [400, 409]:
+                # the issue was not in the expected status or the workflow changed, refresh and try again
+                self.transition_cache.invalidate(cache_key)
+                return self.update_issue_status(issue_key, new_status_name)
+            raise Exception(f"Failed to transition issue '{issue_key}'. Status code: {update_response.status_code}, Response: {update_response.text}")
         except requests.RequestException as e:
             raise Exception(f"Failed to update status for issue '{issue_key}': {e}")
 
+    def _get_transitions(self, issue_key):
+        """
+        :return: tuple (issue type name, current status name, list of available transitions)
+        """
+        url = f"{self.base_url}/rest/api/2/issue/{issue_key}"
+        params = {
+            "fields": "status,issuetype",
+            "expand": "transitions"
+        }
+        try:
+            response = self.transport.get(url, headers=self.headers, params=params, verify=False)
+            if response.status_code != 200:
+                raise Exception(f"Issue '{issue_key}' not found or failed to get transitions. Status code: {response.status_code}")
+        except requests.RequestException as e:
+            raise Exception(f"Failed to get transitions for issue '{issue_key}': {e}")
+
+        issue_data = response.json()
+        return (issue_data["fields"]["issuetype"]["name"], issue_data["fields"]["status"]["name"],
+                issue_data.get("transitions", []))
+
+
+class _MultipartBody:
+    """
+    multipart/form-data request body with a single file field, streamed from a seekable file. Iterating starts over
+    at the beginning of the file, so the body can be sent again, and its length is known up front, so it is sent
+    with a Content-Length rather than chunked.
+    """
+
+    def __init__(self, field, filename, file, size, chunk_size):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        quoted = filename.replace("\\", "\\\\").replace('"', '\\"')
+        self.head = (f"--{boundary}\r\n"
+                     f'Content-Disposition: form-data; name="{field}"; filename="{quoted}"\r\n'
+                     "Content-Type: application/octet-stream\r\n\r\n").encode("utf-8")
+        self.tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self.file = file
+        self.size = size
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return len(self.head) + self.size + len(self.tail)
+
+    def __iter__(self):
+        self.file.seek(0)
+        yield self.head
+        while True:
+            chunk = self.file.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        yield self.tail
+
+
+def _workflow_of(issue_key):
+    # workflows are assigned per project, so the project key stands for the workflow scheme
+    return issue_key.rsplit("-", 1)[0]
+
+
+class TransitionCache:
+    """
+    Available transitions keyed by (workflow, issue type, current status), which is all they depend on.
+    Entries expire after `ttl` seconds and can be invalidated when JIRA rejects a cached transition.
+    """
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, transitions = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            return transitions
+
+    def put(self, key, transitions):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, transitions)
+
+    def invalidate(self, key=None):
+        """
+        Drops one entry, or the whole cache if no key is given
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
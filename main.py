@@ -1,28 +1,124 @@
+from comment_sync import CommentSync
 from config_reader import Config
 from gitlab_api import GitlabApi
+from http_cache import ResponseCache
+from http_transport import Transport
+from issue_mapping import IssueMapper
 from jira_api import JiraApi, JiraIssue
+import logging
+from metrics import Metrics, profile
 import os
+from orchestrator import SyncOrchestrator
 from synchronizer import Synchronizer
+from sync_plan import PlanExecutor, SyncPlan, SyncPlanner
+from webhook_server import WebhookService
+
+logger = logging.getLogger("main")
 
 if __name__ == "__main__":
+    # LOG_LEVEL=DEBUG also logs every item
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    # request metrics and phase timers, written to SYNC_METRICS (.prom for Prometheus, JSON otherwise) at the end
+    metrics = Metrics(enabled=bool(os.environ.get("SYNC_METRICS")))
+
     jira_base_url = os.environ["JIRA_URL"]
     issue_key = "PLAT-2"
     jira_token = os.environ["JIRA_TOKEN"]
 
-    jira = JiraApi(jira_base_url, jira_token)
+    config = Config("config.json")
+
+    # items synced concurrently per job, and jobs run concurrently when several are configured
+    workers = int(os.environ.get("SYNC_WORKERS", "1"))
+    job_workers = int(os.environ.get("SYNC_JOBS", "4")) if config.get_jobs() else 1
+    pool_size = max(workers * job_workers, 10)
+
+    # optional cap on the requests in flight to each host, shared by all jobs
+    host_concurrency = int(os.environ["HOST_CONCURRENCY"]) if os.environ.get("HOST_CONCURRENCY") else None
+
+    jira = JiraApi(jira_base_url, jira_token, transport=Transport(pool_size=pool_size, verify=False,
+                                                                  max_concurrent_per_host=host_concurrency,
+                                                                  metrics=metrics))
 
     gitlab_base_url = os.environ["GITLAB_BASE_URL"]
     gitlab_access_token = os.environ["GITLAB_TOKEN"]
 
-    print("Read base URL: " + gitlab_base_url)
-    print("Read access token: (length: " + str(len(gitlab_access_token)) + ")")
+    logger.info("Read base URL: %s", gitlab_base_url)
+    logger.info("Read access token: (length: %d)", len(gitlab_access_token))
 
-    gitlab_api = GitlabApi(base_url=gitlab_base_url, access_token=gitlab_access_token)
+    # optional on-disk cache of Gitlab reads, revalidated with ETags; project listings are reused for an hour
+    gitlab_cache = None
+    if os.environ.get("GITLAB_CACHE_DIR"):
+        gitlab_cache = ResponseCache(os.environ["GITLAB_CACHE_DIR"], ttls={r"/groups/[^/]+/projects$": 3600})
 
-    config = Config("config.json")
+    gitlab_api = GitlabApi(base_url=gitlab_base_url, access_token=gitlab_access_token,
+                           transport=Transport(pool_size=pool_size, cache=gitlab_cache,
+                                               max_concurrent_per_host=host_concurrency, metrics=metrics),
+                           id_cache_path=os.environ.get("GITLAB_ID_CACHE"),
+                           # GITLAB_GRAPHQL=1 lists issues and epics with only the synced fields
+                           graphql=os.environ.get("GITLAB_GRAPHQL") == "1")
+
+    # a .db / .sqlite path selects the SQLite mapping store
+    mapper = IssueMapper.from_path(os.environ.get("ISSUE_MAPPING_PATH", "issue_mapping.csv"))
+
+    sync_options = {
+        "incremental": os.environ.get("SYNC_INCREMENTAL") == "1",
+        "workers": workers,
+        "bulk_create": os.environ.get("SYNC_BULK_CREATE") == "1",
+        "metrics": metrics
+    }
+
+    # copy the comments of synced items, and the files they link, after the Gitlab => JIRA sync
+    comments = os.environ.get("SYNC_COMMENTS") == "1"
+
+    # push title and status changes made in JIRA back to Gitlab after the Gitlab => JIRA sync
+    reverse = os.environ.get("SYNC_JIRA_TO_GITLAB") == "1"
+
+    # SYNC_PROFILE=cprofile or tracemalloc profiles the sync, cProfile statistics go to SYNC_PROFILE_OUT
+    with profile(os.environ.get("SYNC_PROFILE") or None, os.environ.get("SYNC_PROFILE_OUT")):
+        logger.info("Synchronizing Gitlab => JIRA")
+        if os.environ.get("WEBHOOK_PORT"):
+            # sync single items as Gitlab reports changes, instead of scanning the whole group/project; events of
+            # other groups and projects are ignored
+            sync = Synchronizer(jira_api=jira, gitlab_api=gitlab_api,
+                                gitlab_group=os.environ.get("GITLAB_GROUP", "galileo-genai"),
+                                gitlab_project=os.environ.get("GITLAB_PROJECT", "aws-infra"),
+                                config=config, mapper=mapper, metrics=metrics)
+            WebhookService(sync, host=os.environ.get("WEBHOOK_HOST", "0.0.0.0"),
+                           port=int(os.environ["WEBHOOK_PORT"]), secret_token=os.environ.get("WEBHOOK_TOKEN"),
+                           workers=workers).serve_forever()
+        elif config.get_jobs():
+            # the group => JIRA project pairs listed under gitlab_to_jira.jobs in config.json
+            SyncOrchestrator(jira_api=jira, gitlab_api=gitlab_api, config=config, mapper=mapper,
+                             workers=job_workers, include_issues=True, comments=comments, reverse=reverse,
+                             **sync_options).run()
+        else:
+            sync = Synchronizer(jira_api=jira, gitlab_api=gitlab_api,
+                                gitlab_group=os.environ.get("GITLAB_GROUP", "galileo-genai"),
+                                gitlab_project=os.environ.get("GITLAB_PROJECT", "aws-infra"),
+                                config=config, mapper=mapper, **sync_options)
+            if os.environ.get("SYNC_PLAN"):
+                # dry run: write the plan of the sync for review instead of syncing
+                SyncPlanner(sync).plan().save(os.environ["SYNC_PLAN"])
+            elif os.environ.get("SYNC_APPLY_PLAN"):
+                PlanExecutor(sync).execute(SyncPlan.load(os.environ["SYNC_APPLY_PLAN"]))
+            else:
+                sync.sync_gitlab_to_jira()
+            if comments:
+                logger.info("Copying Gitlab comments => JIRA")
+                CommentSync(sync).run()
+            if reverse:
+                logger.info("Synchronizing JIRA => Gitlab")
+                sync.sync_jira_to_gitlab()
+    mapper.close()
+
+    logger.info("JIRA requests: %s", jira.transport.stats())
+    logger.info("Gitlab requests: %s", gitlab_api.transport.stats())
 
-    print("Synchronizing Gitlab => JIRA")
-    sync = Synchronizer(jira_api=jira, gitlab_api=gitlab_api, gitlab_group="galileo-genai", gitlab_project="aws-infra",
-                        config=config)
-    sync.sync_gitlab_to_jira()
+    if os.environ.get("SYNC_METRICS"):
+        for client, transport in (("jira", jira.transport), ("gitlab", gitlab_api.transport)):
+            for name, value in transport.stats().items():
+                metrics.gauge("transport_" + name, value, client=client)
+        metrics.write(os.environ["SYNC_METRICS"])
 
@@ -0,0 +1,737 @@
+import csv
+import json
+import os
+import sqlite3
+import sys
+
+FIELDNAMES = ["jira_issue", "gitlab_issue", "type"]
+# per-item sync state, see MappingStore.get_sync_state
+STATE_FIELDS = ["updated_at", "content_hash", "status", "title", "gitlab_ref", "note_id", "epic_key"]
+# files attached to JIRA issues, see MappingStore.add_attachment
+ATTACHMENT_FIELDS = ["jira_issue", "source", "content_hash", "attachment_id", "filename"]
+# JIRA issue creations which were started but whose mapping may not have been written, see add_pending_creations
+CREATION_FIELDS = ["type", "gitlab_issue", "project_key", "issue_type", "title", "started_at", "scope"]
+
+
+class MappingStore:
+    """
+    Storage backend used by IssueMapper. Keeps the Gitlab => JIRA mappings and the per-item sync state
+    (last synced `updated_at`, content hash, JIRA status and title, Gitlab reference, last synced note) of each
+    mapped item, as well as the files attached to JIRA issues.
+    """
+
+    def get_jira_issue(self, gitlab_issue, type):
+        raise NotImplementedError
+
+    def get_gitlab_issue(self, jira_issue):
+        raise NotImplementedError
+
+    def add_mapping(self, jira_issue, gitlab_issue, type):
+        """
+        Stores a mapping unless the Gitlab item is already mapped
+        :return: True if the mapping was added, False if it already existed
+        """
+        raise NotImplementedError
+
+    def get_sync_state(self, gitlab_issue, type):
+        """
+        :return: dictionary with keys `updated_at`, `content_hash`, `status` and `title` (last JIRA status and title
+                 known to be in sync on both sides), `gitlab_ref` (`<project_id>#<iid>` for issues,
+                 `<group_id>&<iid>` for epics), `note_id` (ID of the last Gitlab note copied to JIRA) and `epic_key`
+                 (JIRA epic the issue was linked to), or None if the item was never synced
+        """
+        raise NotImplementedError
+
+    def set_sync_state(self, gitlab_issue, type, updated_at=None, content_hash=None, status=None, title=None,
+                       gitlab_ref=None, note_id=None, epic_key=None):
+        raise NotImplementedError
+
+    def get_attachment(self, jira_issue, source=None, content_hash=None):
+        """
+        Looks up a file attached to a JIRA issue by its source or by its content
+        :param source: where the file came from, e.g. `<secret>/<filename>` of a Gitlab upload
+        :param content_hash: SHA-256 of the file content
+        :return: dictionary with the ATTACHMENT_FIELDS, or None
+        """
+        raise NotImplementedError
+
+    def add_attachment(self, jira_issue, source, content_hash, attachment_id, filename):
+        """
+        Records a file attached to a JIRA issue; written out right away, as the upload must not be repeated
+        """
+        raise NotImplementedError
+
+    def attachments(self):
+        """
+        :return: iterator of dictionaries with the ATTACHMENT_FIELDS
+        """
+        raise NotImplementedError
+
+    def set_epic_issues(self, epic_id, issues):
+        """
+        Replaces the recorded issues of a Gitlab epic; an issue belongs to one epic, so recording it under another
+        epic moves it
+        :param epic_id: Gitlab ID of the epic
+        :param issues: list of (gitlab_issue, project_id) tuples
+        """
+        raise NotImplementedError
+
+    def epic_issues(self):
+        """
+        :return: iterator of (epic_id, gitlab_issue, project_id) tuples, the IDs as strings
+        """
+        raise NotImplementedError
+
+    def get_watermark(self, name):
+        """
+        :param name: name of the watermark, e.g. `issues:<group>/<project>`
+        :return: the highest `updated_at` synced so far, or None
+        """
+        raise NotImplementedError
+
+    def set_watermark(self, name, value):
+        raise NotImplementedError
+
+    def watermarks(self):
+        """
+        :return: dictionary of watermark name => value
+        """
+        raise NotImplementedError
+
+    def add_pending_creations(self, creations):
+        """
+        Durably journals JIRA issues about to be created, before the request is sent, so that an issue created by a
+        run which stopped before writing its mapping can be found again instead of being created twice
+        :param creations: list of dictionaries with the CREATION_FIELDS; `started_at` is a JIRA timestamp and `scope`
+                          names the sync which journaled the creation, e.g. its watermark
+        """
+        raise NotImplementedError
+
+    def remove_pending_creation(self, gitlab_issue, type):
+        """
+        Drops a journaled creation once the item is mapped, or known not to have been created. The removal is
+        written out by the next flush, after the mappings.
+        """
+        raise NotImplementedError
+
+    def pending_creations(self):
+        """
+        :return: list of journaled creation dictionaries, oldest first
+        """
+        raise NotImplementedError
+
+    def mappings(self):
+        """
+        :return: iterator of (jira_issue, gitlab_issue, type) tuples
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+def _read_csv_rows(csv_path):
+    with open(csv_path, mode='r', newline='') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            # a row cut short by an interrupted write has missing columns, ignore it
+            if not row.get("jira_issue") or not row.get("gitlab_issue") or not row.get("type"):
+                continue
+            yield row["jira_issue"], row["gitlab_issue"], row["type"]
+
+
+class CsvMappingStore(MappingStore):
+    """
+    Mapping store backed by the original `issue_mapping.csv` format.
+
+    The file is read once into two in-memory indexes, one keyed by (type, gitlab_issue) and a reverse one keyed by
+    the JIRA issue. New mappings are appended in fsync'ed batches of `batch_size` rows. Sync state does not fit the
+    append-only CSV, so it is kept together with the sync watermarks in a JSON file next to it, which is replaced
+    atomically on flush. Pending creations are appended to a JSON lines journal, which is emptied once all of them
+    are resolved. Attachments are appended to a journal of their own as they are added, and moved into the JSON file
+    by the next flush.
+    """
+
+    def __init__(self, csv_path="issue_mapping.csv", batch_size=25, state_path=None, journal_path=None,
+                 attachments_path=None):
+        self.csv_path = csv_path
+        self.state_path = state_path or os.path.splitext(csv_path)[0] + "_state.json"
+        self.journal_path = journal_path or os.path.splitext(csv_path)[0] + "_journal.jsonl"
+        self.attachments_path = attachments_path or os.path.splitext(csv_path)[0] + "_attachments.jsonl"
+        self.batch_size = batch_size
+        self._jira_by_gitlab = {}
+        self._gitlab_by_jira = {}
+        self._pending = []
+        self._state = {}
+        self._watermarks = {}
+        self._state_dirty = False
+        self._creations = {}
+        self._resolved_creations = []
+        self._attachments = {}
+        self._attachments_journaled = False
+        # Gitlab issue ID => [Gitlab epic ID, project ID]
+        self._epic_issues = {}
+        # Gitlab epic ID => set of the Gitlab issue IDs recorded for it
+        self._issues_by_epic = {}
+
+        # create the file if it does not exist
+        if not os.path.exists(self.csv_path) or os.path.getsize(self.csv_path) == 0:
+            with open(self.csv_path, mode='w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+                writer.writeheader()
+        else:
+            for jira_issue, gitlab_issue, type in _read_csv_rows(self.csv_path):
+                self._index(jira_issue, gitlab_issue, type)
+
+        if os.path.exists(self.state_path):
+            with open(self.state_path, mode='r', encoding='utf-8') as f:
+                data = json.load(f)
+                self._state = data.get("items", {})
+                self._watermarks = data.get("watermarks", {})
+                self._attachments = data.get("attachments", {})
+                self._epic_issues = data.get("epic_issues", {})
+                for gitlab_issue, (epic_id, _) in self._epic_issues.items():
+                    self._issues_by_epic.setdefault(epic_id, set()).add(gitlab_issue)
+
+        if os.path.exists(self.journal_path):
+            self._read_journal()
+
+        if os.path.exists(self.attachments_path):
+            self._read_attachments()
+
+    def _index(self, jira_issue, gitlab_issue, type):
+        key = (type, str(gitlab_issue))
+        # the first mapping stored for an item wins, same as the duplicate check in add_mapping
+        if key not in self._jira_by_gitlab:
+            self._jira_by_gitlab[key] = str(jira_issue)
+            self._gitlab_by_jira[str(jira_issue)] = key
+
+    def get_jira_issue(self, gitlab_issue, type):
+        return self._jira_by_gitlab.get((type, str(gitlab_issue)))
+
+    def get_gitlab_issue(self, jira_issue):
+        return self._gitlab_by_jira.get(str(jira_issue))
+
+    def add_mapping(self, jira_issue, gitlab_issue, type):
+        if self.get_jira_issue(gitlab_issue, type) is not None:
+            return False
+
+        self._index(jira_issue, gitlab_issue, type)
+        self._pending.append({
+            "jira_issue": jira_issue,
+            "gitlab_issue": gitlab_issue,
+            "type": type
+        })
+
+        if len(self._pending) >= self.batch_size:
+            self._flush_mappings()
+        return True
+
+    def get_sync_state(self, gitlab_issue, type):
+        state = self._state.get(f"{type}:{gitlab_issue}")
+        return {field: state.get(field) for field in STATE_FIELDS} if state is not None else None
+
+    def set_sync_state(self, gitlab_issue, type, updated_at=None, content_hash=None, status=None, title=None,
+                       gitlab_ref=None, note_id=None, epic_key=None):
+        self._state[f"{type}:{gitlab_issue}"] = {"updated_at": updated_at, "content_hash": content_hash,
+                                                 "status": status, "title": title, "gitlab_ref": gitlab_ref,
+                                                 "note_id": note_id, "epic_key": epic_key}
+        self._state_dirty = True
+
+    def get_attachment(self, jira_issue, source=None, content_hash=None):
+        attachments = self._attachments.get(str(jira_issue), {})
+        if source is not None:
+            attachment = attachments.get(source)
+        else:
+            attachment = next((a for a in attachments.values() if a["content_hash"] == content_hash), None)
+        return dict(attachment, jira_issue=str(jira_issue)) if attachment is not None else None
+
+    def add_attachment(self, jira_issue, source, content_hash, attachment_id, filename):
+        attachment = {"source": source, "content_hash": content_hash, "attachment_id": attachment_id,
+                      "filename": filename}
+        self._attachments.setdefault(str(jira_issue), {})[source] = attachment
+        # the upload must not be repeated, so the record is on disk before this returns
+        with open(self.attachments_path, mode='a', encoding='utf-8') as f:
+            f.write(json.dumps(dict(attachment, jira_issue=str(jira_issue))) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._attachments_journaled = True
+        self._state_dirty = True
+
+    def attachments(self):
+        for jira_issue, attachments in self._attachments.items():
+            for attachment in attachments.values():
+                yield dict(attachment, jira_issue=jira_issue)
+
+    def set_epic_issues(self, epic_id, issues):
+        epic_id = str(epic_id)
+        for gitlab_issue in self._issues_by_epic.pop(epic_id, ()):
+            del self._epic_issues[gitlab_issue]
+        members = set()
+        for gitlab_issue, project_id in issues:
+            gitlab_issue = str(gitlab_issue)
+            previous = self._epic_issues.get(gitlab_issue)
+            if previous is not None and previous[0] != epic_id:
+                # the issue moved here from another epic
+                self._issues_by_epic[previous[0]].discard(gitlab_issue)
+            self._epic_issues[gitlab_issue] = [epic_id, project_id]
+            members.add(gitlab_issue)
+        if members:
+            self._issues_by_epic[epic_id] = members
+        self._state_dirty = True
+
+    def epic_issues(self):
+        for gitlab_issue, (epic_id, project_id) in list(self._epic_issues.items()):
+            yield epic_id, gitlab_issue, project_id
+
+    def get_watermark(self, name):
+        return self._watermarks.get(name)
+
+    def set_watermark(self, name, value):
+        self._watermarks[name] = value
+        self._state_dirty = True
+
+    def watermarks(self):
+        return {name: value for name, value in self._watermarks.items() if value is not None}
+
+    def add_pending_creations(self, creations):
+        entries = [dict({field: creation.get(field) for field in CREATION_FIELDS},
+                        gitlab_issue=str(creation["gitlab_issue"])) for creation in creations]
+        self._append_journal([dict(entry, op="create") for entry in entries])
+        keys = set()
+        for entry in entries:
+            keys.add((entry["type"], entry["gitlab_issue"]))
+            self._creations[(entry["type"], entry["gitlab_issue"])] = entry
+        # a resolution still buffered would be written after this creation and drop it when the journal is read
+        self._resolved_creations = [resolved for resolved in self._resolved_creations
+                                    if (resolved["type"], resolved["gitlab_issue"]) not in keys]
+
+    def remove_pending_creation(self, gitlab_issue, type):
+        if self._creations.pop((type, str(gitlab_issue)), None) is not None:
+            self._resolved_creations.append({"op": "resolve", "type": type, "gitlab_issue": str(gitlab_issue)})
+
+    def pending_creations(self):
+        return [dict(creation) for creation in self._creations.values()]
+
+    def mappings(self):
+        for (type, gitlab_issue), jira_issue in self._jira_by_gitlab.items():
+            yield jira_issue, gitlab_issue, type
+
+    def flush(self):
+        self._flush_mappings()
+        self._flush_state()
+        self._flush_journal()
+
+    def _flush_mappings(self):
+        if not self._pending:
+            return
+
+        with open(self.csv_path, mode='a', newline='') as f:
+            # if the last write was interrupted mid-row, start the batch on a fresh line
+            if not self._ends_with_newline():
+                f.write("\r\n")
+            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+            writer.writerows(self._pending)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._pending = []
+
+    def _flush_state(self):
+        if not self._state_dirty:
+            return
+
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, mode='w', encoding='utf-8') as f:
+            json.dump({"items": self._state, "watermarks": self._watermarks, "attachments": self._attachments,
+                       "epic_issues": self._epic_issues}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+        self._state_dirty = False
+        if self._attachments_journaled:
+            # the attachments are in the JSON file now, start their journal over
+            with open(self.attachments_path, mode='w', encoding='utf-8') as f:
+                f.flush()
+                os.fsync(f.fileno())
+            self._attachments_journaled = False
+
+    def _flush_journal(self):
+        if not self._resolved_creations:
+            return
+
+        if self._creations:
+            self._append_journal(self._resolved_creations)
+        else:
+            # nothing left pending, start the journal over
+            with open(self.journal_path, mode='w', encoding='utf-8') as f:
+                f.flush()
+                os.fsync(f.fileno())
+
+        self._resolved_creations = []
+
+    def _append_journal(self, entries):
+        with open(self.journal_path, mode='a', encoding='utf-8') as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in entries)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read_journal(self):
+        with open(self.journal_path, mode='r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line cut short by an interrupted write
+                    continue
+                key = (entry.get("type"), entry.get("gitlab_issue"))
+                if entry.get("op") == "create":
+                    self._creations[key] = {field: entry.get(field) for field in CREATION_FIELDS}
+                elif entry.get("op") == "resolve":
+                    self._creations.pop(key, None)
+
+    def _read_attachments(self):
+        with open(self.attachments_path, mode='r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    attachment = json.loads(line)
+                except ValueError:
+                    # a line cut short by an interrupted write
+                    continue
+                jira_issue = attachment.pop("jira_issue")
+                self._attachments.setdefault(jira_issue, {})[attachment["source"]] = attachment
+                # kept in the journal until the next flush moves them into the JSON file
+                self._attachments_journaled = True
+                self._state_dirty = True
+
+    def _ends_with_newline(self):
+        with open(self.csv_path, mode='rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) in (b"\n", b"\r")
+
+    def __len__(self):
+        return len(self._jira_by_gitlab)
+
+
+class SqliteMappingStore(MappingStore):
+    """
+    Mapping store backed by a SQLite database in WAL mode, safe to share between several processes.
+
+    Mappings are looked up through the (type, gitlab_issue) primary key and the jira_issue index. New mappings are
+    buffered and inserted in a single transaction per batch of `batch_size` rows.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS issue_mapping (
+            type TEXT NOT NULL,
+            gitlab_issue TEXT NOT NULL,
+            jira_issue TEXT NOT NULL,
+            PRIMARY KEY (type, gitlab_issue)
+        );
+        CREATE INDEX IF NOT EXISTS idx_issue_mapping_jira_issue ON issue_mapping (jira_issue);
+        CREATE TABLE IF NOT EXISTS sync_state (
+            type TEXT NOT NULL,
+            gitlab_issue TEXT NOT NULL,
+            updated_at TEXT,
+            content_hash TEXT,
+            status TEXT,
+            title TEXT,
+            gitlab_ref TEXT,
+            note_id INTEGER,
+            epic_key TEXT,
+            PRIMARY KEY (type, gitlab_issue)
+        );
+        CREATE TABLE IF NOT EXISTS watermarks (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS attachments (
+            jira_issue TEXT NOT NULL,
+            source TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            attachment_id TEXT,
+            filename TEXT,
+            PRIMARY KEY (jira_issue, source)
+        );
+        CREATE INDEX IF NOT EXISTS idx_attachments_content_hash ON attachments (jira_issue, content_hash);
+        CREATE TABLE IF NOT EXISTS epic_issues (
+            gitlab_issue TEXT PRIMARY KEY,
+            epic_id TEXT NOT NULL,
+            project_id INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_epic_issues_epic_id ON epic_issues (epic_id);
+        CREATE TABLE IF NOT EXISTS pending_creations (
+            type TEXT NOT NULL,
+            gitlab_issue TEXT NOT NULL,
+            project_key TEXT,
+            issue_type TEXT,
+            title TEXT,
+            started_at TEXT,
+            scope TEXT,
+            PRIMARY KEY (type, gitlab_issue)
+        );
+    """
+
+    def __init__(self, db_path="issue_mapping.db", batch_size=25, timeout=30):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        # autocommit mode, transactions are opened explicitly around each batch
+        self._conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._add_missing_columns("sync_state", {"status": "TEXT", "title": "TEXT", "gitlab_ref": "TEXT",
+                                                 "note_id": "INTEGER", "epic_key": "TEXT"})
+        self._add_missing_columns("pending_creations", {"scope": "TEXT"})
+        self._pending = {}
+        self._pending_state = {}
+        self._resolved_creations = set()
+
+    def get_jira_issue(self, gitlab_issue, type):
+        key = (type, str(gitlab_issue))
+        if key in self._pending:
+            return self._pending[key]
+        row = self._conn.execute("SELECT jira_issue FROM issue_mapping WHERE type = ? AND gitlab_issue = ?",
+                                 key).fetchone()
+        return row[0] if row else None
+
+    def get_gitlab_issue(self, jira_issue):
+        for key, pending_jira_issue in self._pending.items():
+            if pending_jira_issue == str(jira_issue):
+                return key
+        row = self._conn.execute("SELECT type, gitlab_issue FROM issue_mapping WHERE jira_issue = ?",
+                                 (str(jira_issue),)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def add_mapping(self, jira_issue, gitlab_issue, type):
+        if self.get_jira_issue(gitlab_issue, type) is not None:
+            return False
+
+        self._pending[(type, str(gitlab_issue))] = str(jira_issue)
+
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        return True
+
+    def get_sync_state(self, gitlab_issue, type):
+        key = (type, str(gitlab_issue))
+        if key in self._pending_state:
+            return dict(self._pending_state[key])
+        row = self._conn.execute(f"SELECT {', '.join(STATE_FIELDS)} FROM sync_state "
+                                 "WHERE type = ? AND gitlab_issue = ?", key).fetchone()
+        return dict(zip(STATE_FIELDS, row)) if row else None
+
+    def set_sync_state(self, gitlab_issue, type, updated_at=None, content_hash=None, status=None, title=None,
+                       gitlab_ref=None, note_id=None, epic_key=None):
+        self._pending_state[(type, str(gitlab_issue))] = {"updated_at": updated_at, "content_hash": content_hash,
+                                                          "status": status, "title": title, "gitlab_ref": gitlab_ref,
+                                                          "note_id": note_id, "epic_key": epic_key}
+
+        if len(self._pending_state) >= self.batch_size:
+            self.flush()
+
+    def get_attachment(self, jira_issue, source=None, content_hash=None):
+        column, value = ("source", source) if source is not None else ("content_hash", content_hash)
+        row = self._conn.execute(f"SELECT {', '.join(ATTACHMENT_FIELDS)} FROM attachments "
+                                 f"WHERE jira_issue = ? AND {column} = ?", (str(jira_issue), value)).fetchone()
+        return dict(zip(ATTACHMENT_FIELDS, row)) if row else None
+
+    def add_attachment(self, jira_issue, source, content_hash, attachment_id, filename):
+        with self._transaction():
+            self._conn.execute(f"INSERT OR REPLACE INTO attachments ({', '.join(ATTACHMENT_FIELDS)}) "
+                               "VALUES (?, ?, ?, ?, ?)",
+                               (str(jira_issue), source, content_hash, str(attachment_id), filename))
+
+    def attachments(self):
+        for row in self._conn.execute(f"SELECT {', '.join(ATTACHMENT_FIELDS)} FROM attachments"):
+            yield dict(zip(ATTACHMENT_FIELDS, row))
+
+    def set_epic_issues(self, epic_id, issues):
+        with self._transaction():
+            self._conn.execute("DELETE FROM epic_issues WHERE epic_id = ?", (str(epic_id),))
+            self._conn.executemany("INSERT OR REPLACE INTO epic_issues (gitlab_issue, epic_id, project_id) "
+                                   "VALUES (?, ?, ?)",
+                                   [(str(gitlab_issue), str(epic_id), project_id)
+                                    for gitlab_issue, project_id in issues])
+
+    def epic_issues(self):
+        return iter(self._conn.execute("SELECT epic_id, gitlab_issue, project_id FROM epic_issues").fetchall())
+
+    def get_watermark(self, name):
+        row = self._conn.execute("SELECT value FROM watermarks WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, name, value):
+        # the items below the watermark must be on disk before the watermark itself
+        self.flush()
+        with self._transaction():
+            self._conn.execute("INSERT OR REPLACE INTO watermarks (name, value) VALUES (?, ?)", (name, value))
+
+    def watermarks(self):
+        return dict(self._conn.execute("SELECT name, value FROM watermarks WHERE value IS NOT NULL"))
+
+    def add_pending_creations(self, creations):
+        rows = [tuple(str(creation[field]) if field == "gitlab_issue" else creation.get(field)
+                      for field in CREATION_FIELDS) for creation in creations]
+        # committed right away, the creation request is only sent once its journal entry is on disk
+        with self._transaction():
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO pending_creations ({', '.join(CREATION_FIELDS)}) "
+                f"VALUES (?{', ?' * (len(CREATION_FIELDS) - 1)})", rows)
+        for row in rows:
+            self._resolved_creations.discard((row[0], row[1]))
+
+    def remove_pending_creation(self, gitlab_issue, type):
+        self._resolved_creations.add((type, str(gitlab_issue)))
+
+    def pending_creations(self):
+        rows = self._conn.execute(f"SELECT {', '.join(CREATION_FIELDS)} FROM pending_creations "
+                                  "ORDER BY started_at").fetchall()
+        return [dict(zip(CREATION_FIELDS, row)) for row in rows if (row[0], row[1]) not in self._resolved_creations]
+
+    def mappings(self):
+        self.flush()
+        for row in self._conn.execute("SELECT jira_issue, gitlab_issue, type FROM issue_mapping"):
+            yield row[0], row[1], row[2]
+
+    def flush(self):
+        if not self._pending and not self._pending_state and not self._resolved_creations:
+            return
+
+        with self._transaction():
+            # another process may have mapped the same item in the meantime, its mapping is kept
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO issue_mapping (type, gitlab_issue, jira_issue) VALUES (?, ?, ?)",
+                [(type, gitlab_issue, jira_issue) for (type, gitlab_issue), jira_issue in self._pending.items()])
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO sync_state (type, gitlab_issue, {', '.join(STATE_FIELDS)}) "
+                f"VALUES (?, ?{', ?' * len(STATE_FIELDS)})",
+                [(type, gitlab_issue, *(state[field] for field in STATE_FIELDS))
+                 for (type, gitlab_issue), state in self._pending_state.items()])
+            self._conn.executemany("DELETE FROM pending_creations WHERE type = ? AND gitlab_issue = ?",
+                                   list(self._resolved_creations))
+
+        self._pending = {}
+        self._pending_state = {}
+        self._resolved_creations = set()
+
+    def _add_missing_columns(self, table, columns):
+        # databases created by an older version lack the columns added since
+        existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+        for name, column_type in columns.items():
+            if name not in existing:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def __len__(self):
+        self.flush()
+        return self._conn.execute("SELECT COUNT(*) FROM issue_mapping").fetchone()[0]
+
+
+class _Transaction:
+    """
+    Wraps a block of statements in BEGIN IMMEDIATE / COMMIT, rolling back on error
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        # take the write lock up front so concurrent writers wait on busy_timeout instead of failing mid-batch
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+def create_store(path, batch_size=25):
+    """
+    Opens the mapping store for the given path; `.db`, `.sqlite` and `.sqlite3` files use the SQLite backend,
+    anything else the CSV backend
+    """
+    if os.path.splitext(path)[1].lower() in (".db", ".sqlite", ".sqlite3"):
+        return SqliteMappingStore(path, batch_size=batch_size)
+    return CsvMappingStore(path, batch_size=batch_size)
+
+
+def import_csv(csv_path, store):
+    """
+    Copies all mappings, sync state, attachments, epic issues, watermarks and pending creations from an existing
+    mapping CSV into another store
+    :param csv_path: path of the mapping CSV
+    :param store: destination MappingStore
+    :return: number of mappings added to the store
+    """
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(f"Mapping file not found: {csv_path}")
+
+    source = CsvMappingStore(csv_path)
+    imported = 0
+    for jira_issue, gitlab_issue, type in source.mappings():
+        if store.add_mapping(jira_issue, gitlab_issue, type):
+            imported += 1
+        state = source.get_sync_state(gitlab_issue, type)
+        if state is not None:
+            store.set_sync_state(gitlab_issue, type, **state)
+    store.flush()
+
+    # without them, files already uploaded to JIRA would be uploaded again
+    for attachment in source.attachments():
+        if store.get_attachment(attachment["jira_issue"], source=attachment["source"]) is None:
+            store.add_attachment(*(attachment[field] for field in ATTACHMENT_FIELDS))
+
+    epics = {}
+    for epic_id, gitlab_issue, project_id in source.epic_issues():
+        epics.setdefault(epic_id, []).append((gitlab_issue, project_id))
+    for epic_id, issues in epics.items():
+        store.set_epic_issues(epic_id, issues)
+
+    # without them, issues created by an interrupted run would be created a second time
+    pending = [creation for creation in source.pending_creations()
+               if store.get_jira_issue(creation["gitlab_issue"], creation["type"]) is None]
+    if pending:
+        store.add_pending_creations(pending)
+
+    # the items below a watermark are in the store now; a watermark the store already has further along is kept
+    for name, value in source.watermarks().items():
+        stored = store.get_watermark(name)
+        if stored is None or value > stored:
+            store.set_watermark(name, value)
+    return imported
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python mapping_store.py <issue_mapping.csv> <issue_mapping.db>")
+        sys.exit(1)
+
+    with SqliteMappingStore(sys.argv[2]) as target:
+        count = import_csv(sys.argv[1], target)
+    print(f"Imported {count} mappings from {sys.argv[1]} into {sys.argv[2]}")
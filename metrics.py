@@ -0,0 +1,265 @@
+import contextlib
+import cProfile
+import json
+import logging
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# upper bounds in seconds of the request latency buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# prefix of the metric names in the Prometheus output
+PREFIX = "reposync_"
+
+_JIRA_KEY = re.compile(r"[A-Z][A-Z0-9_]*-\d+")
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        cumulative, buckets = 0, {}
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class Metrics:
+    """
+    Counters, gauges, histograms and phase timers of a sync run, written out as a Prometheus text file or JSON at
+    the end of the run. Metrics are identified by name and keyword labels. A disabled instance records nothing, and
+    its timers are shared no-op context managers, so instrumented code costs a method call when metrics are off.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.started = time.monotonic()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, phase):
+        """
+        Context manager adding the time spent in its block to the `phase_seconds_total` of a phase. Phases timed on
+        several threads add up, so a phase can take longer in total than the run.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _PhaseTimer(self, phase)
+
+    def timed(self, items, phase):
+        """
+        Wraps an iterator so the time spent waiting for each item is added to a phase, e.g. fetching pages
+        """
+        if not self.enabled:
+            return items
+        return self._timed(iter(items), phase)
+
+    def _timed(self, items, phase):
+        while True:
+            with self.timer(phase):
+                item = next(items, _END)
+            if item is _END:
+                return
+            yield item
+
+    def observe_request(self, method, url, status, seconds, sent_bytes, received_bytes):
+        """
+        Records one HTTP request under its endpoint, which is its path with IDs and keys replaced by placeholders
+        """
+        if not self.enabled:
+            return
+        endpoint = endpoint_of(url)
+        host = urlsplit(url).hostname
+        self.count("http_requests_total", host=host, method=method, endpoint=endpoint, status=status)
+        self.observe("http_request_seconds", seconds, host=host, method=method, endpoint=endpoint)
+        self.count("http_sent_bytes_total", sent_bytes, host=host, method=method, endpoint=endpoint)
+        self.count("http_received_bytes_total", received_bytes, host=host, method=method, endpoint=endpoint)
+
+    def to_dict(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: histogram.to_dict() for key, histogram in self._histograms.items()}
+        return {
+            "elapsed_seconds": time.monotonic() - self.started,
+            "counters": [_entry(key, value=value) for key, value in sorted(counters.items())],
+            "gauges": [_entry(key, value=value) for key, value in sorted(gauges.items())],
+            "histograms": [_entry(key, **histogram) for key, histogram in sorted(histograms.items())]
+        }
+
+    def to_prometheus(self):
+        data = self.to_dict()
+        lines = []
+        typed = set()
+
+        def sample(name, labels, value, metric_type):
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name} {metric_type}")
+                typed.add(name)
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+
+        for entry in data["counters"]:
+            sample(entry["name"], entry["labels"], entry["value"], "counter")
+        for entry in data["gauges"]:
+            sample(entry["name"], entry["labels"], entry["value"], "gauge")
+        for entry in data["histograms"]:
+            name = entry["name"]
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                typed.add(name)
+            for bound, count in entry["buckets"].items():
+                lines.append(f"{PREFIX}{name}_bucket{_labels(dict(entry['labels'], le=bound))} {count}")
+            lines.append(f"{PREFIX}{name}_sum{_labels(entry['labels'])} {entry['sum']}")
+            lines.append(f"{PREFIX}{name}_count{_labels(entry['labels'])} {entry['count']}")
+        sample("elapsed_seconds", {}, data["elapsed_seconds"], "gauge")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Writes the metrics to a file, in the Prometheus text format if the path ends with `.prom`, as JSON otherwise
+        """
+        if not self.enabled:
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=2)
+        logger.info("Metrics written to %s", path)
+
+
+class _PhaseTimer:
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.count("phase_seconds_total", time.perf_counter() - self.start, phase=self.phase)
+        self.metrics.count("phase_calls_total", phase=self.phase)
+
+
+# shared by all disabled Metrics instances
+_NULL_TIMER = contextlib.nullcontext()
+_END = object()
+
+# metrics which record nothing, the default of all instrumented classes
+DISABLED = Metrics(enabled=False)
+
+
+def endpoint_of(url):
+    """
+    :return: path of the URL with numeric IDs, JIRA issue keys and URL-encoded Gitlab paths replaced by
+             `{id}`, `{key}` and `{path}`, so the number of distinct endpoints stays small
+    """
+    segments = []
+    for segment in urlsplit(url).path.split("/"):
+        if segment.isdigit() and segments and segments[-1] == "api":
+            pass  # API version, e.g. /rest/api/2
+        elif segment.isdigit():
+            segment = "{id}"
+        elif _JIRA_KEY.fullmatch(segment):
+            segment = "{key}"
+        elif "%2F" in segment.upper():
+            segment = "{path}"
+        segments.append(segment)
+    return "/".join(segments)
+
+
+@contextlib.contextmanager
+def profile(kind, path=None):
+    """
+    Profiles the block with cProfile or tracemalloc
+    :param kind: "cprofile", "tracemalloc", or None to not profile
+    :param path: file the cProfile statistics are written to, for `python -m pstats` or snakeviz
+    """
+    if kind is None:
+        yield
+    elif kind == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            path = path or "sync.prof"
+            profiler.dump_stats(path)
+            logger.info("cProfile statistics written to %s", path)
+            if logger.isEnabledFor(logging.DEBUG):
+                pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+    elif kind == "tracemalloc":
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            logger.info("Memory: %.1f MiB allocated, %.1f MiB peak", current / 2 ** 20, peak / 2 ** 20)
+            for stat in snapshot.statistics("lineno")[:20]:
+                logger.info("%s", stat)
+    else:
+        raise ValueError(f"Unknown profiler '{kind}', expected 'cprofile' or 'tracemalloc'")
+
+
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _entry(key, **fields):
+    name, labels = key
+    return dict({"name": name, "labels": dict(labels)}, **fields)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    values = ((k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+              for k, v in sorted(labels.items()))
+    return "{" + ",".join(f'{k}="{v}"' for k, v in values) + "}"
@@ -0,0 +1,155 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from comment_sync import CommentSync
+from config_reader import Config
+from gitlab_api import GitlabApi
+from issue_mapping import IssueMapper
+from jira_api import JiraApi
+from synchronizer import Synchronizer
+
+logger = logging.getLogger(__name__)
+
+
+class JobResult:
+    """
+    Outcome of one orchestrated sync: an epic sync of a group or an issue sync of a project
+    """
+
+    def __init__(self, name, seconds, counts=None, error=None):
+        self.name = name
+        self.seconds = seconds
+        self.counts = counts
+        self.error = error
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+    def __str__(self):
+        if self.error is not None:
+            return f"{self.name}: FAILED after {self.seconds:.1f}s: {self.error}"
+        counts = ", ".join(f"{k}={v}" for k, v in sorted((self.counts or {}).items()))
+        return f"{self.name}: {self.seconds:.1f}s ({counts})"
+
+
+class SyncOrchestrator:
+    """
+    Runs the sync for several Gitlab group/project => JIRA project pairs on a thread pool.
+
+    All jobs share the same API clients, and through them the HTTP sessions, caches and rate limits, as well as the
+    issue mapper. Epics belong to a group, so they are synced once per group before the issue syncs of the group's
+    projects start, and so are the issues of each epic when issues are linked to their epics. With `comments`, the
+    Gitlab comments are then copied the same way, and with `reverse`, JIRA changes are pushed back to Gitlab once per
+    JIRA project. A failing job is reported and does not stop the others.
+    """
+
+    def __init__(self, jira_api: JiraApi, gitlab_api: GitlabApi, config: Config, mapper: IssueMapper, jobs=None,
+                 workers=4, include_issues=False, comments=False, reverse=False, **sync_options):
+        """
+        :param jobs: list of job dictionaries as returned by Config.get_jobs(), defaults to the configured jobs
+        :param workers: number of jobs run at the same time
+        :param include_issues: also sync the issues of each project, not only the epics of each group
+        :param comments: also copy the comments of the synced items and the files they link, see CommentSync
+        :param reverse: also sync title and status changes from JIRA back to Gitlab
+        :param sync_options: keyword arguments passed to every Synchronizer, e.g. `incremental` or `workers`
+        """
+        self.jira_api = jira_api
+        self.gitlab_api = gitlab_api
+        self.config = config
+        self.mapper = mapper
+        self.jobs = jobs if jobs is not None else config.get_jobs()
+        self.workers = workers
+        self.include_issues = include_issues
+        self.comments = comments
+        self.reverse = reverse
+        self.sync_options = sync_options
+        # groups whose epic issues the epic job of this run already scanned
+        self._scanned_groups = set()
+
+    def run(self):
+        """
+        :return: list of JobResult, epic syncs first, then issue and comment syncs, and JIRA => Gitlab syncs last
+        """
+        start = time.perf_counter()
+        self._scanned_groups = set()
+
+        # a Gitlab item maps to a single JIRA issue, so epics are synced once per group, to the JIRA project of the
+        # group's first job
+        epic_jobs = {}
+        for job in self.jobs:
+            epic_jobs.setdefault(job["gitlab_group"], job)
+
+        # jobs without a project only sync the epics of their group
+        issue_jobs = [job for job in self.jobs if job.get("gitlab_project") is not None]
+
+        try:
+            results = self._run_all(list(epic_jobs.values()), "epics")
+            if self.include_issues:
+                results += self._run_all(issue_jobs, "issues")
+            if self.comments:
+                results += self._run_all(list(epic_jobs.values()), "epic_comments")
+                if self.include_issues:
+                    results += self._run_all(issue_jobs, "issue_comments")
+            if self.reverse:
+                # the JIRA search covers a whole JIRA project, whichever Gitlab project its issues came from
+                reverse_jobs = {}
+                for job in self.jobs:
+                    reverse_jobs.setdefault(job["jira_project_key"], job)
+                results += self._run_all(list(reverse_jobs.values()), "jira")
+        finally:
+            self.mapper.flush()
+
+        failed = sum(1 for result in results if not result.succeeded)
+        logger.info("Ran %d sync jobs in %.1fs, %d failed", len(results), time.perf_counter() - start, failed)
+        for result in results:
+            if result.succeeded:
+                logger.info("%s", result)
+            else:
+                logger.error("%s", result)
+        return results
+
+    def _run_all(self, jobs, kind):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(lambda job: self._run_job(job, kind), jobs))
+
+    def _run_job(self, job, kind):
+        if kind == "epics":
+            name = f"{job['gitlab_group']} epics => {job['jira_project_key']}"
+        elif kind == "epic_comments":
+            name = f"{job['gitlab_group']} epic comments => {job['jira_project_key']}"
+        elif kind == "issue_comments":
+            name = f"{job['gitlab_group']}/{job['gitlab_project']} issue comments => {job['jira_project_key']}"
+        elif kind == "jira":
+            name = f"{job['jira_project_key']} => Gitlab"
+        else:
+            name = f"{job['gitlab_group']}/{job['gitlab_project']} issues => {job['jira_project_key']}"
+
+        start = time.perf_counter()
+        try:
+            sync = Synchronizer(jira_api=self.jira_api, gitlab_api=self.gitlab_api,
+                                gitlab_group=job["gitlab_group"], gitlab_project=job.get("gitlab_project"),
+                                config=self.config, mapper=self.mapper, jira_project_key=job["jira_project_key"],
+                                **self.sync_options)
+            if kind == "epics":
+                counts = sync.sync_epics()
+                if self.include_issues and self.config.epic_link_field is not None:
+                    try:
+                        counts["epics_scanned"] = sync.update_epic_issues()
+                        self._scanned_groups.add(job["gitlab_group"])
+                    except Exception as e:
+                        # the issue jobs scan the epics again
+                        logger.warning("Failed to list the issues of the epics of %s: %s", job["gitlab_group"], e)
+            elif kind == "epic_comments":
+                counts = CommentSync(sync).run(include_issues=False)
+            elif kind == "issue_comments":
+                counts = CommentSync(sync).run(include_epics=False)
+            elif kind == "jira":
+                counts = sync.sync_jira_to_gitlab()
+            else:
+                sync.scan_epic_issues = job["gitlab_group"] not in self._scanned_groups
+                counts = sync.sync_issues()
+        except Exception as e:
+            return JobResult(name, time.perf_counter() - start, error=e)
+        return JobResult(name, time.perf_counter() - start, counts=dict(counts))
@@ -0,0 +1,414 @@
+import json
+import logging
+import math
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from config_reader import ConfigError
+from jira_api import BULK_CREATE_LIMIT
+from synchronizer import OUTCOME_CREATED, OUTCOME_FAILED, OUTCOME_UPDATED, Synchronizer, Watermark, gitlab_ref
+
+logger = logging.getLogger(__name__)
+
+ACTION_CREATE = "create"
+ACTION_UPDATE = "update"
+ACTION_TRANSITION = "transition"
+# the issue only needs to be linked to another epic, or unlinked
+ACTION_LINK = "link"
+ACTION_NOOP = "noop"
+ACTION_SKIP = "skip"
+# a write left out because of a limit, the item is planned again by the next run
+ACTION_DEFERRED = "deferred"
+# the item cannot be synced, e.g. no rule gives its issue type or its JIRA issue is gone
+ACTION_ERROR = "error"
+
+WRITE_ACTIONS = (ACTION_CREATE, ACTION_UPDATE, ACTION_TRANSITION, ACTION_LINK)
+# outcome of an executed write
+OUTCOME_BY_ACTION = {
+    ACTION_CREATE: OUTCOME_CREATED,
+    ACTION_UPDATE: OUTCOME_UPDATED,
+    ACTION_TRANSITION: "transitioned",
+    ACTION_LINK: "linked"
+}
+
+
+class SyncPlan:
+    """
+    The changes a Gitlab => JIRA sync would make, one entry per fetched item in fetch order, together with the
+    watermarks the fetch started from. Plans are plain data and can be saved as JSON, reviewed and executed later.
+
+    Each change is a dictionary with the keys `action` (one of the ACTION_* constants), `type` ("epic" or "issue"),
+    `gitlab_issue`, `jira_issue`, `issue_type`, `title`, `description`, `labels`, `updated_at`, `gitlab_ref`,
+    `status` (target JIRA status), `current_status`, `watermark` and `reason`. When issues are linked to their
+    epic, issue changes also have `epic_key` (JIRA epic the issue belongs to, None for none) and `link`, which is
+    true if a transition or link write changes the epic link; creations set it in the same request.
+    """
+
+    def __init__(self, jira_project_key, changes=None, watermarks=None, created_at=None):
+        self.jira_project_key = jira_project_key
+        self.changes = changes if changes is not None else []
+        self.watermarks = watermarks if watermarks is not None else {}
+        self.created_at = created_at if created_at is not None else time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+    def counts(self):
+        return Counter(change["action"] for change in self.changes)
+
+    def estimated_requests(self):
+        """
+        :return: dictionary of write kind => number of JIRA requests the plan costs at most; transitions usually
+                 cost one request each once the transition cache is warm, two before
+        """
+        counts = self.counts()
+        created_with_status = sum(1 for change in self.changes
+                                  if change["action"] == ACTION_CREATE and change.get("status"))
+        return {
+            "create": math.ceil(counts[ACTION_CREATE] / BULK_CREATE_LIMIT),
+            "update": counts[ACTION_UPDATE],
+            "transition": 2 * (counts[ACTION_TRANSITION] + created_with_status),
+            "link": sum(1 for change in self.changes if change.get("link"))
+        }
+
+    def to_dict(self):
+        return {
+            "jira_project_key": self.jira_project_key,
+            "created_at": self.created_at,
+            "watermarks": self.watermarks,
+            "summary": dict(self.counts()),
+            "changes": self.changes
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(jira_project_key=data["jira_project_key"], changes=data["changes"],
+                   watermarks=data.get("watermarks", {}), created_at=data.get("created_at"))
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def __str__(self):
+        counts = self.counts()
+        requests = self.estimated_requests()
+        return (f"Plan for {self.jira_project_key}: " +
+                ", ".join(f"{action}={counts[action]}" for action in sorted(counts)) +
+                f"; at most {sum(requests.values())} JIRA write requests (" +
+                ", ".join(f"{kind}={n}" for kind, n in requests.items()) + ")")
+
+
+class SyncPlanner:
+    """
+    First phase of a planned sync: fetches the Gitlab items and the current state of their JIRA issues in bulk and
+    decides what to do with each item, without writing to JIRA. Decisions follow Synchronizer.sync_epic and
+    sync_issue, except that statuses are compared against JIRA itself rather than the sync state.
+    """
+
+    def __init__(self, synchronizer: Synchronizer, limits=None):
+        """
+        :param synchronizer: provides the API clients, mapper, config and the group/project to plan for
+        :param limits: dictionary of `create`, `update` and `transition` => maximum number of such writes; writes
+                       beyond a limit are planned as deferred. Defaults to the limits of the config.
+        """
+        self.sync = synchronizer
+        self.limits = limits if limits is not None else synchronizer.config.get_limits()
+
+    def plan(self, include_issues=True):
+        """
+        :param include_issues: also plan the issues of the project, not only the epics of the group
+        :return: SyncPlan
+        """
+        sync = self.sync
+        plan = SyncPlan(jira_project_key=sync.jira_project_key)
+
+        fetched = []
+        watermark = sync.mapper.get_watermark(sync.epics_watermark)
+        plan.watermarks[sync.epics_watermark] = watermark
+        epics = sync.gitlab_api.iter_epics(group_id=sync.gitlab_group,
+                                           params=sync.fetch_params(watermark if sync.incremental else None),
+                                           lean=True)
+        fetched += [("epic", epic, sync.epics_watermark) for epic in epics]
+
+        if include_issues and sync.gitlab_project is not None:
+            watermark = sync.mapper.get_watermark(sync.issues_watermark)
+            plan.watermarks[sync.issues_watermark] = watermark
+            issues = sync.gitlab_api.iter_issues(group_name=sync.gitlab_group, project_name=sync.gitlab_project,
+                                                 params=sync.fetch_params(watermark if sync.incremental else None),
+                                                 lean=True)
+            fetched += [("issue", issue, sync.issues_watermark) for issue in issues]
+
+        # the current status of every mapped issue, with one search per 100 issues
+        mapped_issue_keys = {sync.mapper.get_jira_issue(gitlab_issue=item["id"], type="issue")
+                             for type, item, _ in fetched if type == "issue"}
+        mapped_issue_keys.discard(None)
+        jira_issues = sync.jira_api.get_issues_by_key(sorted(mapped_issue_keys))
+        # the epic of every issue, None if issues are not linked to their epic
+        members = sync.epic_members() if any(type == "issue" for type, _, _ in fetched) else None
+
+        planned = Counter()
+        for type, item, watermark_name in fetched:
+            change = self._plan_epic(item) if type == "epic" else self._plan_issue(item, jira_issues, members)
+            change.update(type=type, gitlab_issue=item["id"], title=item["title"],
+                          description=item["description"], labels=list(item["labels"]),
+                          updated_at=item.get("updated_at"), gitlab_ref=gitlab_ref(type, item),
+                          watermark=watermark_name)
+            change.setdefault("jira_issue", None)
+
+            action = change["action"]
+            limit = self.limits.get(action)
+            if action in WRITE_ACTIONS and limit is not None and planned[action] >= limit:
+                change.update(action=ACTION_DEFERRED, reason=f"limit of {limit} {action} writes reached")
+            planned[change["action"]] += 1
+
+            plan.changes.append(change)
+
+        logger.info("%s", plan)
+        return plan
+
+    def _plan_epic(self, ge):
+        sync = self.sync
+        if not sync.is_synchronizable(ge, "epic"):
+            return {"action": ACTION_SKIP, "reason": "filtered out"}
+
+        jira_epic_id = sync.mapper.get_jira_issue(gitlab_issue=ge["id"], type="epic")
+        if jira_epic_id is None:
+            return {"action": ACTION_CREATE, "issue_type": "Epic"}
+
+        state = sync.mapper.get_sync_state(ge["id"], "epic")
+        if state is not None and state["content_hash"] == Synchronizer.content_hash(ge):
+            return {"action": ACTION_NOOP, "jira_issue": jira_epic_id}
+        return {"action": ACTION_UPDATE, "jira_issue": jira_epic_id, "issue_type": "Epic"}
+
+    def _plan_issue(self, gi, jira_issues, members=None):
+        sync = self.sync
+        if not sync.is_synchronizable(gi, "non-epic"):
+            return {"action": ACTION_SKIP, "reason": "filtered out"}
+
+        try:
+            issue_type = sync.get_issue_type(gi)
+            status = sync.get_issue_status(gi)
+        except (ConfigError, ValueError) as e:
+            return {"action": ACTION_ERROR, "reason": str(e)}
+        if not issue_type:
+            return {"action": ACTION_ERROR, "reason": "Issue type not determined based on rules"}
+
+        link = {}
+        if members is not None:
+            link["epic_key"] = sync.epic_key(gi["id"], members)
+
+        jira_issue_id = sync.mapper.get_jira_issue(gitlab_issue=gi["id"], type="issue")
+        if jira_issue_id is None:
+            return dict(link, action=ACTION_CREATE, issue_type=issue_type, status=status)
+
+        jira_issue = jira_issues.get(jira_issue_id)
+        if jira_issue is None:
+            return {"action": ACTION_ERROR, "jira_issue": jira_issue_id, "reason": "JIRA issue not found"}
+
+        if link:
+            # the epic last linked is kept in the sync state, see Synchronizer._sync_epic_link
+            link["link"] = (sync.mapper.get_sync_state(gi["id"], "issue") or {}).get("epic_key") != link["epic_key"]
+
+        if status is None or status.lower() == jira_issue.status.lower():
+            return dict(link, action=ACTION_LINK if link.get("link") else ACTION_NOOP, jira_issue=jira_issue_id,
+                        current_status=jira_issue.status)
+        return dict(link, action=ACTION_TRANSITION, jira_issue=jira_issue_id, issue_type=jira_issue.issue_type,
+                    status=status, current_status=jira_issue.status)
+
+
+class PlanExecutor:
+    """
+    Second phase of a planned sync: applies the writes of a SyncPlan. All creations go out first through the bulk
+    endpoint; updates and transitions then run on a thread pool. Transitions are ordered so that the first one of
+    each (issue type, current status) pair fills the transition cache before the others run. Epic links are
+    changed last.
+    """
+
+    def __init__(self, synchronizer: Synchronizer, workers=None, limits=None):
+        """
+        :param synchronizer: provides the API clients and mapper the plan is applied with
+        :param workers: number of concurrent updates and transitions, defaults to the synchronizer's workers
+        :param limits: maximum number of writes per action; a plan exceeding them is rejected before any write.
+                       Defaults to the limits of the config.
+        """
+        self.sync = synchronizer
+        self.workers = workers if workers is not None else max(synchronizer.workers, 1)
+        self.limits = limits if limits is not None else synchronizer.config.get_limits()
+
+    def execute(self, plan: SyncPlan):
+        """
+        :return: Counter of outcomes: "created", "updated", "transitioned", "linked" or "failed" for writes, the
+                 action for all other changes
+        :raises ValueError: if the plan is for another JIRA project, exceeds the limits or links issues to epics
+                            without an `epic_link_field` configured
+        """
+        self._check(plan)
+        # issues created by an earlier execution which stopped before mapping them are mapped, not created again
+        self.sync.reconcile_creations()
+
+        succeeded = {}
+        try:
+            transitions = self._create_all(plan, succeeded)
+            transitions += [index for index, change in enumerate(plan.changes)
+                            if change["action"] == ACTION_TRANSITION]
+            updates = [index for index, change in enumerate(plan.changes) if change["action"] == ACTION_UPDATE]
+
+            first, rest = self._order_transitions(plan, transitions)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for index, ok in zip(updates + first,
+                                     executor.map(lambda i: self._apply(plan.changes[i]), updates + first)):
+                    succeeded[index] = succeeded.get(index, True) and ok
+                for index, ok in zip(rest, executor.map(lambda i: self._transition(plan.changes[i]), rest)):
+                    succeeded[index] = succeeded.get(index, True) and ok
+                links = [index for index, change in enumerate(plan.changes)
+                         if change.get("link") and succeeded.get(index, True)]
+                for index, ok in zip(links, executor.map(lambda i: self._link(plan.changes[i]), links)):
+                    succeeded[index] = succeeded.get(index, True) and ok
+
+            self._advance_watermarks(plan, succeeded)
+        finally:
+            self.sync.mapper.flush()
+
+        counts = Counter()
+        for index, change in enumerate(plan.changes):
+            action = change["action"]
+            if action in WRITE_ACTIONS:
+                counts[OUTCOME_BY_ACTION[action] if succeeded.get(index) else OUTCOME_FAILED] += 1
+            else:
+                counts[action] += 1
+        logger.info("Executed plan: %s", ", ".join(f"{k}={v}" for k, v in sorted(counts.items())))
+        return counts
+
+    def _check(self, plan):
+        if plan.jira_project_key != self.sync.jira_project_key:
+            raise ValueError(f"Plan is for JIRA project {plan.jira_project_key}, not {self.sync.jira_project_key}")
+        counts = plan.counts()
+        for action, limit in self.limits.items():
+            if limit is not None and counts[action] > limit:
+                raise ValueError(f"Plan has {counts[action]} {action} writes, more than the limit of {limit}")
+        if self.sync.config.epic_link_field is None and any(change.get("link") or change.get("epic_key")
+                                                            for change in plan.changes):
+            raise ValueError("Plan links issues to epics, but no epic_link_field is configured")
+
+    def _create_all(self, plan, succeeded):
+        """
+        Creates the JIRA issues of all planned creations with bulk requests and maps them
+        :return: indexes of the created issues which still need a transition
+        """
+        creates = []
+        for index, change in enumerate(plan.changes):
+            if change["action"] != ACTION_CREATE:
+                continue
+            # the plan may be applied twice, an item mapped in the meantime is not created again
+            if self.sync.mapper.get_jira_issue(gitlab_issue=change["gitlab_issue"], type=change["type"]) is not None:
+                succeeded[index] = True
+            else:
+                creates.append(index)
+
+        self.sync.journal_creations([(plan.changes[index]["type"], plan.changes[index]["gitlab_issue"],
+                                       plan.changes[index]["issue_type"], plan.changes[index]["title"])
+                                      for index in creates])
+        results = self.sync.jira_api.create_issues([{
+            "title": plan.changes[index]["title"],
+            "issue_type": plan.changes[index]["issue_type"],
+            "description": plan.changes[index]["description"],
+            "project_key": plan.jira_project_key,
+            "fields": self._link_fields(plan.changes[index])
+        } for index in creates])
+
+        transitions = []
+        for index, (jira_issue_id, error) in zip(creates, results):
+            change = plan.changes[index]
+            if jira_issue_id is None:
+                logger.warning("Failed to create JIRA issue for Gitlab %s %s: %s", change["type"],
+                               change["gitlab_issue"], error)
+                succeeded[index] = False
+                continue
+            change["jira_issue"] = jira_issue_id
+            self.sync.mapper.store_mapping(jira_issue=jira_issue_id, gitlab_issue=change["gitlab_issue"],
+                                           type=change["type"])
+            self._store_state(change, epic_key=change.get("epic_key"))
+            self.sync.mapper.remove_pending_creation(change["gitlab_issue"], change["type"])
+            succeeded[index] = True
+            if change.get("status"):
+                transitions.append(index)
+        return transitions
+
+    @staticmethod
+    def _order_transitions(plan, transitions):
+        """
+        :return: tuple (first transition of each (issue type, current status, target status), all others)
+        """
+        first, rest, seen = [], [], set()
+        for index in transitions:
+            change = plan.changes[index]
+            key = (change.get("issue_type"), (change.get("current_status") or "").lower(), change["status"].lower())
+            (rest if key in seen else first).append(index)
+            seen.add(key)
+        return first, rest
+
+    def _apply(self, change):
+        if change["action"] == ACTION_UPDATE:
+            return self._update(change)
+        return self._transition(change)
+
+    def _update(self, change):
+        if self.sync.jira_api.create_issue(project_key=self.sync.jira_project_key, issue_type=change["issue_type"],
+                                           title=change["title"], description=change["description"],
+                                           issue_id=change["jira_issue"]) is None:
+            return False
+        self._store_state(change)
+        return True
+
+    def _transition(self, change):
+        try:
+            self.sync.jira_api.update_issue_status(change["jira_issue"], change["status"],
+                                                   issue_type=change.get("issue_type"),
+                                                   current_status=change.get("current_status"))
+        except Exception as e:
+            logger.warning("Failed to update status of %s to %s: %s", change["jira_issue"], change["status"], e)
+            return False
+        self.sync.mapper.set_sync_state(change["gitlab_issue"], change["type"], status=change["status"],
+                                        gitlab_ref=change.get("gitlab_ref"))
+        return True
+
+    def _link(self, change):
+        try:
+            self.sync.jira_api.set_epic_link(change["jira_issue"], change["epic_key"],
+                                             field=self.sync.config.epic_link_field)
+        except Exception as e:
+            logger.warning("Failed to link %s to epic %s: %s", change["jira_issue"], change["epic_key"], e)
+            return False
+        self.sync.mapper.set_sync_state(change["gitlab_issue"], change["type"], epic_key=change["epic_key"])
+        return True
+
+    def _link_fields(self, change):
+        """
+        :return: the fields linking a planned creation to its epic, or None
+        """
+        if change.get("epic_key") is None:
+            return None
+        return self.sync.jira_api.epic_link_fields(change["epic_key"], field=self.sync.config.epic_link_field)
+
+    def _store_state(self, change, **fields):
+        self.sync.mapper.set_sync_state(change["gitlab_issue"], change["type"], updated_at=change["updated_at"],
+                                        content_hash=Synchronizer.content_hash(change), title=change["title"],
+                                        gitlab_ref=change.get("gitlab_ref"), **fields)
+
+    def _advance_watermarks(self, plan, succeeded):
+        for name, start in plan.watermarks.items():
+            watermark = Watermark(start)
+            changes = [(index, change) for index, change in enumerate(plan.changes) if change["watermark"] == name]
+            for position, (index, change) in enumerate(changes):
+                if change["action"] in WRITE_ACTIONS:
+                    synced = succeeded.get(index, False)
+                else:
+                    synced = change["action"] not in (ACTION_DEFERRED, ACTION_ERROR)
+                watermark.complete(position, change["updated_at"], synced)
+            # a run since the plan was made may have moved the watermark further, it never goes back
+            stored = self.sync.mapper.get_watermark(name)
+            if watermark.value is not None and (stored is None or watermark.value > stored):
+                self.sync.mapper.set_watermark(name, watermark.value)
@@ -1,179 +1,877 @@
-from jira_api import JiraApi
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+from jira_api import BULK_CREATE_LIMIT, JiraApi, JiraIssue
 from gitlab_api import GitlabApi
 from issue_mapping import IssueMapper
-from config_reader import Config
+from config_reader import Config, ConfigError
+from metrics import DISABLED, Metrics
+
+logger = logging.getLogger(__name__)
+
+OUTCOME_CREATED = "created"
+OUTCOME_UPDATED = "updated"
+OUTCOME_UNCHANGED = "unchanged"
+OUTCOME_MAPPED = "mapped"
+OUTCOME_SKIPPED = "skipped"
+OUTCOME_DEFERRED = "deferred"
+OUTCOME_FAILED = "failed"
+# the item waits in the bulk creation queue, its final outcome is recorded when the queue is flushed
+OUTCOME_QUEUED = "queued"
+
+# prefix of the watermarks holding the progress of a run which has not finished yet
+CHECKPOINT_PREFIX = "checkpoint:"
+# seconds between two checkpoints of a run
+CHECKPOINT_INTERVAL = 30
+# JIRA's clock may be behind ours, journaled creations are looked for among the issues created this much earlier
+CLOCK_SKEW = timedelta(minutes=5)
+# seconds the epic membership of issues is reused by single item syncs before the updated epics are listed again,
+# see epic_members
+EPIC_MEMBERS_TTL = 600
 
 
 class Synchronizer:
 
-    def __init__(self, jira_api: JiraApi, gitlab_api: GitlabApi, gitlab_group, gitlab_project, config: Config):
+    def __init__(self, jira_api: JiraApi, gitlab_api: GitlabApi, gitlab_group, gitlab_project, config: Config,
+                 mapper: IssueMapper = None, incremental=False, workers=1, bulk_create=False, jira_project_key=None,
+                 metrics: Metrics = None):
         self.jira_api = jira_api
         self.gitlab_api = gitlab_api
         self.gitlab_group = gitlab_group
         self.gitlab_project = gitlab_project
-        self.mapper = IssueMapper()
+        self.mapper = mapper if mapper is not None else IssueMapper()
         self.config = config
+        # JIRA project the items are synced to, the one from the config unless given
+        self.jira_project_key = jira_project_key if jira_project_key is not None else config.jira_project_key
+        # only fetch items updated since the last run
+        self.incremental = incremental
+        # number of items synced concurrently; the API clients' pool size should be at least this large
+        self.workers = workers
+        # queue new JIRA issues and create them in batches through the bulk endpoint
+        self.bulk_create = bulk_create
+        # phase timers and item counts; the phases are "fetch", "filter", "mapping" and "write"
+        self.metrics = metrics if metrics is not None else DISABLED
+        self.max_epics_created = 1
+        self.max_issues_created = 1
+        # seconds between two saves of a run's progress, see _run
+        self.checkpoint_interval = CHECKPOINT_INTERVAL
+        # scan the updated epics before linking issues; turned off when the orchestrator already did for the group
+        self.scan_epic_issues = True
+        self._created = Counter()
+        self._queued_creations = {}
+        self._lock = threading.Lock()
+        # Gitlab references of the group's epics and the project's issues, listed once if the JIRA => Gitlab sync
+        # meets an item whose reference was not recorded yet
+        self._gitlab_refs = None
+        self._refs_lock = threading.Lock()
+        # Gitlab issue ID => Gitlab ID of its epic, for the issues of the project, see epic_members
+        self._epic_of_issue = None
+        self._epic_members_at = None
+        self._epics_lock = threading.Lock()
+
+    @property
+    def epics_watermark(self):
+        return "epics:" + str(self.gitlab_group)
+
+    @property
+    def epic_issues_watermark(self):
+        return "epic_issues:" + str(self.gitlab_group)
+
+    @property
+    def issues_watermark(self):
+        return "issues:" + str(self.gitlab_group) + "/" + str(self.gitlab_project)
 
     def is_synchronizable(self, item, issue_type):
+        with self.metrics.timer("filter"):
+            return self.config.is_synchronizable(item["labels"], issue_type)
 
-        labels = item["labels"]
-        filters = self.config.get_filters()
-        required_labels = []
-
-        for f in filters:
-            if f["issue_type"] == issue_type and f["label"] is not None:
-                required_labels.append(f["label"])
-
-        if len(required_labels) == 0:
-            return True
-
-        for rl in required_labels:
-            is_found = False
-            for actual_label in labels:
-                if actual_label == rl:
-                    is_found = True
-                    break
-            if not is_found:
-                # required label not found
-                return False
+    def sync_epics(self):
 
-        return True
+        watermark_name = self.epics_watermark
+        self.reconcile_creations("epic")
+        watermark, since = self._start(watermark_name)
+        self._created["epic"] = 0
 
-    def sync_epics(self):
+        # epics are streamed page by page rather than loaded up front
+        gitlab_epics = self.gitlab_api.iter_epics(group_id=self.gitlab_group, params=self.fetch_params(since),
+                                                  lean=True)
 
-        gitlab_epics = self.gitlab_api.get_epics(group_id=self.gitlab_group)
-        print("Retrieved Gitlab epics: " + str(len(gitlab_epics)))
+        counts = self._run(gitlab_epics, self.sync_epic, watermark, kind="epics", checkpoint=watermark_name)
+        self._finish(watermark_name, watermark)
 
-        epics_created = 0
-        max_epics_created = 1
+        logger.info("Retrieved Gitlab epics: %d", counts["retrieved"])
+        logger.info("Epics created: %d, updated: %d, unchanged: %d",
+                    counts["created"], counts["updated"], counts["unchanged"])
+        return counts
 
-        for ge in gitlab_epics:
+    def sync_epic(self, ge):
+        """
+        Synchronizes a single Gitlab epic to JIRA
+        :param ge: Gitlab epic dictionary
+        :return: outcome of the sync, one of the OUTCOME_* constants
+        """
 
-            if not self.is_synchronizable(ge, "epic"):
-                print("Epic not synchronizable: " + ge["title"])
-                continue
+        if not self.is_synchronizable(ge, "epic"):
+            logger.debug("Epic not synchronizable: %s", ge["title"])
+            return OUTCOME_SKIPPED
 
-            gitlab_epic_id = ge["id"]
+        gitlab_epic_id = ge["id"]
+        content_hash = self.content_hash(ge)
 
-            # check if the epic exists in the mapping file
+        # check if the epic exists in the mapping file
+        with self.metrics.timer("mapping"):
             jira_epic_id = self.mapper.get_jira_issue(gitlab_issue=gitlab_epic_id, type="epic")
+            state = self.mapper.get_sync_state(gitlab_epic_id, "epic") if jira_epic_id is not None else None
 
-            if jira_epic_id is None:
+        if jira_epic_id is None:
 
-                # epic does not exist in JIRA, create it
-                if epics_created < max_epics_created:
-                    jira_epic_id = self.jira_api.create_issue(project_key=self.config.jira_project_key,
-                                                              issue_type="Epic", title=ge["title"],
-                                                              description=ge["description"])
+            # epic does not exist in JIRA, create it
+            if not self._reserve_creation("epic"):
+                # not created in this run, so it must be fetched again by the next incremental run
+                return OUTCOME_DEFERRED
 
-                    # create a mapping between the JIRA and Gitlab issues
-                    self.mapper.store_mapping(jira_issue=jira_epic_id, gitlab_issue=gitlab_epic_id, type="epic")
+            return self._create("epic", ge, issue_type="Epic")
 
-                    epics_created = epics_created + 1
+        if state is not None and state["content_hash"] == content_hash:
+            if state["gitlab_ref"] is None:
+                # mapped before references and titles were recorded; JIRA got this title from the last update
+                self.mapper.set_sync_state(gitlab_epic_id, "epic", title=ge["title"],
+                                           gitlab_ref=gitlab_ref("epic", ge))
+            return OUTCOME_UNCHANGED
 
-            else:
-
-                # update existing epic
-                self.jira_api.create_issue(project_key=self.config.jira_project_key,
-                                           issue_type="Epic", title=ge["title"],
-                                           description=ge["description"], issue_id=jira_epic_id)
+        # update existing epic
+        with self.metrics.timer("write"):
+            updated = self.jira_api.create_issue(project_key=self.jira_project_key,
+                                                 issue_type="Epic", title=ge["title"],
+                                                 description=ge["description"], issue_id=jira_epic_id) is not None
+        if not updated:
+            return OUTCOME_FAILED
 
-        return None
+        self.mapper.set_sync_state(gitlab_epic_id, "epic", updated_at=ge.get("updated_at"),
+                                   content_hash=content_hash, title=ge["title"], gitlab_ref=gitlab_ref("epic", ge))
+        return OUTCOME_UPDATED
 
     def sync_issues(self):
 
-        max_issues = 1000
-
-        # get all issues from gitlab
-        gitlab_issues = self.gitlab_api.get_issues(group_name=self.gitlab_group, project_name=self.gitlab_project,
-                                                   issue_count=max_issues)
-
-        print("Retrieved Gitlab issues: " + str(len(gitlab_issues)))
+        watermark_name = self.issues_watermark
+        self.reconcile_creations("issue")
+        watermark, since = self._start(watermark_name)
+        self._created["issue"] = 0
+        # epics may have been created and issues moved between epics since the membership was last listed
+        with self._epics_lock:
+            self._epic_of_issue = None
+
+        # stream all issues from gitlab, page by page
+        gitlab_issues = self.gitlab_api.iter_issues(group_name=self.gitlab_group, project_name=self.gitlab_project,
+                                                    params=self.fetch_params(since), lean=True)
+
+        counts = self._run(gitlab_issues, self.sync_issue, watermark, kind="issues", checkpoint=watermark_name)
+        self._finish(watermark_name, watermark)
+
+        logger.info("Retrieved Gitlab issues: %d", counts["retrieved"])
+        logger.info("Issues created: %d, already mapped: %d", counts["created"], counts["mapped"])
+
+        links = self.sync_epic_links()
+        counts["linked"] = links[OUTCOME_UPDATED]
+        return counts
+
+    def sync_epic_links(self):
+        """
+        Links the mapped issues of the mapped epics to their JIRA epics. sync_issue links the issues it syncs; this
+        catches the mapped issues a run did not fetch, e.g. those whose epic was only created after them. The
+        membership comes from epic_members and the links recorded in the sync state, so only changed links cost a
+        request.
+        :return: Counter of outcomes
+        """
+        members = self.epic_members()
+        if not members:
+            return Counter()
+
+        def link(gitlab_issue):
+            with self.metrics.timer("mapping"):
+                jira_issue_id = self.mapper.get_jira_issue(gitlab_issue=gitlab_issue, type="issue")
+            if jira_issue_id is None:
+                return OUTCOME_SKIPPED
+            return self._sync_epic_link(gitlab_issue, jira_issue_id)
 
-        max_issues_created = 1
-        issues_created = 0
+        counts = self._run(list(members), link, Watermark(None), updated_at=lambda gitlab_issue: None,
+                           kind="epic_links")
+        logger.info("Issues linked to their epic: %d", counts[OUTCOME_UPDATED])
+        return counts
 
-        for gi in gitlab_issues:
+    def sync_issue(self, gi):
+        """
+        Synchronizes a single Gitlab issue to JIRA
+        :param gi: Gitlab issue dictionary
+        :return: outcome of the sync, one of the OUTCOME_* constants
+        """
 
-            if not self.is_synchronizable(gi, "non-epic"):
-                print("Issue not synchronizable: " + gi["title"])
-                continue
+        if not self.is_synchronizable(gi, "non-epic"):
+            logger.debug("Issue not synchronizable: %s", gi["title"])
+            return OUTCOME_SKIPPED
 
-            gitlab_issue_id = str(gi["id"])
+        gitlab_issue_id = str(gi["id"])
 
-            # check if the issue exists in the mapping file
+        # check if the issue exists in the mapping file
+        with self.metrics.timer("mapping"):
             jira_issue_id = self.mapper.get_jira_issue(gitlab_issue=gi["id"], type="issue")
 
-            jira_issue_type = self._get_issue_type(gi)
-
+        try:
+            jira_issue_type = self.get_issue_type(gi)
+            # the status is synced after a creation too, so its rules are checked before anything is written
+            self.get_issue_status(gi)
             if not jira_issue_type:
-                raise "Issue type not determined based on rules"
-
-            if jira_issue_id is None:
+                raise ConfigError("Issue type not determined based on rules")
+        except (ConfigError, ValueError) as e:
+            # a problem with this issue's labels; fixing them changes `updated_at`, so the issue is fetched again
+            logger.warning("Not syncing Gitlab issue %s: %s", gitlab_issue_id, e)
+            return OUTCOME_SKIPPED
+
+        if jira_issue_id is None:
+
+            if not self._reserve_creation("issue"):
+                logger.debug("Not creating issue (max = %d)", self.max_issues_created)
+                return OUTCOME_DEFERRED
+
+            # create a JIRA issue for the Gitlab issue, its status is synced once it exists
+            return self._create("issue", gi, issue_type=jira_issue_type)
+
+        logger.debug("Found mapping: GITLAB[%s] => JIRA[%s]", gitlab_issue_id, jira_issue_id)
+
+        if not self._sync_status(gi, jira_issue_id, jira_issue_type):
+            return OUTCOME_FAILED
+        if self._sync_epic_link(gi["id"], jira_issue_id) == OUTCOME_FAILED:
+            return OUTCOME_FAILED
+        return OUTCOME_MAPPED
+
+    def _sync_epic_link(self, gitlab_issue, jira_issue_id):
+        """
+        Links the JIRA issue to the JIRA epic of the Gitlab issue's epic, or unlinks it when the Gitlab issue left
+        its epic. The epic last linked is kept in the sync state, so an unchanged link costs no request.
+        :return: OUTCOME_UPDATED if the link was changed, OUTCOME_UNCHANGED, or OUTCOME_FAILED
+        """
+        members = self.epic_members()
+        if members is None:
+            return OUTCOME_UNCHANGED
+
+        epic_key = self.epic_key(gitlab_issue, members)
+        with self.metrics.timer("mapping"):
+            state = self.mapper.get_sync_state(gitlab_issue, "issue") or {}
+        if state.get("epic_key") == epic_key:
+            return OUTCOME_UNCHANGED
+
+        try:
+            with self.metrics.timer("write"):
+                self.jira_api.set_epic_link(jira_issue_id, epic_key, field=self.config.epic_link_field)
+        except Exception as e:
+            logger.warning("Failed to link %s to epic %s: %s", jira_issue_id, epic_key, e)
+            return OUTCOME_FAILED
+
+        logger.debug("Linked %s to epic %s", jira_issue_id, epic_key)
+        self.mapper.set_sync_state(gitlab_issue, "issue", epic_key=epic_key)
+        return OUTCOME_UPDATED
+
+    def epic_key(self, gitlab_issue, members=None):
+        """
+        :param members: result of epic_members, looked up if not given
+        :return: key of the JIRA epic of the Gitlab issue's epic, None if the issue has no mapped epic
+        """
+        if members is None:
+            members = self.epic_members() or {}
+        epic_id = members.get(gitlab_issue)
+        if epic_id is None:
+            return None
+        with self.metrics.timer("mapping"):
+            return self.mapper.get_jira_issue(gitlab_issue=epic_id, type="epic")
+
+    def update_epic_issues(self):
+        """
+        Records the issues of the group's epics in the mapping store, for all projects of the group, with one
+        paginated scan per epic on `workers` threads. Adding an issue to an epic or removing it updates the epic, so
+        only the epics updated since the last scan are scanned, whether the run is incremental or not; the first scan
+        of a group covers all its epics. Epics left out by the filters are not scanned, their issues could not be
+        linked anyway.
+        :return: number of epics scanned
+        """
+        watermark_name = self.epic_issues_watermark
+        since = self.mapper.get_watermark(watermark_name)
+        epics = [epic for epic in self.gitlab_api.iter_epics(self.gitlab_group, params=self.fetch_params(since),
+                                                             lean=True)
+                 if self.is_synchronizable(epic, "epic")]
+
+        def scan(epic):
+            issues = self.gitlab_api.iter_epic_issues(epic.get("group_id") or self.gitlab_group, epic["iid"])
+            self.mapper.set_epic_issues(epic["id"], [(issue["id"], issue.get("project_id")) for issue in issues])
+            return epic.get("updated_at")
+
+        with self.metrics.timer("fetch"), ThreadPoolExecutor(max_workers=max(self.workers, 1)) as executor:
+            updated = [updated_at for updated_at in executor.map(scan, epics) if updated_at is not None]
+        # the epics are listed oldest change first, the watermark only moves once all of them were scanned
+        if updated and (since is None or max(updated) > since):
+            self.mapper.set_watermark(watermark_name, max(updated))
+        logger.info("Listed the issues of %d epics of %s", len(epics), self.gitlab_group)
+        return len(epics)
+
+    def epic_members(self):
+        """
+        Indexes which issues of the project belong to which epic, from the epic issues recorded by
+        update_epic_issues. The updated epics are scanned, unless `scan_epic_issues` is off, and the index is loaded
+        once per sync_issues run and reused for EPIC_MEMBERS_TTL seconds by single item syncs.
+        :return: dictionary of Gitlab issue ID => Gitlab epic ID, or None if epic links are not synced or the epics
+                 could not be listed
+        """
+        if self.config.epic_link_field is None or self.gitlab_project is None:
+            return None
+
+        with self._epics_lock:
+            if self._epic_of_issue is not None and time.monotonic() - self._epic_members_at < EPIC_MEMBERS_TTL:
+                return self._epic_of_issue if self._epic_of_issue is not False else None
+
+            try:
+                project_id = self.gitlab_api.get_project_id(self.gitlab_group, self.gitlab_project)
+                if self.scan_epic_issues:
+                    self.update_epic_issues()
+                members = {int(gitlab_issue): int(epic_id)
+                           for epic_id, gitlab_issue, issue_project_id in self.mapper.epic_issues()
+                           if issue_project_id == project_id}
+            except Exception as e:
+                # an incomplete index would unlink issues, so links are left alone until the next run
+                logger.warning("Failed to list the issues of the epics of %s, not syncing epic links: %s",
+                               self.gitlab_group, e)
+                members = False
+
+            self._epic_of_issue = members
+            self._epic_members_at = time.monotonic()
+            return members if members is not False else None
+
+    def _sync_status(self, gi, jira_issue_id, jira_issue_type):
+        """
+        Moves the JIRA issue to the status the Gitlab labels map to. The status set by the previous sync is kept in
+        the sync state, so unchanged statuses cost no request and changed ones usually a single one.
+        :return: False if the transition failed
+        """
+
+        # update JIRA status based on rules
+        jira_issue_status = self.get_issue_status(gi)
+
+        with self.metrics.timer("mapping"):
+            state = self.mapper.get_sync_state(gi["id"], "issue") or {}
+
+        if jira_issue_status is None:
+            if state.get("gitlab_ref") is None:
+                self.mapper.set_sync_state(gi["id"], "issue", gitlab_ref=gitlab_ref("issue", gi))
+            return True
 
-                if issues_created < max_issues_created:
-                    # create a JIRA issue for the Gitlab issue
-                    jira_issue_id = self.jira_api.create_issue(project_key=self.config.jira_project_key,
-                                                               issue_type=jira_issue_type, title=gi["title"],
-                                                               description=gi["description"])
+        try:
+            with self.metrics.timer("write"):
+                self.jira_api.update_issue_status(jira_issue_id, jira_issue_status, issue_type=jira_issue_type,
+                                                  current_status=state.get("status"))
+        except Exception as e:
+            logger.warning("Failed to update status of %s to %s: %s", jira_issue_id, jira_issue_status, e)
+            return False
 
-                    # create a mapping between the JIRA and Gitlab issues
-                    self.mapper.store_mapping(jira_issue=jira_issue_id, gitlab_issue=gitlab_issue_id, type="issue")
+        self.mapper.set_sync_state(gi["id"], "issue", status=jira_issue_status, gitlab_ref=gitlab_ref("issue", gi))
+        return True
 
-                    issues_created = issues_created + 1
+    def sync_item(self, type, item):
+        """
+        Synchronizes a single Gitlab item outside of a full run, e.g. for a webhook event. The creation limits apply
+        to each call, and the mapping is written out right away.
+        :param type: "epic" or "issue"
+        :param item: Gitlab item dictionary
+        :return: outcome of the sync, one of the OUTCOME_* constants
+        """
+        with self._lock:
+            self._created[type] = 0
+
+        outcome = self.sync_epic(item) if type == "epic" else self.sync_issue(item)
+
+        if outcome == OUTCOME_QUEUED:
+            with self._lock:
+                creation = self._queued_creations.pop(id(item))
+            _, outcome = self._create_batch([creation])[0]
+
+        self.mapper.flush()
+        return outcome
+
+    def sync_jira_to_gitlab(self):
+        """
+        Pushes title and status changes made in JIRA back to the mapped Gitlab items. Issues are found with a JQL
+        query for changes since the `jira:<project key>` watermark (when incremental) and applied like the
+        Gitlab => JIRA direction, on `workers` threads.
+        :return: Counter of outcomes, plus the number of retrieved issues under "retrieved"
+        """
+        watermark_name = "jira:" + str(self.jira_project_key)
+        watermark, since = self._start(watermark_name)
+
+        jira_issues = self.jira_api.iter_updated_issues(self.jira_project_key, since=since)
+
+        try:
+            counts = self._run(jira_issues, self.sync_jira_issue, watermark, updated_at=lambda issue: issue.updated,
+                               kind="jira", checkpoint=watermark_name)
+        finally:
+            self.mapper.flush()
+
+        self._finish(watermark_name, watermark)
+
+        logger.info("Retrieved JIRA issues: %d", counts["retrieved"])
+        logger.info("Gitlab items updated: %d, unchanged: %d", counts["updated"], counts["unchanged"])
+        return counts
+
+    def sync_jira_issue(self, issue: JiraIssue):
+        """
+        Synchronizes the title and, for issues, the status of a JIRA issue to its Gitlab item.
+
+        The sync state holds the title and status last known to be equal on both sides, which both directions update
+        after each write. Changes are only pushed when JIRA differs from that state, so a write made by the sync
+        itself, which JIRA and Gitlab both report as a change, is never written back. When nothing was recorded
+        yet, JIRA's values become the baseline and Gitlab is left alone.
+        :param issue: JIRA issue with summary and status
+        :return: outcome of the sync, one of the OUTCOME_* constants
+        """
+        with self.metrics.timer("mapping"):
+            mapping = self.mapper.get_gitlab_issue(issue.issue_key)
+            if mapping is None:
+                # not created by the sync
+                return OUTCOME_SKIPPED
+
+            type, gitlab_issue = mapping
+            state = self.mapper.get_sync_state(gitlab_issue, type) or {}
+        synced_status = state.get("status") if type == "issue" else None
+
+        if state.get("title") is None or (type == "issue" and synced_status is None):
+            self.mapper.set_sync_state(gitlab_issue, type, title=state.get("title") or issue.summary,
+                                       status=synced_status or (issue.status if type == "issue" else None))
+            return OUTCOME_UNCHANGED
+
+        changes = {}
+        if issue.summary != state["title"]:
+            changes["title"] = issue.summary
+
+        status_changed = synced_status is not None and issue.status.lower() != synced_status.lower()
+        if status_changed:
+            label = self.config.get_status_label(issue.status)
+            if label is not None:
+                changes["add_labels"] = label
+                other_labels = self.config.get_status_labels() - {label}
+                if other_labels:
+                    changes["remove_labels"] = ",".join(sorted(other_labels))
+
+        if not changes:
+            if status_changed:
+                # no label maps to the new status, remember it so the change is not looked at again
+                self.mapper.set_sync_state(gitlab_issue, type, status=issue.status)
+            return OUTCOME_UNCHANGED
+
+        gitlab_ref = state.get("gitlab_ref") or self._find_gitlab_ref(type, gitlab_issue)
+        if gitlab_ref is None:
+            logger.warning("Gitlab %s %s of JIRA issue %s is not in %s/%s, not updating it",
+                           type, gitlab_issue, issue.issue_key, self.gitlab_group, self.gitlab_project)
+            return OUTCOME_SKIPPED
+
+        try:
+            with self.metrics.timer("write"):
+                if type == "epic":
+                    group_id, iid = gitlab_ref.rsplit("&", 1)
+                    updated = self.gitlab_api.update_epic(group_id, iid, **changes)
                 else:
-                    print("Not creating issue (max = " + str(max_issues_created) + ")")
-
-            else:
-                print("Found mapping: GITLAB[" + gitlab_issue_id + "] => JIRA[" + jira_issue_id + "]")
-
-            # update JIRA status based on rules
-            jira_issue_status = self._get_issue_status(gi)
-
-            if jira_issue_status is not None:
-                print("Updating status to")
+                    project_id, iid = gitlab_ref.rsplit("#", 1)
+                    updated = self.gitlab_api.update_issue(project_id, iid, **changes)
+        except Exception as e:
+            logger.warning("Failed to update Gitlab %s %s from JIRA issue %s: %s", type, gitlab_issue,
+                           issue.issue_key, e)
+            return OUTCOME_FAILED
+
+        logger.info("Updated Gitlab %s %s from JIRA issue %s: %s", type, gitlab_issue, issue.issue_key,
+                    ", ".join(changes))
+
+        # the new content hash keeps the Gitlab => JIRA direction from writing the change back
+        self.mapper.set_sync_state(gitlab_issue, type, updated_at=updated.get("updated_at"),
+                                   content_hash=self.content_hash(updated), title=issue.summary,
+                                   status=issue.status if type == "issue" else None, gitlab_ref=gitlab_ref)
+        return OUTCOME_UPDATED
+
+    def _find_gitlab_ref(self, type, gitlab_issue):
+        """
+        Looks up the reference of a Gitlab item mapped before references were recorded, among the epics of the
+        group and the issues of the project, which are listed on the first call
+        :return: the reference, or None if the item is not part of this group/project
+        """
+        with self._refs_lock:
+            if self._gitlab_refs is None:
+                refs = {}
+                sources = [("epic", lambda: self.gitlab_api.iter_epics(self.gitlab_group, lean=True))]
+                if self.gitlab_project is not None:
+                    sources.append(("issue", lambda: self.gitlab_api.iter_issues(self.gitlab_group,
+                                                                                 self.gitlab_project, lean=True)))
+                for item_type, items in sources:
+                    try:
+                        for item in items():
+                            refs[(item_type, str(item["id"]))] = gitlab_ref(item_type, item)
+                    except Exception as e:
+                        logger.warning("Failed to list Gitlab %ss: %s", item_type, e)
+                self._gitlab_refs = refs
+
+        ref = self._gitlab_refs.get((type, str(gitlab_issue)))
+        if ref is not None:
+            self.mapper.set_sync_state(gitlab_issue, type, gitlab_ref=ref)
+        return ref
 
     def sync_gitlab_to_jira(self):
-        self.sync_epics()
-        #self.sync_issues()
+        try:
+            self.sync_epics()
+            if self.gitlab_project is not None:
+                # after the epics, so new issues are created linked to the JIRA epics
+                self.sync_issues()
+        finally:
+            # write out any mappings still buffered, even if the sync failed halfway
+            self.mapper.flush()
         return None
 
-    def _get_issue_type(self, gi):
+    def _run(self, items, sync_item, watermark, updated_at=lambda item: item.get("updated_at"), kind="items",
+             checkpoint=None):
+        """
+        Applies `sync_item` to every item, on a pool of `workers` threads when more than one worker is configured.
+        At most twice as many items as workers are in flight, so the item stream is consumed lazily. Items queued
+        for bulk creation are created in batches of BULK_CREATE_LIMIT, the last batch at the end of the run.
+        :param updated_at: function returning the last change of an item, which the watermark advances to
+        :param kind: name of the run in the metrics
+        :param checkpoint: name of the run's watermark; the progress of the run is saved as its checkpoint every
+                           `checkpoint_interval` seconds and when the run fails, see _start
+        :return: Counter of outcomes, plus the number of retrieved items under "retrieved"
+        """
+        counts = Counter()
+        batch = []
+        start = time.perf_counter()
+        items = self.metrics.timed(items, "fetch")
+        last_checkpoint = time.monotonic()
+
+        def save_checkpoint():
+            nonlocal last_checkpoint
+            last_checkpoint = time.monotonic()
+            if checkpoint is not None and watermark.value is not None:
+                # the mappings of the items below the watermark are written out first
+                self.mapper.set_watermark(CHECKPOINT_PREFIX + checkpoint, watermark.value)
+                self.mapper.flush()
+
+        def flush_batch():
+            positions = [position for position, _ in batch]
+            outcomes = self._create_batch([creation for _, creation in batch])
+            batch.clear()
+            for position, (item, outcome) in zip(positions, outcomes):
+                record(position, item, outcome)
+
+        def record(position, item, outcome):
+            if outcome == OUTCOME_QUEUED:
+                with self._lock:
+                    batch.append((position, self._queued_creations.pop(id(item))))
+                if len(batch) >= BULK_CREATE_LIMIT:
+                    flush_batch()
+                return
+
+            counts["retrieved"] += 1
+            counts[outcome] += 1
+            self.metrics.count("sync_items_total", kind=kind, outcome=outcome)
+            watermark.complete(position, updated_at(item), outcome not in (OUTCOME_DEFERRED, OUTCOME_FAILED))
+            if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                save_checkpoint()
+
+        try:
+            if self.workers <= 1:
+                for position, item in enumerate(items):
+                    record(position, item, sync_item(item))
 
-        labels = gi["labels"]
-        issue_type = None
+            else:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    in_flight = {}
+
+                    def collect(futures):
+                        for future in futures:
+                            position, item = in_flight.pop(future)
+                            record(position, item, future.result())
+
+                    for position, item in enumerate(items):
+                        if len(in_flight) >= self.workers * 2:
+                            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                            collect(done)
+                        in_flight[executor.submit(sync_item, item)] = (position, item)
+
+                    collect(list(in_flight))
+
+            if batch:
+                flush_batch()
+        except BaseException:
+            # the next run resumes after the items completed so far
+            save_checkpoint()
+            raise
+
+        seconds = time.perf_counter() - start
+        self.metrics.gauge("sync_run_seconds", seconds, kind=kind)
+        self.metrics.gauge("sync_items_per_second", counts["retrieved"] / seconds if seconds > 0 else 0.0, kind=kind)
+        return counts
+
+    def _create(self, type, item, issue_type):
+        """
+        Creates the JIRA issue of a Gitlab item and maps it, or queues it when bulk creation is enabled
+        :return: OUTCOME_CREATED, OUTCOME_FAILED or OUTCOME_QUEUED
+        """
+        if self.bulk_create:
+            # picked up by _run, which creates the queued items in batches
+            with self._lock:
+                self._queued_creations[id(item)] = (type, item, issue_type)
+            return OUTCOME_QUEUED
+
+        self.journal_creations([(type, item["id"], issue_type, item["title"])])
+        with self.metrics.timer("write"):
+            jira_issue_id = self.jira_api.create_issue(project_key=self.jira_project_key,
+                                                       issue_type=issue_type, title=item["title"],
+                                                       description=item["description"],
+                                                       fields=self._creation_fields(type, item))
+
+        if jira_issue_id is None:
+            # the request may still have created the issue, the journal entry is resolved by the next run
+            return OUTCOME_FAILED
+
+        return self._store_created(type, item, jira_issue_id, issue_type)
+
+    def _create_batch(self, creations):
+        """
+        Creates a batch of queued items with one bulk request and maps every item JIRA created
+        :param creations: list of (type, item, issue_type) tuples
+        :return: list of (item, outcome) tuples
+        """
+        self.journal_creations([(type, item["id"], issue_type, item["title"]) for type, item, issue_type in creations])
+        with self.metrics.timer("write"):
+            results = self.jira_api.create_issues([{
+                "title": item["title"],
+                "issue_type": issue_type,
+                "description": item["description"],
+                "project_key": self.jira_project_key,
+                "fields": self._creation_fields(type, item)
+            } for type, item, issue_type in creations])
+
+        outcomes = []
+        for (type, item, issue_type), (jira_issue_id, error) in zip(creations, results):
+            if jira_issue_id is None:
+                logger.warning("Failed to create JIRA issue for Gitlab %s %s: %s", type, item["id"], error)
+                outcomes.append((item, OUTCOME_FAILED))
+            else:
+                outcomes.append((item, self._store_created(type, item, jira_issue_id, issue_type)))
+        return outcomes
+
+    def _creation_fields(self, type, item):
+        """
+        :return: the fields linking the JIRA issue of a Gitlab issue to its epic on creation, or None
+        """
+        epic_key = self.epic_key(item["id"]) if type == "issue" else None
+        if epic_key is None:
+            return None
+        return self.jira_api.epic_link_fields(epic_key, field=self.config.epic_link_field)
+
+    def _store_created(self, type, item, jira_issue_id, issue_type):
+        """
+        Maps a newly created JIRA issue and brings it to the status of the Gitlab issue
+        :return: OUTCOME_CREATED, or OUTCOME_FAILED if the status could not be set
+        """
+        # create a mapping between the JIRA and Gitlab issues
+        self.mapper.store_mapping(jira_issue=jira_issue_id, gitlab_issue=item["id"], type=type)
+        self.mapper.set_sync_state(item["id"], type, updated_at=item.get("updated_at"),
+                                   content_hash=self.content_hash(item), title=item["title"],
+                                   gitlab_ref=gitlab_ref(type, item),
+                                   epic_key=self.epic_key(item["id"]) if type == "issue" else None)
+        self.mapper.remove_pending_creation(item["id"], type)
+
+        if type == "issue" and not self._sync_status(item, jira_issue_id, issue_type):
+            return OUTCOME_FAILED
+        return OUTCOME_CREATED
+
+    def journal_creations(self, creations):
+        """
+        Journals creations in the mapping store before they are sent to JIRA, see reconcile_creations
+        :param creations: list of (type, gitlab_issue, issue_type, title) tuples
+        """
+        if not creations:
+            return
+        started_at = _jira_timestamp(datetime.now(timezone.utc))
+        self.mapper.add_pending_creations([{
+            "type": type,
+            "gitlab_issue": gitlab_issue,
+            "project_key": self.jira_project_key,
+            "issue_type": issue_type,
+            "title": title,
+            "started_at": started_at,
+            "scope": self._journal_scope(type)
+        } for type, gitlab_issue, issue_type, title in creations])
+
+    def _journal_scope(self, type):
+        """
+        :return: scope of the journaled creations of this sync; syncs of other groups or projects into the same
+                 JIRA project, e.g. other jobs of an orchestrated run, leave each other's creations alone
+        """
+        return self.epics_watermark if type == "epic" else self.issues_watermark
+
+    def reconcile_creations(self, type=None):
+        """
+        Resolves the creations journaled by an earlier run which stopped between creating JIRA issues and mapping
+        them. A pending item is mapped to an unmapped JIRA issue of the same summary and issue type created since
+        its creation started, instead of being created a second time; items without such an issue are dropped from
+        the journal and created again by the run. Only the creations journaled by syncs of the same group or project
+        are looked at, see _journal_scope.
+        :param type: only reconcile "epic" or "issue" creations, all if None
+        :return: number of mappings recovered
+        """
+        # creations journaled before scopes were recorded are reconciled by whichever sync meets them first
+        pending = [creation for creation in self.mapper.pending_creations()
+                   if creation["project_key"] == self.jira_project_key and type in (None, creation["type"])
+                   and creation.get("scope") in (None, self._journal_scope(creation["type"]))]
+        unresolved = []
+        for creation in pending:
+            if self.mapper.get_jira_issue(gitlab_issue=creation["gitlab_issue"], type=creation["type"]) is None:
+                unresolved.append(creation)
+            else:
+                # the mapping was written, only the journal entry was not
+                self.mapper.remove_pending_creation(creation["gitlab_issue"], creation["type"])
+
+        recovered = 0
+        if unresolved:
+            unresolved.sort(key=lambda creation: creation["started_at"])
+            since = datetime.strptime(unresolved[0]["started_at"], "%Y-%m-%dT%H:%M:%S.%f%z") - CLOCK_SKEW
+            candidates = [issue for issue in self.jira_api.iter_created_issues(self.jira_project_key,
+                                                                               _jira_timestamp(since))
+                          if self.mapper.get_gitlab_issue(issue.issue_key) is None]
+
+            for creation in unresolved:
+                match = next((issue for issue in candidates
+                              if issue.summary.strip() == (creation["title"] or "").strip()
+                              and issue.issue_type == creation["issue_type"]), None)
+                if match is not None:
+                    candidates.remove(match)
+                    self.mapper.store_mapping(jira_issue=match.issue_key, gitlab_issue=creation["gitlab_issue"],
+                                              type=creation["type"])
+                    logger.info("Recovered mapping of Gitlab %s %s to JIRA issue %s created by an interrupted run",
+                                creation["type"], creation["gitlab_issue"], match.issue_key)
+                    recovered += 1
+                self.mapper.remove_pending_creation(creation["gitlab_issue"], creation["type"])
+
+        if pending:
+            self.mapper.flush()
+        return recovered
+
+    def _start(self, watermark_name):
+        """
+        A run resumes from the checkpoint of an interrupted run if there is one; otherwise incremental runs start at
+        the watermark and full runs at the beginning
+        :return: tuple (Watermark of the run, `updated_at` to fetch from or None)
+        """
+        checkpoint = self.mapper.get_watermark(CHECKPOINT_PREFIX + watermark_name)
+        if checkpoint is not None:
+            logger.info("Resuming interrupted %s run from %s", watermark_name, checkpoint)
+            return Watermark(checkpoint), checkpoint
+        since = self.mapper.get_watermark(watermark_name) if self.incremental else None
+        return Watermark(since), since
+
+    def _finish(self, watermark_name, watermark):
+        """
+        Stores the watermark reached by a completed run and drops its checkpoint
+        """
+        stored = self.mapper.get_watermark(watermark_name)
+        if watermark.value is not None and (stored is None or watermark.value > stored):
+            self.mapper.set_watermark(watermark_name, watermark.value)
+        if self.mapper.get_watermark(CHECKPOINT_PREFIX + watermark_name) is not None:
+            self.mapper.set_watermark(CHECKPOINT_PREFIX + watermark_name, None)
+
+    def _reserve_creation(self, type):
+        """
+        Claims one of the creations allowed per run for the given item type
+        :return: True if the item may be created
+        """
+        limit = self.max_epics_created if type == "epic" else self.max_issues_created
+        with self._lock:
+            if self._created[type] >= limit:
+                return False
+            self._created[type] += 1
+            return True
 
-        if not labels:
-            raise "Gitlab issue labels not returned from API"
+    @staticmethod
+    def fetch_params(since):
+        # oldest changes first, so the watermark can only move forward while iterating
+        params = {"order_by": "updated_at", "sort": "asc"}
+        if since is not None:
+            params["updated_after"] = since
+        return params
 
-        for gitlab_label in labels:
+    @staticmethod
+    def content_hash(item):
+        """
+        Hash of the fields synced to JIRA, used to skip writes for items that did not change
+        """
+        content = json.dumps([item["title"], item["description"], sorted(item["labels"] or [])])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
 
-            for rule in self.config.rules:
-                if rule["type"] == "label_to_issue_type":
-                    if rule["label"] == gitlab_label:
-                        if issue_type is None:
-                            issue_type = rule["issue_type"]
-                        else:
-                            raise "Duplicate issue type mapping for label " + gitlab_label
+    def get_issue_type(self, gi):
 
-        return issue_type
+        if not gi["labels"]:
+            raise ValueError("Gitlab issue labels not returned from API")
 
-    def _get_issue_status(self, gi):
+        return self.config.get_issue_type(gi["labels"])
 
-        labels = gi["labels"]
-        status = None
+    def get_issue_status(self, gi):
 
-        if not labels:
-            raise "Gitlab issue labels not returned from API"
+        if not gi["labels"]:
+            raise ValueError("Gitlab issue labels not returned from API")
 
-        for gitlab_label in labels:
+        return self.config.get_status(gi["labels"])
 
-            for rule in self.config.rules:
-                if rule["type"] == "label_to_status":
-                    if rule["label"] == gitlab_label:
-                        if status is None:
-                            status = rule["status"]
-                        else:
-                            raise "Duplicate issue status mapping for label " + gitlab_label
 
-        return status
+def gitlab_ref(type, item):
+    """
+    :return: reference of a Gitlab item, `<project_id>#<iid>` for issues and `<group_id>&<iid>` for epics,
+             or None if the item dictionary lacks the IDs
+    """
+    parent = item.get("group_id") if type == "epic" else item.get("project_id")
+    if parent is None or item.get("iid") is None:
+        return None
+    return f"{parent}{'&' if type == 'epic' else '#'}{item['iid']}"
+
+
+def _jira_timestamp(value):
+    """
+    :return: the datetime in the timestamp format of JIRA, e.g. `2024-05-01T12:30:00.000+0000`
+    """
+    return value.strftime("%Y-%m-%dT%H:%M:%S.") + f"{value.microsecond // 1000:03d}" + value.strftime("%z")
+
+
+class Watermark:
+    """
+    Highest `updated_at` up to which all items of a run were synced. Items arrive sorted by `updated_at` and may
+    complete out of order, so the watermark only moves over the contiguous prefix of completed items. Once an item
+    could not be synced it stops moving, and the item is fetched again by the next incremental run.
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self._completed = {}
+        self._next_position = 0
+        self._held = False
+        self._lock = threading.Lock()
+
+    def complete(self, position, updated_at, synced):
+        with self._lock:
+            if self._held:
+                return
+            self._completed[position] = (updated_at, synced)
+            while self._next_position in self._completed:
+                updated_at, synced = self._completed.pop(self._next_position)
+                if not synced:
+                    self._held = True
+                    self._completed.clear()
+                    return
+                if updated_at is not None and (self.value is None or updated_at > self.value):
+                    self.value = updated_at
+                self._next_position += 1
@@ -0,0 +1,182 @@
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from config_reader import Config  # noqa: E402
+from gitlab_api import GitlabItem  # noqa: E402
+from issue_mapping import IssueMapper  # noqa: E402
+from jira_api import JiraIssue  # noqa: E402
+
+GROUP = "group"
+PROJECT = "project"
+GROUP_ID = 100
+SUBGROUP_ID = 101
+PROJECT_ID = 200
+JIRA_PROJECT = "TEST"
+
+CONFIG = {
+    "gitlab_to_jira": {
+        "jira_project_key": JIRA_PROJECT,
+        "rules": [
+            {"type": "label_to_issue_type", "label": "type::story", "issue_type": "Story"},
+            {"type": "label_to_status", "label": "status::doing", "status": "In Progress"}
+        ],
+        "filters": [{"issue_type": "epic", "label": None}]
+    }
+}
+
+_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def timestamp(seconds):
+    return (_START + timedelta(seconds=seconds)).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def epic(item_id, title=None, group_id=GROUP_ID):
+    return GitlabItem(id=item_id, iid=item_id, title=title or f"Epic {item_id}", description="", labels=[],
+                      updated_at=timestamp(item_id), group_id=group_id)
+
+
+def issue(item_id, labels=("type::story",), title=None):
+    return GitlabItem(id=item_id, iid=item_id, title=title or f"Issue {item_id}", description="",
+                      labels=list(labels), updated_at=timestamp(item_id), project_id=PROJECT_ID)
+
+
+class FakeGitlab:
+    """
+    The listing calls of GitlabApi the Synchronizer makes, over in-memory epics and issues
+    """
+
+    def __init__(self, epics=(), issues=()):
+        self.epics = list(epics)
+        self.issues = list(issues)
+        self.epic_issues = {}
+        self.scanned = []
+
+    def iter_epics(self, group_id, params=None, lean=False):
+        return iter(self._select(self.epics, params))
+
+    def iter_issues(self, group_name, project_name, params=None, lean=False):
+        return iter(self._select(self.issues, params))
+
+    def get_project_id(self, group_id, project_name):
+        return PROJECT_ID
+
+    def get_group_id(self, group):
+        return GROUP_ID if group == GROUP else None
+
+    def get_subgroup_ids(self, group):
+        return {SUBGROUP_ID} if group == GROUP else set()
+
+    def get_epic(self, group_id, epic_iid):
+        epic = next(epic for epic in self.epics if epic["group_id"] == group_id and epic["iid"] == epic_iid)
+        return epic.to_dict()
+
+    def iter_epic_issues(self, group_id, epic_iid, params=None):
+        self.scanned.append(epic_iid)
+        return iter({"id": item_id, "project_id": PROJECT_ID} for item_id in self.epic_issues.get(epic_iid, ()))
+
+    @staticmethod
+    def _select(items, params):
+        since = (params or {}).get("updated_after")
+        items = sorted(items, key=lambda item: item["updated_at"])
+        return [item for item in items if since is None or item["updated_at"] >= since]
+
+
+class FakeJira:
+    """
+    The JiraApi calls the Synchronizer makes, creating issues in memory. Creations of the titles in `fail` return
+    an error, those in `crash` raise like a lost connection, and those in `lost` raise after the issue was created,
+    like a response lost on the way back.
+    """
+
+    def __init__(self):
+        self.issues = {}
+        self.fail = set()
+        self.crash = set()
+        self.lost = set()
+
+    def create_issue(self, title, issue_type, description, project_key, issue_id=None, fields=None):
+        if issue_id is not None:
+            return issue_id
+        if title in self.crash:
+            raise ConnectionError(f"connection lost creating {title}")
+        if title in self.fail:
+            return None
+        key = self._add(title, issue_type, project_key, fields)
+        if title in self.lost:
+            raise ConnectionError(f"response lost creating {title}")
+        return key
+
+    def create_issues(self, issues):
+        results = []
+        for i in issues:
+            if i["title"] in self.crash:
+                raise ConnectionError(f"connection lost creating {i['title']}")
+            if i["title"] in self.fail:
+                results.append((None, "summary: rejected"))
+            else:
+                results.append((self._add(i["title"], i["issue_type"], i["project_key"], i.get("fields")), None))
+        return results
+
+    def iter_created_issues(self, project_key, since):
+        return (JiraIssue(key, "To Do", data["summary"], issue_type=data["issue_type"])
+                for key, data in self.issues.items() if data["project_key"] == project_key)
+
+    def get_issues_by_key(self, issue_keys):
+        return {key: JiraIssue(key, self.issues[key]["status"], self.issues[key]["summary"],
+                               issue_type=self.issues[key]["issue_type"]) for key in issue_keys if key in self.issues}
+
+    def update_issue_status(self, issue_key, new_status_name, issue_type=None, current_status=None):
+        self.issues[issue_key]["status"] = new_status_name
+        return True
+
+    def set_epic_link(self, issue_key, epic_key, field="parent"):
+        self.issues[issue_key]["epic"] = epic_key
+
+    @staticmethod
+    def epic_link_fields(epic_key, field="parent"):
+        return {field: epic_key}
+
+    def _add(self, title, issue_type, project_key, fields):
+        key = f"{project_key}-{len(self.issues) + 1}"
+        self.issues[key] = {"summary": title, "issue_type": issue_type, "project_key": project_key,
+                            "status": "To Do", "epic": (fields or {}).get("parent")}
+        return key
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(CONFIG), encoding="utf-8")
+    return Config(str(path))
+
+
+@pytest.fixture(params=["csv", "db"])
+def mapping_path(request, tmp_path):
+    """
+    Path of a mapping store, once for each backend
+    """
+    return str(tmp_path / f"mapping.{request.param}")
+
+
+@pytest.fixture
+def open_mapper(mapping_path):
+    mappers = []
+
+    def open_mapper():
+        mapper = IssueMapper.from_path(mapping_path, batch_size=5)
+        mappers.append(mapper)
+        return mapper
+
+    yield open_mapper
+    for mapper in mappers:
+        try:
+            mapper.close()
+        except Exception:
+            pass
@@ -0,0 +1,226 @@
+import pytest
+
+from conftest import GROUP, JIRA_PROJECT, PROJECT, FakeGitlab, FakeJira, epic, timestamp
+from issue_mapping import IssueMapper
+from mapping_store import CsvMappingStore, SqliteMappingStore, import_csv
+from synchronizer import CHECKPOINT_PREFIX, OUTCOME_CREATED, OUTCOME_FAILED, Synchronizer, Watermark
+
+EPICS_WATERMARK = "epics:" + GROUP
+
+
+def make_sync(jira, gitlab, config, mapper, project=PROJECT, **options):
+    sync = Synchronizer(jira, gitlab, GROUP, project, config, mapper=mapper, incremental=True, **options)
+    sync.max_epics_created = sync.max_issues_created = 1000
+    return sync
+
+
+def jira_titles(jira):
+    return sorted(data["summary"] for data in jira.issues.values())
+
+
+class TestWatermark:
+
+    def test_advances_over_the_contiguous_prefix_of_completed_items(self):
+        watermark = Watermark(None)
+        watermark.complete(1, timestamp(2), True)
+        assert watermark.value is None
+        watermark.complete(0, timestamp(1), True)
+        assert watermark.value == timestamp(2)
+        watermark.complete(3, timestamp(4), True)
+        assert watermark.value == timestamp(2)
+        watermark.complete(2, timestamp(3), True)
+        assert watermark.value == timestamp(4)
+
+    def test_stops_at_the_first_item_not_synced(self):
+        watermark = Watermark(timestamp(0))
+        watermark.complete(0, timestamp(1), True)
+        watermark.complete(2, timestamp(3), True)
+        watermark.complete(1, timestamp(2), False)
+        watermark.complete(3, timestamp(4), True)
+        assert watermark.value == timestamp(1)
+
+    def test_items_without_timestamp_keep_the_value(self):
+        watermark = Watermark(timestamp(5))
+        watermark.complete(0, None, True)
+        assert watermark.value == timestamp(5)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_interrupted_run_resumes_from_its_checkpoint(config, open_mapper, workers):
+    jira, gitlab = FakeJira(), FakeGitlab(epics=[epic(i) for i in range(1, 11)])
+    jira.crash.add("Epic 6")
+    mapper = open_mapper()
+
+    with pytest.raises(ConnectionError):
+        make_sync(jira, gitlab, config, mapper, workers=workers).sync_epics()
+    checkpoint = mapper.get_watermark(CHECKPOINT_PREFIX + EPICS_WATERMARK)
+    # with several workers, the crash may come before any item completed
+    assert checkpoint is not None or workers > 1
+    assert checkpoint is None or checkpoint <= timestamp(5)
+    assert mapper.get_watermark(EPICS_WATERMARK) is None
+
+    # a new process picks up the checkpoint from the store
+    mapper.close()
+    mapper = open_mapper()
+    jira.crash.clear()
+    counts = make_sync(jira, gitlab, config, mapper, workers=workers).sync_epics()
+
+    # only the items from the checkpoint on are fetched again
+    assert counts["retrieved"] == sum(1 for i in range(1, 11) if checkpoint is None or timestamp(i) >= checkpoint)
+    assert jira_titles(jira) == sorted(f"Epic {i}" for i in range(1, 11))
+    assert mapper.get_watermark(CHECKPOINT_PREFIX + EPICS_WATERMARK) is None
+    assert mapper.get_watermark(EPICS_WATERMARK) == timestamp(10)
+    assert mapper.pending_creations() == []
+
+
+def test_issue_created_before_a_crash_is_mapped_not_created_again(config, open_mapper):
+    jira, gitlab = FakeJira(), FakeGitlab(epics=[epic(i) for i in range(1, 6)])
+    jira.lost.add("Epic 3")
+    mapper = open_mapper()
+
+    with pytest.raises(ConnectionError):
+        make_sync(jira, gitlab, config, mapper).sync_epics()
+    assert len(jira.issues) == 3
+    assert mapper.get_jira_issue(3, "epic") is None
+
+    mapper.close()
+    mapper = open_mapper()
+    jira.lost.clear()
+    make_sync(jira, gitlab, config, mapper).sync_epics()
+
+    assert jira_titles(jira) == sorted(f"Epic {i}" for i in range(1, 6))
+    assert jira.issues[mapper.get_jira_issue(3, "epic")]["summary"] == "Epic 3"
+    assert mapper.pending_creations() == []
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_bulk_creation_with_a_rejected_item(config, open_mapper, workers):
+    jira, gitlab = FakeJira(), FakeGitlab(epics=[epic(i) for i in range(1, 11)])
+    jira.fail.add("Epic 4")
+    mapper = open_mapper()
+
+    counts = make_sync(jira, gitlab, config, mapper, workers=workers, bulk_create=True).sync_epics()
+
+    assert counts[OUTCOME_CREATED] == 9 and counts[OUTCOME_FAILED] == 1
+    assert mapper.get_jira_issue(4, "epic") is None
+    assert all(mapper.get_jira_issue(i, "epic") is not None for i in range(1, 11) if i != 4)
+    # the rejected item is fetched again by the next run
+    assert mapper.get_watermark(EPICS_WATERMARK) == timestamp(3)
+
+    jira.fail.clear()
+    counts = make_sync(jira, gitlab, config, mapper, workers=workers, bulk_create=True).sync_epics()
+
+    assert counts[OUTCOME_CREATED] == 1
+    assert jira_titles(jira) == sorted(f"Epic {i}" for i in range(1, 11))
+    assert mapper.get_watermark(EPICS_WATERMARK) == timestamp(10)
+    assert mapper.pending_creations() == []
+
+
+class TestReconcileCreations:
+
+    def journal(self, sync, gitlab_issue, title, type="issue"):
+        sync.journal_creations([(type, gitlab_issue, "Story", title)])
+
+    def test_maps_an_unmapped_issue_with_the_same_summary(self, config, open_mapper):
+        jira, mapper = FakeJira(), open_mapper()
+        sync = make_sync(jira, FakeGitlab(), config, mapper)
+        self.journal(sync, 1, "Created")
+        self.journal(sync, 2, "Never created")
+        created = jira.create_issue("Created", "Story", "", JIRA_PROJECT)
+
+        assert sync.reconcile_creations() == 1
+        assert mapper.get_jira_issue(1, "issue") == created
+        assert mapper.get_jira_issue(2, "issue") is None
+        assert mapper.pending_creations() == []
+
+    def test_ignores_a_mapped_issue_and_another_issue_type(self, config, open_mapper):
+        jira, mapper = FakeJira(), open_mapper()
+        sync = make_sync(jira, FakeGitlab(), config, mapper)
+        mapper.store_mapping(jira.create_issue("Title", "Story", "", JIRA_PROJECT), 9, "issue")
+        jira.create_issue("Title", "Bug", "", JIRA_PROJECT)
+        self.journal(sync, 1, "Title")
+
+        assert sync.reconcile_creations() == 0
+        assert mapper.get_jira_issue(1, "issue") is None
+
+    def test_leaves_the_creations_of_other_projects_alone(self, config, open_mapper):
+        jira, mapper = FakeJira(), open_mapper()
+        creating = make_sync(jira, FakeGitlab(), config, mapper, project="other")
+        starting = make_sync(jira, FakeGitlab(), config, mapper)
+        self.journal(creating, 1, "In flight")
+        created = jira.create_issue("In flight", "Story", "", JIRA_PROJECT)
+
+        assert starting.reconcile_creations() == 0
+        assert len(mapper.pending_creations()) == 1
+
+        assert creating.reconcile_creations() == 1
+        assert mapper.get_jira_issue(1, "issue") == created
+
+
+class TestJournal:
+
+    CREATION = {"type": "issue", "gitlab_issue": 1, "project_key": JIRA_PROJECT, "issue_type": "Story",
+                "title": "Title", "started_at": "2024-01-01T00:00:00.000+0000", "scope": "issues:group/project"}
+
+    def test_pending_creations_survive_a_restart(self, open_mapper):
+        mapper = open_mapper()
+        mapper.add_pending_creations([self.CREATION, dict(self.CREATION, gitlab_issue=2)])
+        # journaled without a flush, as the process may stop right after
+        del mapper
+
+        pending = open_mapper().pending_creations()
+        assert sorted(creation["gitlab_issue"] for creation in pending) == ["1", "2"]
+        assert pending[0]["scope"] == "issues:group/project"
+
+    def test_resolved_creations_are_gone_after_a_restart(self, open_mapper):
+        mapper = open_mapper()
+        mapper.add_pending_creations([self.CREATION, dict(self.CREATION, gitlab_issue=2)])
+        mapper.remove_pending_creation(1, "issue")
+        mapper.flush()
+        mapper.close()
+
+        assert [creation["gitlab_issue"] for creation in open_mapper().pending_creations()] == ["2"]
+
+    def test_creation_journaled_again_before_the_flush_is_kept(self, open_mapper):
+        mapper = open_mapper()
+        mapper.add_pending_creations([self.CREATION])
+        mapper.remove_pending_creation(1, "issue")
+        mapper.add_pending_creations([self.CREATION])
+        mapper.flush()
+        mapper.close()
+
+        assert [creation["gitlab_issue"] for creation in open_mapper().pending_creations()] == ["1"]
+
+    def test_attachments_survive_a_restart(self, open_mapper):
+        mapper = open_mapper()
+        mapper.add_attachment("TEST-1", "secret/a.png", "hash-a", 10, "a.png")
+        # recorded without a flush, as the process may stop right after the upload
+        del mapper
+        mapper = open_mapper()
+        mapper.add_attachment("TEST-1", "secret/b.png", "hash-b", 11, "b.png")
+        mapper.flush()
+        mapper.close()
+
+        mapper = open_mapper()
+        assert mapper.get_attachment("TEST-1", source="secret/a.png")["filename"] == "a.png"
+        assert mapper.get_attachment("TEST-1", content_hash="hash-b")["filename"] == "b.png"
+
+
+def test_import_csv_keeps_attachments_watermarks_and_pending_creations(tmp_path):
+    csv_path = str(tmp_path / "mapping.csv")
+    source = CsvMappingStore(csv_path)
+    source.add_mapping("TEST-1", 1, "epic")
+    source.set_sync_state(1, "epic", title="Epic 1")
+    source.set_watermark(EPICS_WATERMARK, timestamp(1))
+    source.add_attachment("TEST-1", "secret/file.png", "hash", 10, "file.png")
+    source.add_pending_creations([dict(TestJournal.CREATION, gitlab_issue=2)])
+    source.close()
+
+    with SqliteMappingStore(str(tmp_path / "mapping.db")) as target:
+        assert import_csv(csv_path, target) == 1
+        mapper = IssueMapper(store=target)
+        assert mapper.get_jira_issue(1, "epic") == "TEST-1"
+        assert mapper.get_sync_state(1, "epic")["title"] == "Epic 1"
+        assert mapper.get_watermark(EPICS_WATERMARK) == timestamp(1)
+        assert mapper.get_attachment("TEST-1", content_hash="hash")["attachment_id"] == "10"
+        assert [creation["gitlab_issue"] for creation in mapper.pending_creations()] == ["2"]
@@ -0,0 +1,116 @@
+import json
+
+import pytest
+
+from conftest import CONFIG, GROUP, PROJECT, FakeGitlab, FakeJira, epic, issue, timestamp
+from config_reader import Config
+from orchestrator import SyncOrchestrator
+from sync_plan import ACTION_CREATE, ACTION_LINK, ACTION_NOOP, PlanExecutor, SyncPlanner
+from synchronizer import Synchronizer
+
+
+@pytest.fixture
+def linking_config(tmp_path):
+    path = tmp_path / "linking_config.json"
+    data = {"gitlab_to_jira": dict(CONFIG["gitlab_to_jira"], epic_link_field="parent")}
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return Config(str(path))
+
+
+def make_sync(jira, gitlab, config, mapper):
+    sync = Synchronizer(jira, gitlab, GROUP, PROJECT, config, mapper=mapper, incremental=True)
+    sync.max_epics_created = sync.max_issues_created = 1000
+    return sync
+
+
+def epic_of(jira, mapper, gitlab_issue):
+    return jira.issues[mapper.get_jira_issue(gitlab_issue, "issue")]["epic"]
+
+
+def test_issues_are_not_linked_unless_configured(config, open_mapper):
+    jira, gitlab = FakeJira(), FakeGitlab(epics=[epic(1)], issues=[issue(11)])
+    gitlab.epic_issues = {1: [11]}
+    mapper = open_mapper()
+    make_sync(jira, gitlab, config, mapper).sync_epics()
+    make_sync(jira, gitlab, config, mapper).sync_issues()
+
+    assert gitlab.scanned == []
+    assert epic_of(jira, mapper, 11) is None
+
+
+def test_only_the_epics_updated_since_the_last_scan_are_scanned_again(linking_config, open_mapper):
+    jira, gitlab = FakeJira(), FakeGitlab(epics=[epic(1), epic(2)], issues=[issue(11), issue(12), issue(13)])
+    gitlab.epic_issues = {1: [11, 12], 2: [13]}
+    mapper = open_mapper()
+    make_sync(jira, gitlab, linking_config, mapper).sync_epics()
+    epic_keys = {i: mapper.get_jira_issue(i, "epic") for i in (1, 2)}
+
+    make_sync(jira, gitlab, linking_config, mapper).sync_issues()
+    assert sorted(gitlab.scanned) == [1, 2]
+    assert [epic_of(jira, mapper, i) for i in (11, 12, 13)] == [epic_keys[1], epic_keys[1], epic_keys[2]]
+
+    # another project job of the group, or the next run, reuses the recorded epic issues
+    gitlab.scanned.clear()
+    make_sync(jira, gitlab, linking_config, mapper).sync_issues()
+    assert gitlab.scanned == [2]
+
+    # moving an issue to another epic updates that epic
+    gitlab.scanned.clear()
+    gitlab.epic_issues = {1: [11], 2: [12, 13]}
+    gitlab.epics[1] = epic(2)
+    gitlab.epics[1].updated_at = timestamp(30)
+    counts = make_sync(jira, gitlab, linking_config, mapper).sync_issues()
+    assert gitlab.scanned == [2]
+    assert counts["linked"] == 1
+    assert [epic_of(jira, mapper, i) for i in (11, 12, 13)] == [epic_keys[1], epic_keys[2], epic_keys[2]]
+
+
+def test_planned_run_links_created_and_mapped_issues(linking_config, open_mapper):
+    jira, gitlab = FakeJira(), FakeGitlab(epics=[epic(1), epic(2)], issues=[issue(11), issue(12)])
+    gitlab.epic_issues = {1: [11, 12]}
+    mapper = open_mapper()
+    make_sync(jira, gitlab, linking_config, mapper).sync_epics()
+    epic_keys = {i: mapper.get_jira_issue(i, "epic") for i in (1, 2)}
+    make_sync(jira, gitlab, linking_config, mapper).sync_issues()
+
+    # issue 12 moves to epic 2 and issue 13 is added to it
+    gitlab.issues.append(issue(13))
+    gitlab.epic_issues = {1: [11], 2: [12, 13]}
+    gitlab.epics[1].updated_at = timestamp(30)
+    sync = make_sync(jira, gitlab, linking_config, mapper)
+    sync.incremental = False
+    plan = SyncPlanner(sync).plan()
+
+    actions = {change["gitlab_issue"]: change["action"] for change in plan.changes if change["type"] == "issue"}
+    assert actions == {11: ACTION_NOOP, 12: ACTION_LINK, 13: ACTION_CREATE}
+    assert plan.estimated_requests()["link"] == 1
+
+    counts = PlanExecutor(sync).execute(plan)
+    assert counts["linked"] == 1 and counts["created"] == 1
+    assert [epic_of(jira, mapper, i) for i in (11, 12, 13)] == [epic_keys[1], epic_keys[2], epic_keys[2]]
+    assert mapper.get_sync_state(13, "issue")["epic_key"] == epic_keys[2]
+
+
+def test_orchestrated_run_scans_the_epics_of_a_group_once(linking_config, open_mapper):
+    jira, gitlab = FakeJira(), FakeGitlab(epics=[epic(1), epic(2), epic(3)], issues=[issue(11), issue(12)])
+    gitlab.epic_issues = {1: [11], 2: [12]}
+    jobs = [{"gitlab_group": GROUP, "gitlab_project": f"project{i}", "jira_project_key": "TEST"} for i in range(5)]
+
+    # not incremental, like the default run
+    results = SyncOrchestrator(jira, gitlab, linking_config, open_mapper(), jobs=jobs, include_issues=True).run()
+
+    assert all(result.succeeded for result in results)
+    assert sorted(gitlab.scanned) == [1, 2, 3]
+
+
+def test_recording_an_issue_under_another_epic_moves_it(open_mapper):
+    mapper = open_mapper()
+    mapper.set_epic_issues(1, [(11, 200), (12, 200)])
+    mapper.set_epic_issues(2, [(13, 200)])
+    mapper.set_epic_issues(2, [(12, 200), (13, 200)])
+    mapper.set_epic_issues(1, [(11, 200)])
+    mapper.flush()
+    mapper.close()
+
+    recorded = {gitlab_issue: epic_id for epic_id, gitlab_issue, _ in open_mapper().epic_issues()}
+    assert recorded == {"11": "1", "12": "2", "13": "2"}
@@ -0,0 +1,77 @@
+import json
+import time
+import urllib.request
+
+import pytest
+
+from conftest import GROUP, GROUP_ID, PROJECT, PROJECT_ID, SUBGROUP_ID, FakeGitlab, FakeJira, epic, timestamp
+from synchronizer import Synchronizer
+from webhook_server import WebhookService
+
+
+def issue_event(issue_id, title, project_id=PROJECT_ID):
+    return {"object_kind": "issue", "labels": [{"title": "type::story"}],
+            "object_attributes": {"id": issue_id, "iid": issue_id, "project_id": project_id, "title": title,
+                                  "description": "", "updated_at": timestamp(issue_id)}}
+
+
+def epic_event(epic_id, group_id=GROUP_ID):
+    return {"object_kind": "epic", "labels": [],
+            "object_attributes": {"id": epic_id, "iid": epic_id, "group_id": group_id, "title": f"Epic {epic_id}",
+                                  "description": "", "updated_at": timestamp(epic_id)}}
+
+
+def work_item_epic_event(work_item_id, iid, group_id=GROUP_ID):
+    return {"object_kind": "work_item", "labels": [],
+            "object_attributes": {"id": work_item_id, "iid": iid, "type": "Epic", "namespace_id": group_id,
+                                  "title": f"Epic {iid}", "description": ""}}
+
+
+def post(service, payload):
+    request = urllib.request.Request(f"http://127.0.0.1:{service.port}/", data=json.dumps(payload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(request) as response:
+        return response.status
+
+
+@pytest.fixture
+def webhook(config, open_mapper):
+    jira = FakeJira()
+    gitlab = FakeGitlab(epics=[epic(1), epic(2, group_id=SUBGROUP_ID)])
+    sync = Synchronizer(jira, gitlab, GROUP, PROJECT, config, mapper=open_mapper())
+    service = WebhookService(sync, port=0, delay=0.3).start()
+    yield service, jira
+    service.stop()
+
+
+def wait_for_syncs(service, count, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = service.stats()
+        if stats["synced"] + stats["failed"] >= count and stats["queued"] == 0:
+            return stats
+        time.sleep(0.05)
+    raise AssertionError(f"only {service.stats()} after {timeout}s")
+
+
+def test_duplicate_events_are_synced_once(webhook):
+    service, jira = webhook
+    payloads = [
+        issue_event(11, "First title"), issue_event(11, "Second title"), issue_event(11, "Last title"),
+        # the same epic, reported by epic and by work item events
+        epic_event(1), work_item_epic_event(901, 1),
+        epic_event(2, group_id=SUBGROUP_ID),
+        # another project and another group
+        issue_event(12, "Foreign issue", project_id=999), epic_event(3, group_id=999)
+    ]
+    assert all(post(service, payload) == 202 for payload in payloads)
+
+    wait_for_syncs(service, 3)
+    # longer than the coalescing delay, so a second sync of an item would have happened
+    time.sleep(0.5)
+    stats = service.stats()
+
+    assert stats["received"] == len(payloads)
+    assert stats["ignored"] == 2
+    assert stats["synced"] == 3 and stats["failed"] == 0
+    assert sorted(data["summary"] for data in jira.issues.values()) == ["Epic 1", "Epic 2", "Last title"]
@@ -0,0 +1,281 @@
+import hmac
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from gitlab_api import GitlabItem
+from synchronizer import OUTCOME_FAILED, Synchronizer
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescingQueue:
+    """
+    Queue of pending item syncs keyed by item. An event for an item already waiting replaces the queued payload
+    instead of adding a second entry, and postpones it by `delay` seconds, so a burst of edits results in one sync of
+    the latest state. An item is delayed by at most `max_delay` seconds after its first event. An item handed out by
+    get() is not handed out again until task_done() was called for it, so one item is never synced twice at once.
+    """
+
+    def __init__(self, delay=2.0, max_delay=30.0):
+        self.delay = delay
+        self.max_delay = max_delay
+        self._items = {}
+        self._in_progress = set()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def put(self, key, payload):
+        now = time.monotonic()
+        with self._condition:
+            if key in self._items:
+                first_seen, _, _ = self._items[key]
+            else:
+                first_seen = now
+            due = min(now + self.delay, first_seen + self.max_delay)
+            self._items[key] = (first_seen, due, payload)
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Waits for the next item whose delay has passed
+        :return: tuple (key, payload), or None on timeout or when the queue was closed
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while not self._closed:
+                now = time.monotonic()
+                ready = [(due, key) for key, (_, due, _) in self._items.items() if key not in self._in_progress]
+                if ready:
+                    due, key = min(ready, key=lambda entry: entry[0])
+                    if due <= now:
+                        _, _, payload = self._items.pop(key)
+                        self._in_progress.add(key)
+                        return key, payload
+                    wait = due - now
+                else:
+                    wait = None
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._condition.wait(wait)
+            return None
+
+    def task_done(self, key):
+        with self._condition:
+            self._in_progress.discard(key)
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._items)
+
+
+def parse_event(payload):
+    """
+    Turns a Gitlab issue, epic or work item webhook payload into the item shape returned by the REST API.
+
+    The ID of an epic work item is its work item ID, not the ID of the legacy epic which the epic API and the
+    mapping use, so the `id` of such an epic is None; it is looked up by group and IID before the sync, see
+    WebhookService.
+    :return: tuple ("issue" or "epic", item dictionary), or None for events which are not synced
+    """
+    kind = payload.get("object_kind")
+    attributes = payload.get("object_attributes") or {}
+
+    work_item_epic = kind == "work_item" and attributes.get("type") == "Epic"
+    if kind == "work_item":
+        kind = "epic" if work_item_epic else "issue"
+    if kind not in ("issue", "epic") or "id" not in attributes:
+        return None
+    if work_item_epic and (attributes.get("iid") is None or attributes.get("namespace_id") is None):
+        return None
+
+    labels = payload.get("labels")
+    if labels is None:
+        labels = attributes.get("labels", [])
+
+    return kind, {
+        "id": None if work_item_epic else attributes["id"],
+        "iid": attributes.get("iid"),
+        "project_id": attributes.get("project_id"),
+        "group_id": attributes.get("namespace_id") if work_item_epic else attributes.get("group_id"),
+        "title": attributes.get("title"),
+        "description": attributes.get("description"),
+        "labels": [label["title"] if isinstance(label, dict) else label for label in labels],
+        "state": attributes.get("state"),
+        "updated_at": attributes.get("updated_at")
+    }
+
+
+def in_scope(synchronizer: Synchronizer, kind, item):
+    """
+    :return: True if the item belongs to the group (epics), one of its subgroups, like the epics of a full sync, or
+             the project (issues) the Synchronizer syncs
+    """
+    gitlab_api = synchronizer.gitlab_api
+    if kind == "epic":
+        if item.get("group_id") is None:
+            return False
+        return (item["group_id"] == gitlab_api.get_group_id(synchronizer.gitlab_group) or
+                item["group_id"] in gitlab_api.get_subgroup_ids(synchronizer.gitlab_group))
+    if synchronizer.gitlab_project is None or item.get("project_id") is None:
+        return False
+    return item["project_id"] == gitlab_api.get_project_id(synchronizer.gitlab_group, synchronizer.gitlab_project)
+
+
+def _event_key(kind, item):
+    # an epic is reported both by epic and by work item events, with different IDs but the same group and IID
+    if kind == "epic" and item.get("group_id") is not None and item.get("iid") is not None:
+        return kind, item["group_id"], item["iid"]
+    return kind, item["id"]
+
+
+class WebhookService:
+    """
+    Receives Gitlab webhooks and syncs each changed issue or epic on its own, through Synchronizer.sync_item.
+
+    Events are deduplicated and coalesced per item by a CoalescingQueue and applied by `workers` threads. Requests
+    are answered as soon as the event is queued, so Gitlab never waits on JIRA.
+    """
+
+    def __init__(self, synchronizer_for, host="127.0.0.1", port=8080, secret_token=None, workers=1, delay=2.0):
+        """
+        :param synchronizer_for: a Synchronizer, which ignores events of other groups and projects, or a function
+                                 returning the Synchronizer for a webhook payload (e.g. chosen by project) or None
+                                 to ignore the event
+        :param host: interface to listen on
+        :param port: port to listen on, 0 picks a free one
+        :param secret_token: expected value of the X-Gitlab-Token header, not checked if None
+        :param workers: number of threads applying queued events
+        :param delay: seconds an item waits for further events before it is synced
+        """
+        if isinstance(synchronizer_for, Synchronizer):
+            synchronizer = synchronizer_for
+
+            def synchronizer_for(payload):
+                event = parse_event(payload)
+                return synchronizer if event is not None and in_scope(synchronizer, *event) else None
+        self.synchronizer_for = synchronizer_for
+        self.secret_token = secret_token
+        self.queue = CoalescingQueue(delay=delay)
+        self.workers = workers
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._threads = []
+        self._counters = {"received": 0, "ignored": 0, "synced": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        """
+        Starts the HTTP server and the workers in background threads
+        """
+        self._threads = [threading.Thread(target=self.server.serve_forever, daemon=True)]
+        self._threads += [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        logger.info("Listening for Gitlab webhooks on port %d", self.port)
+        return self
+
+    def serve_forever(self):
+        self.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.queue.close()
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, queued=len(self.queue))
+
+    def accept(self, payload):
+        """
+        Queues the sync of the item a webhook payload refers to
+        :return: True if the event was queued
+        """
+        self._count("received")
+        event = parse_event(payload)
+        synchronizer = self.synchronizer_for(payload) if event is not None else None
+        if synchronizer is None:
+            self._count("ignored")
+            return False
+
+        kind, item = event
+        self.queue.put((id(synchronizer), *_event_key(kind, item)), (synchronizer, kind, item))
+        return True
+
+    def _work(self):
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                return
+            key, (synchronizer, kind, item) = entry
+            try:
+                if item["id"] is None:
+                    # an epic work item, synced as the legacy epic with the same group and IID
+                    item = GitlabItem.from_json(synchronizer.gitlab_api.get_epic(item["group_id"], item["iid"]))
+                outcome = synchronizer.sync_item(kind, item)
+                logger.info("Webhook sync of Gitlab %s %s: %s", kind, item["id"], outcome)
+                self._count("failed" if outcome == OUTCOME_FAILED else "synced")
+            except Exception as e:
+                logger.warning("Webhook sync of Gitlab %s %s failed: %s", kind, item["id"] or item["iid"], e)
+                self._count("failed")
+            finally:
+                self.queue.task_done(key)
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _handler_class(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                token = self.headers.get("X-Gitlab-Token", "")
+                if service.secret_token is not None and not hmac.compare_digest(token, service.secret_token):
+                    self._reply(401)
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    payload = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self._reply(400)
+                    return
+                if not isinstance(payload, dict):
+                    self._reply(400)
+                    return
+                service.accept(payload)
+                self._reply(202)
+
+            def _reply(self, status):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler